@@ -0,0 +1,408 @@
+import os
+import sys
+import base64
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# Garantir que o diretório `src` esteja no path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models import model_registry                                   # noqa: E402
+from models.vision_model_clip import CLIPAIModel                    # noqa: E402
+from pipeline.image_io import to_pil, encode_image, DISPLAY_MAX_SIDE  # noqa: E402
+from pipeline.result_cache import EXCLUDED_KEYS, content_hash       # noqa: E402
+from pipeline.embedding_store import (                              # noqa: E402
+    EmbeddingStore, DEFAULT_STORE_DIR, FAKE_LABEL, REAL_LABEL,
+)
+from pipeline.scheduler import MicroBatchScheduler, SchedulerFull   # noqa: E402
+from pipeline.hedging import HedgedRunner                           # noqa: E402
+from pipeline.jobs import JobStore                                  # noqa: E402
+from pipeline import telemetry                                      # noqa: E402
+from pipeline.explanation_cache import ExplanationCache, explanation_key, evidence_hash  # noqa: E402
+
+# Modo da rota -> estágios do CLIPAIModel. Os três compartilham os pesos via model_registry.
+MODES = {
+    "classify": ("classify",),
+    "concepts": ("classify", "concepts"),
+    "defect-map": ("classify", "concepts", "segment"),
+}
+COLORS = ("red", "green", "blue")
+COLOR_NAMES_PT = {"red": "Vermelha", "green": "Verde", "blue": "Azul"}
+
+NEMOTRON_LABEL = "NVIDIA Nemotron-12B (Via API)"
+LLAVA_LABEL = "LLaVA-7B (Local Ollama)"
+
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MEGATRUTH_API_MAX_IMAGES", "64"))
+MAX_BATCH_SIZE = int(os.getenv("MEGATRUTH_MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("MEGATRUTH_MAX_WAIT_MS", "20"))
+QUEUE_DEPTH = int(os.getenv("MEGATRUTH_QUEUE_DEPTH", "128"))
+EXPLAIN_WORKERS = int(os.getenv("MEGATRUTH_EXPLAIN_WORKERS", "4"))
+PRECISION = os.getenv("MEGATRUTH_PRECISION", "fp32")
+RUNTIME = os.getenv("MEGATRUTH_RUNTIME", "torch")
+# Base de embeddings das imagens analisadas (vazio desativa)
+EMBEDDINGS_DIR = os.getenv("MEGATRUTH_EMBEDDINGS", DEFAULT_STORE_DIR)
+VERDICTS = {"IA": FAKE_LABEL, "real": REAL_LABEL, FAKE_LABEL: FAKE_LABEL, REAL_LABEL: REAL_LABEL}
+
+
+class ServiceState:
+    """Modelos, agendadores e clientes multimodais do processo (criados sob demanda, uma única vez)."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.models = {}
+        self.schedulers = {}
+        self.nemotron = None
+        self.llava = None
+        self.hedger = HedgedRunner(strategy=os.getenv("MEGATRUTH_HEDGE_STRATEGY", "hedge"))
+        self.jobs = JobStore()
+        self.explanation_cache = ExplanationCache()
+        self.explain_pool = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explain")
+        self.embeddings = None
+
+    def scheduler(self, mode):
+        with self._lock:
+            if mode not in self.schedulers:
+                print(f"🔄 Inicializando CLIP para o modo '{mode}'...")
+                model = CLIPAIModel(stages=MODES[mode], persist_outputs=False, max_side=DISPLAY_MAX_SIDE,
+                                    precision=PRECISION, runtime=RUNTIME)
+                self.models[mode] = model
+                self.schedulers[mode] = MicroBatchScheduler(
+                    model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, queue_depth=QUEUE_DEPTH
+                )
+            return self.schedulers[mode]
+
+    def embedding_store(self, model):
+        """Base de embeddings do processo (None se MEGATRUTH_EMBEDDINGS estiver vazio)."""
+        if not EMBEDDINGS_DIR:
+            return None
+        with self._lock:
+            if self.embeddings is None:
+                self.embeddings = EmbeddingStore(EMBEDDINGS_DIR, namespace=model.path_tuned)
+            return self.embeddings
+
+    def get_nemotron(self):
+        from models.multimodal_model_nemotron import NemotronVL
+        with self._lock:
+            if self.nemotron is None:
+                self.nemotron = NemotronVL()
+            return self.nemotron
+
+    def get_llava(self):
+        from models.multimodal_model_llava import LLaVAModel
+        with self._lock:
+            if self.llava is None:
+                self.llava = LLaVAModel()
+            return self.llava
+
+
+state = ServiceState()
+telemetry.configure_from_env()
+app = FastAPI(title="MegaTruth API", description="Detecção de imagens geradas por IA (CLIP + CLIPSeg + laudo multimodal)")
+
+
+# ----------------------------------------------------------------------
+# Entrada e saída
+# ----------------------------------------------------------------------
+def _decode_base64(data):
+    """Aceita base64 puro ou data URL (data:image/png;base64,...)."""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    return base64.b64decode(data, validate=False)
+
+
+async def _read_json_object(request):
+    """Corpo JSON do pedido; 400 se não for um objeto (ex: lista, número ou JSON inválido)."""
+    try:
+        body = await request.json()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"JSON inválido: {e}")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="O corpo JSON deve ser um objeto")
+    return body
+
+
+async def _read_request(request):
+    """
+    Lê as imagens e opções do pedido. Formatos aceitos:
+      - multipart/form-data: um ou mais campos `files` (binário) + `overlay_color`, `include_overlay`.
+      - application/json: {"images": ["<base64>", ...], "overlay_color": "red", "include_overlay": false}
+      - image/*: o corpo é a própria imagem (binário).
+    Returns:
+        tuple: (lista de bytes, dict de opções)
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        images = [await f.read() for f in form.getlist("files")]
+        options = {k: v for k, v in form.items() if k != "files"}
+    elif content_type.startswith("application/json"):
+        body = await _read_json_object(request)
+        raw = body.get("images") or ([body["image"]] if body.get("image") else [])
+        if not isinstance(raw, list):
+            raise HTTPException(status_code=400, detail="images deve ser uma lista de strings base64")
+        try:
+            images = [_decode_base64(item) for item in raw]
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Base64 inválido: {e}")
+        options = {k: v for k, v in body.items() if k not in ("images", "image")}
+    elif content_type.startswith("image/") or content_type == "application/octet-stream":
+        images = [await request.body()]
+        options = dict(request.query_params)
+    else:
+        raise HTTPException(status_code=415, detail="Use multipart/form-data, application/json ou image/*")
+
+    if not images:
+        raise HTTPException(status_code=400, detail="Nenhuma imagem enviada")
+    if len(images) > MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"Máximo de {MAX_IMAGES_PER_REQUEST} imagens por pedido")
+
+    color = options.get("overlay_color", "red")
+    if color not in COLORS:
+        raise HTTPException(status_code=400, detail=f"overlay_color deve ser um de {COLORS}")
+    include_overlay = str(options.get("include_overlay", "false")).lower() in ("1", "true", "yes")
+    try:
+        k = int(options.get("k", 5))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="k deve ser um inteiro")
+    return images, {"overlay_color": color, "include_overlay": include_overlay,
+                    "force_refresh": str(options.get("force_refresh", "false")).lower() in ("1", "true", "yes"),
+                    "k": max(1, min(k, 50))}
+
+
+def _serialize(result, include_overlay=False):
+    """Remove caminhos/arrays do resultado e, se pedido, anexa o overlay em PNG (base64)."""
+    out = {k: v for k, v in result.items() if k not in EXCLUDED_KEYS}
+    overlay = result.get("overlay_image")
+    if include_overlay and overlay is not None:
+        out["overlay_png_base64"] = base64.b64encode(encode_image(overlay, fmt="PNG")).decode("ascii")
+    return out
+
+
+def _busy(e):
+    return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": "1"})
+
+
+# ----------------------------------------------------------------------
+# Rotas síncronas (CLIP)
+# ----------------------------------------------------------------------
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "checkpoints": [list(k) for k in model_registry.loaded_checkpoints()],
+        "schedulers": {mode: s.summary() for mode, s in state.schedulers.items()},
+        "ttft": {label: h.summary() for label, h in state.hedger.histograms.items()},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Spans, contadores e histogramas do processo no formato de texto do Prometheus."""
+    return PlainTextResponse(telemetry.telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+async def _analyze(mode, request):
+    """
+    Classifica (classify), classifica + conceitos (concepts) ou classifica + conceitos +
+    defect_map (defect-map) uma ou várias imagens. As imagens de todos os pedidos
+    simultâneos são agrupadas em micro-lotes pelo agendador do modo.
+    """
+    images, options = await _read_request(request)
+    # A primeira chamada carrega os modelos: fora do event loop
+    scheduler = await asyncio.to_thread(state.scheduler, mode)
+    max_side = state.models[mode].max_side
+    # Abrir a base lê o memmap e o SQLite do disco: também fora do event loop
+    store = await asyncio.to_thread(state.embedding_store, state.models[mode])
+
+    def submit(data):
+        # Decodificação + pré-processamento (CPU) fora do event loop
+        pil_image = to_pil(data, max_side=max_side)
+        return pil_image, scheduler.submit((pil_image, None), options["overlay_color"], timeout=1.0)
+
+    futures = []
+    for data in images:
+        try:
+            futures.append(await asyncio.to_thread(submit, data))
+        except SchedulerFull as e:
+            for item in futures:
+                if not isinstance(item, Exception):
+                    item[1].cancel()
+            return _busy(e)
+        except Exception as e:
+            futures.append(e)
+
+    results = []
+    for item in futures:
+        if isinstance(item, Exception):
+            results.append({"error": f"Imagem inválida: {item}"})
+            continue
+        pil_image, future = item
+        try:
+            result = await asyncio.wrap_future(future)
+            out = _serialize(result, options["include_overlay"])
+            if store is not None:
+                # id na base de embeddings: usado em /v1/similar e no veredito do analista
+                out["embedding_id"] = await asyncio.to_thread(store.add_result, result, content_hash(pil_image))
+            results.append(out)
+        except Exception as e:
+            results.append({"error": str(e)})
+    return {"mode": mode, "results": results}
+
+
+def _mode_route(mode):
+    async def route(request: Request):
+        return await _analyze(mode, request)
+    return route
+
+
+# POST /v1/classify, /v1/concepts e /v1/defect-map
+for _mode in MODES:
+    app.add_api_route(f"/v1/{_mode}", _mode_route(_mode), methods=["POST"], summary=f"Análise: {_mode}")
+
+
+# ----------------------------------------------------------------------
+# Imagens já analisadas (base de embeddings)
+# ----------------------------------------------------------------------
+async def _embedding_store():
+    """(modelo do modo classify, base de embeddings); 404 se a base estiver desativada."""
+    await asyncio.to_thread(state.scheduler, "classify")
+    model = state.models["classify"]
+    store = await asyncio.to_thread(state.embedding_store, model)
+    if store is None:
+        raise HTTPException(status_code=404, detail="Base de embeddings desativada (MEGATRUTH_EMBEDDINGS)")
+    return model, store
+
+
+@app.post("/v1/similar")
+async def similar(request: Request):
+    """
+    Compara cada imagem com as já analisadas: a quase-duplicata (se houver), com o
+    resultado e o veredito guardados, e as `k` fakes conhecidas mais parecidas.
+    Roda só a torre de visão do classificador (ou nada, se a imagem exata já estiver na base).
+    """
+    images, options = await _read_request(request)
+    model, store = await _embedding_store()
+
+    def lookup(data):
+        pil_image = to_pil(data, max_side=model.max_side)
+        item_id = store.id_for_key(content_hash(pil_image))
+        vector = store.vector(item_id) if item_id else model.embed_images([pil_image])[0]
+        exclude = (item_id,) if item_id else ()
+        duplicate = store.get(item_id) if item_id else store.find_duplicate(vector)
+        if item_id:
+            duplicate["similarity"] = 1.0
+        return {
+            "embedding_id": item_id,
+            "duplicate": duplicate,
+            "similar_fakes": store.similar(vector, k=options["k"], exclude=exclude),
+        }
+
+    results = []
+    for data in images:
+        try:
+            results.append(await asyncio.to_thread(lookup, data))
+        except Exception as e:
+            results.append({"error": str(e)})
+    return {"results": results}
+
+
+@app.post("/v1/embeddings/{item_id}/verdict")
+async def verdict(item_id: int, request: Request):
+    """Veredito do analista para uma imagem da base: {"verdict": "IA" | "real" | null}."""
+    body = await _read_json_object(request)
+    value = body.get("verdict")
+    if value is not None and value not in VERDICTS:
+        raise HTTPException(status_code=400, detail=f"verdict deve ser um de {sorted(VERDICTS)} ou null")
+    _, store = await _embedding_store()
+    try:
+        store.adjudicate(item_id, VERDICTS.get(value))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return store.get(item_id)
+
+
+# ----------------------------------------------------------------------
+# Laudos (assíncronos, com polling)
+# ----------------------------------------------------------------------
+def _run_explain(job_id, pil_image, overlay_color, force_refresh):
+    state.jobs.update(job_id, "running")
+    try:
+        result = state.scheduler("defect-map").predict((pil_image, None), overlay_color, queue_timeout=30.0)
+        overlay = result.get("overlay_image")
+        overlay = overlay if overlay is not None else pil_image
+        cor = COLOR_NAMES_PT[overlay_color]
+        conceitos = result.get("conceitos") or {}
+
+        image_hash, overlay_hash = evidence_hash(pil_image), evidence_hash(overlay)
+
+        def cache_key(model_label):
+            return explanation_key(image_hash, overlay_hash, result["label"], result["probability"],
+                                   conceitos, cor, model_label)
+
+        text, model_used = None, None
+        if not force_refresh:
+            for label in (NEMOTRON_LABEL, LLAVA_LABEL):
+                cached = state.explanation_cache.get(cache_key(label))
+                if cached:
+                    text, model_used = cached[0], f"{label} (cache)"
+                    break
+
+        if text is None:
+            kwargs = dict(imagem_original=pil_image, defect_map=overlay, classificacao_clip=result["label"],
+                          probabilidade_clip=result["probability"],
+                          conceitos_detectados=dict(list(conceitos.items())[:5]) or None, color_overlay=cor)
+            backends = [
+                (NEMOTRON_LABEL, lambda cancel: state.get_nemotron().analisar_imagens_stream(**kwargs, cancel_event=cancel)),
+                (LLAVA_LABEL, lambda cancel: state.get_llava().analisar_imagens_stream(**kwargs, cancel_event=cancel)),
+            ]
+            pieces = []
+            for label, piece in state.hedger.stream(backends):
+                model_used = label
+                pieces.append(piece)
+            text = "".join(pieces)
+            if text:
+                state.explanation_cache.put(cache_key(model_used), text, model_used)
+
+        state.jobs.update(job_id, "done", result={
+            "clip": _serialize(result),
+            "explanation": text,
+            "model": model_used,
+        })
+    except Exception as e:
+        print(f"⚠️ Job {job_id} falhou: {e}")
+        state.jobs.update(job_id, "error", error=str(e))
+
+
+@app.post("/v1/explain", status_code=202)
+async def explain(request: Request):
+    """
+    Enfileira um laudo (CLIP + defect_map + Nemotron/LLaVA) por imagem.
+    Devolve os ids dos jobs; o resultado sai em GET /v1/jobs/{id}.
+    Todas as imagens são validadas antes: se uma for inválida, nenhum job é criado.
+    """
+    images, options = await _read_request(request)
+    pil_images = []
+    for i, data in enumerate(images):
+        try:
+            pil_images.append(await asyncio.to_thread(to_pil, data))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Imagem {i} inválida: {e}")
+
+    job_ids = []
+    for pil_image in pil_images:
+        job_id = state.jobs.create("explain")
+        state.explain_pool.submit(_run_explain, job_id, pil_image, options["overlay_color"], options["force_refresh"])
+        job_ids.append(job_id)
+    return {"jobs": [{"id": j, "status_url": f"/v1/jobs/{j}"} for j in job_ids]}
+
+
+@app.get("/v1/jobs/{job_id}")
+def job_status(job_id: str):
+    job = state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado)")
+    return job
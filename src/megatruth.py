@@ -0,0 +1,160 @@
+import os
+import sys
+import argparse
+
+# Garantir que o diretório `src` esteja no path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cmd_scan(args):
+    """Varredura em lote sem interface, com saída JSONL em streaming."""
+    from models.vision_model_clip import CLIPAIModel
+    from pipeline.scan import run_scan
+
+    # O pool de processos é só para CPU
+    clip_model = CLIPAIModel(device="cpu" if args.processes else args.device, precision=args.precision,
+                             runtime=args.runtime, export_dir=args.export_dir)
+    store = None
+    if args.embeddings:
+        from pipeline.embedding_store import EmbeddingStore
+        store = EmbeddingStore(args.embeddings, namespace=clip_model.path_tuned)
+    run_scan(
+        clip_model,
+        source=args.source,
+        output_path=args.output,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        queue_depth=args.queue_depth,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
+        overlay_color=args.color,
+        processes=args.processes,
+        threads_per_worker=args.threads_per_worker,
+        store=store,
+    )
+    if store is not None:
+        store.close()
+
+
+def cmd_export(args):
+    """Exporta Tuned, Base e CLIPSeg para ONNX (runtime="onnx" no CLIPAIModel)."""
+    from models.onnx_export import export_bundle
+
+    export_bundle(export_dir=args.output, precision=args.precision, opset=args.opset)
+
+
+def cmd_evaluate(args):
+    """Acurácia, ROC-AUC e disparo de conceitos sobre uma pasta rotulada (ex: images/experiment)."""
+    from models.vision_model_clip import CLIPAIModel
+    from pipeline.evaluate import run_evaluation
+
+    # Só as torres de visão: sem CLIPSeg nem overlays
+    clip_model = CLIPAIModel(device=args.device, stages=("classify", "concepts"), persist_outputs=False,
+                             precision=args.precision, runtime=args.runtime, export_dir=args.export_dir)
+    run_evaluation(
+        clip_model,
+        root=args.root,
+        output_dir=args.output,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        queue_depth=args.queue_depth,
+        threshold=args.threshold,
+        copy_errors=not args.no_copy,
+    )
+
+
+def cmd_index(args):
+    """Refaz o índice de vizinhos da base de embeddings (a busca também o refaz sob demanda)."""
+    from pipeline.embedding_store import EmbeddingStore, DEFAULT_STORE_DIR
+
+    store = EmbeddingStore(args.dir or DEFAULT_STORE_DIR, namespace=None)
+    print(f"📚 {len(store)} imagens em {store.directory}")
+    store.build_index(n_lists=args.lists)
+    store.close()
+
+
+def cmd_serve(args):
+    """
+    API HTTP (FastAPI/uvicorn) ao lado da interface Gradio, em um único processo.
+    Os modelos, o agendador de micro-lotes e as threads que executam os laudos são do
+    processo: vários workers carregariam os modelos uma vez cada, sem dividir os lotes.
+    O estado dos jobs fica em outputs/cache/jobs.sqlite, e os que um processo anterior
+    deixou pela metade são marcados como 'error' ao subir.
+    """
+    import uvicorn
+
+    uvicorn.run("api.server:app", host=args.host, port=args.port, workers=1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="megatruth", description="MegaTruth — linha de comando")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    scan = sub.add_parser("scan", help="Analisa uma pasta, padrão glob ou lista de arquivos")
+    scan.add_argument("source", help="Pasta, padrão glob (ex: 'imgs/**/*.jpg') ou .txt com um caminho por linha")
+    scan.add_argument("-o", "--output", default="outputs/scan/results.jsonl", help="Arquivo JSONL de saída")
+    scan.add_argument("--batch-size", type=int, default=16)
+    scan.add_argument("--workers", type=int, default=4, help="Threads de leitura/pré-processamento")
+    scan.add_argument("--queue-depth", type=int, default=4, help="Lotes prontos aguardando o modelo")
+    scan.add_argument("--checkpoint-every", type=int, default=500, help="Grava o checkpoint a cada N imagens")
+    scan.add_argument("--resume", action="store_true", help="Retoma a partir do checkpoint de --output")
+    scan.add_argument("--color", choices=["red", "green", "blue"], default="red", help="Cor do overlay")
+    scan.add_argument("--device", default=None, help="cuda ou cpu (padrão: automático)")
+    scan.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32",
+                      help="CPU: precisão dos modelos (ver src/test/precision_regression.py)")
+    scan.add_argument("--runtime", choices=["torch", "onnx"], default="torch",
+                      help="onnx: usa os grafos gerados por `export` (CPU)")
+    scan.add_argument("--export-dir", default=None, help="Raiz dos pacotes ONNX (padrão: src/models/exported)")
+    scan.add_argument("--processes", type=int, default=0,
+                      help="CPU: N processos compartilhando os pesos (fork), em vez das threads de leitura")
+    scan.add_argument("--threads-per-worker", type=int, default=None,
+                      help="Threads do PyTorch por processo (padrão: núcleos / processos)")
+    scan.add_argument("--embeddings", default=None,
+                      help="Pasta da base de embeddings onde guardar cada imagem (ex: outputs/embeddings)")
+    scan.set_defaults(func=cmd_scan)
+
+    export = sub.add_parser("export", help="Exporta os modelos para ONNX (partida rápida e menor latência em CPU)")
+    export.add_argument("-o", "--output", default=None, help="Raiz dos pacotes (padrão: src/models/exported)")
+    export.add_argument("--precision", choices=["fp32", "int8"], default="fp32",
+                        help="int8: quantização dinâmica dos grafos (onnxruntime)")
+    export.add_argument("--opset", type=int, default=17)
+    export.set_defaults(func=cmd_export)
+
+    evaluate = sub.add_parser("evaluate", help="Avalia o classificador em uma pasta com subpastas real/ e IA/")
+    evaluate.add_argument("root", help="Pasta com as subpastas rotuladas (ex: images/experiment)")
+    evaluate.add_argument("-o", "--output", default="outputs/evaluate",
+                          help="Pasta do relatório, das previsões e das cópias dos erros")
+    evaluate.add_argument("--batch-size", type=int, default=32)
+    evaluate.add_argument("--workers", type=int, default=4, help="Threads de leitura/pré-processamento")
+    evaluate.add_argument("--queue-depth", type=int, default=4, help="Lotes prontos aguardando o modelo")
+    evaluate.add_argument("--threshold", type=float, default=0.5, help="p(IA) a partir da qual a imagem é IA")
+    evaluate.add_argument("--no-copy", action="store_true", help="Não copia os falsos positivos/negativos")
+    evaluate.add_argument("--device", default=None, help="cuda ou cpu (padrão: automático)")
+    evaluate.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32")
+    evaluate.add_argument("--runtime", choices=["torch", "onnx"], default="torch")
+    evaluate.add_argument("--export-dir", default=None, help="Raiz dos pacotes ONNX (padrão: src/models/exported)")
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    index = sub.add_parser("index", help="Refaz o índice de vizinhos da base de embeddings")
+    index.add_argument("--dir", default=None, help="Pasta da base (padrão: outputs/embeddings)")
+    index.add_argument("--lists", type=int, default=None, help="Listas do índice IVF (padrão: raiz do nº de imagens)")
+    index.set_defaults(func=cmd_index)
+
+    serve = sub.add_parser("serve", help="Sobe a API HTTP (classify, concepts, defect-map, explain)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    from pipeline import telemetry
+
+    args = build_parser().parse_args(argv)
+    telemetry.configure_from_env()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
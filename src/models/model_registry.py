@@ -0,0 +1,127 @@
+import threading
+import torch
+
+# Cada checkpoint distinto é carregado uma única vez por processo, independente
+# de quantos papéis (Tuned, Base) ou instâncias de CLIPAIModel o utilizam.
+_registry = {}
+_lock = threading.RLock()
+
+# Precisões da inferência em CPU (em CUDA os modelos CLIP já rodam em float16)
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def _dtype_for(device):
+    return torch.float16 if device == "cuda" else torch.float32
+
+
+def resolve_precision(precision, device):
+    """Valida `precision`; fora da CPU a opção é ignorada (fp32)."""
+    precision = precision or "fp32"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precisão desconhecida: {precision}. Use {PRECISIONS}.")
+    if precision != "fp32" and device != "cpu":
+        print(f"⚠️ Precisão '{precision}' é só para CPU; usando a padrão em {device}.")
+        return "fp32"
+    return precision
+
+
+def _apply_precision(model, precision):
+    """
+    bf16: converte os pesos para bfloat16 (rápido em CPUs com AVX512-BF16/AMX).
+    int8: quantização dinâmica das camadas Linear (pesos int8, ativações
+    quantizadas em tempo de execução); o restante continua em float32.
+    """
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_clip(path, device, precision="fp32"):
+    """Retorna (CLIPProcessor, CLIPModel) compartilhados para `path` no `device` e na `precision`."""
+    key = ("clip", path, device) if precision == "fp32" else ("clip", path, device, precision)
+    # transformers só é importado quando um modelo eager é de fato carregado (o runtime ONNX não precisa dele)
+    from transformers import CLIPProcessor, CLIPModel
+    with _lock:
+        if key in _registry:
+            print(f"♻️ Reutilizando CLIP já carregado: {path}")
+            return _registry[key]
+
+        processor = CLIPProcessor.from_pretrained(path, use_fast=True)
+        model = CLIPModel.from_pretrained(path, dtype=_dtype_for(device)).to(device)
+        model = _apply_precision(model.eval(), precision)
+        _registry[key] = (processor, model)
+        return _registry[key]
+
+
+def load_clipseg(path, device, precision="fp32"):
+    """Retorna (CLIPSegProcessor, CLIPSegForImageSegmentation) compartilhados."""
+    key = ("clipseg", path, device) if precision == "fp32" else ("clipseg", path, device, precision)
+    from transformers import CLIPSegProcessor, CLIPSegForImageSegmentation
+    with _lock:
+        if key in _registry:
+            print(f"♻️ Reutilizando CLIPSeg já carregado: {path}")
+            return _registry[key]
+
+        processor = CLIPSegProcessor.from_pretrained(path, use_fast=True)
+        model = CLIPSegForImageSegmentation.from_pretrained(path).to(device)
+        model = _apply_precision(model.eval(), precision)
+        _registry[key] = (processor, model)
+        return _registry[key]
+
+
+def _same_value(a, b):
+    """Compara valores de state_dict (tensores, ou as tuplas de pesos empacotados das camadas int8)."""
+    if isinstance(a, torch.Tensor) and isinstance(b, torch.Tensor):
+        if a.shape != b.shape or a.dtype != b.dtype:
+            return False
+        if a.is_quantized:
+            # torch.equal não serve para tensores quantizados (int8): compara os inteiros
+            # guardados e os valores reconstruídos (mesma escala/zero-point)
+            return (a.qscheme() == b.qscheme() and torch.equal(a.int_repr(), b.int_repr())
+                    and torch.equal(a.dequantize(), b.dequantize()))
+        return torch.equal(a, b)
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(_same_value(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+def share_identical_submodules(source, target, names=("vision_model", "visual_projection", "text_model", "text_projection")):
+    """
+    Faz `target` apontar para os submódulos de `source` cujos pesos são idênticos,
+    liberando a cópia duplicada (ex: fine-tuning que não alterou a torre de visão).
+    Returns:
+        list: Nomes dos submódulos que passaram a ser compartilhados.
+    """
+    shared = []
+    for name in names:
+        src_module = getattr(source, name, None)
+        dst_module = getattr(target, name, None)
+        if src_module is None or dst_module is None:
+            continue
+        if src_module is dst_module:
+            shared.append(name)
+            continue
+
+        src_state = src_module.state_dict()
+        dst_state = dst_module.state_dict()
+        if src_state.keys() != dst_state.keys():
+            continue
+        if all(_same_value(src_state[k], dst_state[k]) for k in src_state):
+            setattr(target, name, src_module)
+            shared.append(name)
+
+    return shared
+
+
+def loaded_checkpoints():
+    """Lista os checkpoints atualmente em memória como (tipo, caminho, dispositivo[, precisão])."""
+    with _lock:
+        return list(_registry.keys())
+
+
+def clear():
+    """Esquece todos os modelos carregados (o GC libera a memória quando ninguém mais os referencia)."""
+    with _lock:
+        _registry.clear()
@@ -1,6 +1,11 @@
 import os
+import queue
+import asyncio
+import threading
 import pandas as pd # Importei pandas apenas para formatar data se precisar, mas o foco é o texto
-import base64
+
+from pipeline.image_io import image_to_base64, LLM_MAX_SIDE, LLM_MAX_BYTES
+from pipeline import telemetry
 
 # Remove a variável de ambiente problemática se ela existir
 if 'SSL_CERT_FILE' in os.environ:
@@ -30,31 +35,26 @@ class LLaVAModel:
             print(f"Erro ao verificar modelo LLaVA: {e}")
             raise
 
-    def analisar_imagens(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho"):
+    def _montar_mensagens(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho"):
         """
-        Analisa a imagem original e o defect_map usando LLaVA-7B.
+        Monta as mensagens do ollama.chat (prompt + imagem original + defect_map em base64).
         Agora inclui os 'conceitos_detectados' (Concept Bottleneck) como evidência.
+        `imagem_original` e `defect_map` podem ser caminhos ou imagens em memória (PIL/NumPy).
         """
         
-        # Verifica se as imagens existem
-        if not os.path.exists(imagem_original):
+        # Caminhos são lidos do disco; imagens em memória (PIL/NumPy) são codificadas direto no buffer
+        if isinstance(imagem_original, str) and not os.path.exists(imagem_original):
             raise FileNotFoundError(f"Imagem original não encontrada: {imagem_original}")
             
-        if not os.path.exists(defect_map):
+        if isinstance(defect_map, str) and not os.path.exists(defect_map):
             raise FileNotFoundError(f"defect_map não encontrado: {defect_map}")
+
+        # JPEG reduzido: o LLaVA trabalha em baixa resolução, não vale enviar o original de vários MB
+        image_original_b64 = image_to_base64(imagem_original, max_side=LLM_MAX_SIDE, max_bytes=LLM_MAX_BYTES)
+        defect_map_b64 = image_to_base64(defect_map, max_side=LLM_MAX_SIDE, max_bytes=LLM_MAX_BYTES)
         
-        # Lê os arquivos como bytes
-        with open(imagem_original, 'rb') as f:
-            image_original_bytes = f.read()
-        with open(defect_map, 'rb') as f:
-            defect_map_bytes = f.read()
-
-        # Converter para base64 para garantir compatibilidade
-        image_original_b64 = base64.b64encode(image_original_bytes).decode('utf-8')
-        defect_map_b64 = base64.b64encode(defect_map_bytes).decode('utf-8')
-        
-        print(f"📸 Imagem original: {len(image_original_bytes)} bytes")
-        print(f"🔥 defect_map: {len(defect_map_bytes)} bytes")
+        print(f"📸 Imagem original: {len(image_original_b64) * 3 // 4} bytes")
+        print(f"🔥 defect_map: {len(defect_map_b64) * 3 // 4} bytes")
 
         print("Analisando imagens com LLaVA-7B...")
         
@@ -75,50 +75,57 @@ class LLaVAModel:
             > USE ESTA LISTA COMO GUIA: Verifique se esses defeitos específicos aparecem nas áreas coloridas do defect_map.
             """
 
-        try:
-            prompt = f"""
-                VOCÊ É UM PERITO FORENSE DIGITAL SÊNIOR.
-                
-                Sua tarefa é cruzar dados visuais e semânticos para explicar uma detecção de IA.
-                
-                DADOS DE ENTRADA:
-                1. Imagem Original.
-                2.  **Overlay (Capa de Chuva)**: É a imagem original contendo Uma NÉVOA / MANCHA, de cor {color_overlay}
-                indicando as regiões que o detector considerou importantes.
-                3. caso o overlay não contenha manchas de cor {color_overlay} e que o overlay é idêntico a imagem original,
-                considere que o detector não encontrou áreas relevantese, nesse caso vc pode pular a pergunta  "3. Foco do defect_map.
-                
-                
-                CONTEXTO GERAL:
-                Classificação: "{classificacao_clip}" ({probabilidade_clip:.1%} de certeza).
-
-                {texto_conceitos}
-                    
-                **DIRETRIZ DE SEGURANÇA (IMPORTANTE):**
-                - A lista de conceitos acima é uma indicação do que o detector semântico encontrou.
-                - Se a imagem for REAL, a tendencia é que a lista possa estar vazia ou conter "falsos positivos" (ruído). **NÃO INVENTE DEFEITOS** só para concordar com a lista.
-                - Se a imagem for FAKE, a lista provavelmente indica o erro exato. Use-a como guia.
-
-                INSTRUÇÃO: Responda em PORTUGUÊS, de forma técnica e direta.
-
-                1. Análise da Cena: Descreva brevemente o sujeito e o ambiente da imagem original.
-                2. Interpretação do defect_map: Explique o que as áreas coloridas do overlay indicam sobre o foco do modelo.
-                3. Foco do defect_map: Onde estão concentrados os pontos coloridos no Overlay? (Olhos, mãos, pele, fundo?).
-                4. Verificação de Defeitos: Olhando para a imagem original nessas áreas, você confirma a presença dos defeitos listados em {texto_conceitos}?
-                . Veredito: Explique como a combinação do defect_map com os conceitos detectados confirma a classificação de "{classificacao_clip}".
-            """
+        prompt = f"""
+            VOCÊ É UM PERITO FORENSE DIGITAL SÊNIOR.
+            
+            Sua tarefa é cruzar dados visuais e semânticos para explicar uma detecção de IA.
+            
+            DADOS DE ENTRADA:
+            1. Imagem Original.
+            2.  **Overlay (Capa de Chuva)**: É a imagem original contendo Uma NÉVOA / MANCHA, de cor {color_overlay}
+            indicando as regiões que o detector considerou importantes.
+            3. caso o overlay não contenha manchas de cor {color_overlay} e que o overlay é idêntico a imagem original,
+            considere que o detector não encontrou áreas relevantese, nesse caso vc pode pular a pergunta  "3. Foco do defect_map.
             
-            # Envia as duas imagens para o LLaVA usando base64
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt,
-                        'images': [image_original_b64, defect_map_b64]
-                    }
-                ]
-            )
+            
+            CONTEXTO GERAL:
+            Classificação: "{classificacao_clip}" ({probabilidade_clip:.1%} de certeza).
+
+            {texto_conceitos}
+                
+            **DIRETRIZ DE SEGURANÇA (IMPORTANTE):**
+            - A lista de conceitos acima é uma indicação do que o detector semântico encontrou.
+            - Se a imagem for REAL, a tendencia é que a lista possa estar vazia ou conter "falsos positivos" (ruído). **NÃO INVENTE DEFEITOS** só para concordar com a lista.
+            - Se a imagem for FAKE, a lista provavelmente indica o erro exato. Use-a como guia.
+
+            INSTRUÇÃO: Responda em PORTUGUÊS, de forma técnica e direta.
+
+            1. Análise da Cena: Descreva brevemente o sujeito e o ambiente da imagem original.
+            2. Interpretação do defect_map: Explique o que as áreas coloridas do overlay indicam sobre o foco do modelo.
+            3. Foco do defect_map: Onde estão concentrados os pontos coloridos no Overlay? (Olhos, mãos, pele, fundo?).
+            4. Verificação de Defeitos: Olhando para a imagem original nessas áreas, você confirma a presença dos defeitos listados em {texto_conceitos}?
+            . Veredito: Explique como a combinação do defect_map com os conceitos detectados confirma a classificação de "{classificacao_clip}".
+        """
+
+        # Envia as duas imagens para o LLaVA usando base64
+        return [
+            {
+                'role': 'user',
+                'content': prompt,
+                'images': [image_original_b64, defect_map_b64]
+            }
+        ]
+
+    @telemetry.traced("llava")
+    def analisar_imagens(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho"):
+        """
+        Analisa a imagem original e o defect_map usando LLaVA-7B.
+        Retorna o laudo completo (ou None em caso de erro).
+        """
+        messages = self._montar_mensagens(imagem_original, defect_map, classificacao_clip, probabilidade_clip,
+                                          conceitos_detectados, color_overlay)
+        try:
+            response = ollama.chat(model=self.model_name, messages=messages)
             
             print("✅ Análise concluída!\n")
             print("=" * 60)
@@ -126,8 +133,72 @@ class LLaVAModel:
             print("=" * 60)
             print(response['message']['content'])
             
+            telemetry.count("megatruth_llm_requests_total", backend="llava", outcome="ok")
             return response['message']['content']
             
         except Exception as e:
             print(f"Erro ao analisar imagens: {e}")
-            return None
\ No newline at end of file
+            telemetry.count("megatruth_llm_requests_total", backend="llava", outcome="error")
+            return None
+
+    def analisar_imagens_stream(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho", cancel_event=None):
+        """
+        Igual a analisar_imagens, mas produz o laudo em trechos à medida que o
+        LLaVA gera os tokens (ollama.AsyncClient com stream=True). Erros são lançados ao consumidor.
+        Setar `cancel_event` (threading.Event) de outra thread fecha o stream do Ollama na hora,
+        mesmo antes do primeiro token (o Ollama para de gerar quando a conexão cai).
+        """
+        messages = self._montar_mensagens(imagem_original, defect_map, classificacao_clip, probabilidade_clip,
+                                          conceitos_detectados, color_overlay)
+        chunks = queue.Queue()
+        fim = object()
+        stop = threading.Event()
+
+        async def consume():
+            async for chunk in await ollama.AsyncClient().chat(model=self.model_name, messages=messages, stream=True):
+                piece = chunk['message']['content']
+                if piece:
+                    chunks.put(piece)
+
+        async def pump():
+            task = asyncio.create_task(consume())
+            while not task.done():
+                if stop.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                    # Cancelar a task sai do `async with` do stream e fecha a resposta HTTP
+                    task.cancel()
+                    break
+                await asyncio.wait({task}, timeout=0.1)
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        def run():
+            try:
+                asyncio.run(pump())
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(fim)
+
+        threading.Thread(target=run, name="llava-stream", daemon=True).start()
+        try:
+            with telemetry.span("llava_stream"):
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        print("🛑 Geração do LLaVA cancelada.")
+                        telemetry.count("megatruth_llm_cancelled_total", backend="llava")
+                        return
+                    try:
+                        item = chunks.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is fim:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            # Consumidor desistiu ou cancelou: garante que a requisição ao Ollama seja fechada
+            stop.set()
+        print("✅ Análise concluída (streaming)!")
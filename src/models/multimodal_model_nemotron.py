@@ -1,40 +1,232 @@
 import os
-import base64
-import requests
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
+
+import httpx
+
+from pipeline.image_io import image_to_base64, LLM_MAX_SIDE, LLM_MAX_BYTES
+from pipeline import telemetry
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# Respostas que valem nova tentativa (limite de taxa e falhas transitórias do servidor)
+RETRY_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
 
 class NemotronVL:
-    def __init__(self):
+    """
+    Cliente do Nemotron (OpenRouter) sobre httpx assíncrono.
+
+    Um único event loop (em uma thread de fundo) mantém o pool de conexões vivo
+    entre chamadas, de modo que tanto o uso síncrono (analisar_imagens) quanto o
+    assíncrono (aanalisar_imagens / analisar_lote) reaproveitam as mesmas conexões.
+    Um semáforo limita as requisições simultâneas; 429/5xx e falhas de rede são
+    repetidos com backoff exponencial + jitter, sempre dentro do prazo (deadline)
+    de cada requisição.
+    """
+
+    def __init__(self, base_url=None, max_concurrency=4, max_retries=4, timeout=90.0, deadline=180.0,
+                 backoff_base=1.0, backoff_max=30.0):
+        """
+        Args:
+            base_url (str): Endpoint compatível com OpenRouter (padrão: OPENROUTER_BASE_URL
+                ou a variável de ambiente de mesmo nome; útil para servidores de teste).
+            max_concurrency (int): Requisições simultâneas permitidas.
+            max_retries (int): Tentativas extras após a primeira.
+            timeout (float): Timeout de cada tentativa, em segundos.
+            deadline (float): Prazo total por análise (tentativas + esperas), em segundos.
+            backoff_base, backoff_max (float): Espera base e máxima entre tentativas.
+        """
         self.model_name = "nvidia/nemotron-nano-12b-v2-vl:free"
         self.api_key = os.getenv("OPENROUTER_API_KEY")
 
         if not self.api_key:
             raise ValueError("A variável de ambiente OPENROUTER_API_KEY não está definida!")
 
+        self.base_url = (base_url or os.getenv("OPENROUTER_BASE_URL") or OPENROUTER_BASE_URL).rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+        # Event loop próprio: o AsyncClient e o semáforo ficam presos a ele
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="nemotron-http", daemon=True)
+        self._thread.start()
+        self._client = None
+        self._semaphore = None
+
         print(f"Usando modelo: {self.model_name}")
 
-    def _carregar_imagem_base64(self, caminho):
-        """Lê imagem como bytes e converte para base64."""
-        if not os.path.exists(caminho):
-            raise FileNotFoundError(f"Arquivo não encontrado: {caminho}")
+    # ------------------------------------------------------------------
+    # Infraestrutura assíncrona
+    # ------------------------------------------------------------------
+    def _submit(self, coro):
+        """Agenda uma corrotina no loop do cliente e devolve um concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _ensure_client(self):
+        # Só é chamado de dentro do loop do cliente
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "http://localhost",
+                    "X-Title": "Megatruth Analyzer"
+                },
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                timeout=self.timeout,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
 
-        with open(caminho, "rb") as f:
-            return base64.b64encode(f.read()).decode("utf-8")
+    def _backoff(self, attempt, retry_after=None):
+        """Backoff exponencial com jitter completo; respeita Retry-After quando o servidor informa."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
 
-    def analisar_imagens(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho"):
+    async def _post_chat(self, payload, deadline=None):
         """
-        Envia imagem original + defect_map + conceitos semânticos para o Nemotron.
+        POST /chat/completions com semáforo, repetições e prazo total.
+        Returns:
+            dict: JSON da resposta. Lança a última exceção se o prazo ou as tentativas se esgotarem.
         """
+        client = self._ensure_client()
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + (deadline if deadline is not None else self.deadline)
 
-        print("Carregando imagens...")
-        try:
-            img1_b64 = self._carregar_imagem_base64(imagem_original)
-            img2_b64 = self._carregar_imagem_base64(defect_map)
-        except Exception as e:
-            print(f"Erro ao carregar imagens: {e}")
-            return None
+        attempt = 0
+        while True:
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                raise TimeoutError("Prazo da requisição ao Nemotron esgotado")
 
-        print("Imagens carregadas. Preparando prompt com conceitos...")
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    response = await client.post("/chat/completions", json=payload,
+                                                 timeout=min(self.timeout, remaining))
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+                error = httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            wait = self._backoff(attempt, retry_after)
+            if loop.time() + wait >= expires_at:
+                raise error
+            attempt += 1
+            self.stats["retries"] += 1
+            telemetry.count("megatruth_llm_retries_total", backend="nemotron")
+            print(f"⏳ Nemotron: {error} — nova tentativa {attempt}/{self.max_retries} em {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+    async def _stream_chat(self, payload, deadline=None):
+        """
+        POST /chat/completions com stream=True (SSE), produzindo os trechos de texto.
+        Repetições e o prazo (deadline) valem só até o início da resposta; depois disso
+        o fluxo segue enquanto o servidor enviar dados (timeout de leitura por trecho).
+        """
+        client = self._ensure_client()
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + (deadline if deadline is not None else self.deadline)
+        payload = {**payload, "stream": True}
+
+        attempt = 0
+        while True:
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                raise TimeoutError("Prazo da requisição ao Nemotron esgotado")
+
+            retry_after = None
+            started = False
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=remaining)
+                try:
+                    self.stats["requests"] += 1
+                    request = client.build_request("POST", "/chat/completions", json=payload)
+                    response = await asyncio.wait_for(client.send(request, stream=True), timeout=remaining)
+                    try:
+                        if response.status_code in RETRY_STATUS:
+                            retry_after = response.headers.get("Retry-After")
+                            error = httpx.HTTPStatusError(f"HTTP {response.status_code}",
+                                                          request=response.request, response=response)
+                        else:
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                # Linhas ":" são comentários de keep-alive do OpenRouter
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    return
+                                event = json.loads(data)
+                                if "error" in event:
+                                    raise RuntimeError(f"Erro no streaming do Nemotron: {event['error']}")
+                                choices = event.get("choices") or [{}]
+                                piece = (choices[0].get("delta") or {}).get("content")
+                                if piece:
+                                    started = True
+                                    yield piece
+                            return
+                    finally:
+                        await response.aclose()
+                finally:
+                    self._semaphore.release()
+            except httpx.TransportError as e:
+                if started:
+                    raise
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            wait = self._backoff(attempt, retry_after)
+            if loop.time() + wait >= expires_at:
+                raise error
+            attempt += 1
+            self.stats["retries"] += 1
+            telemetry.count("megatruth_llm_retries_total", backend="nemotron")
+            print(f"⏳ Nemotron (stream): {error} — nova tentativa {attempt}/{self.max_retries} em {wait:.1f}s")
+            await asyncio.sleep(wait)
 
+    def close(self):
+        """Fecha o pool de conexões e encerra o loop do cliente."""
+        if self._client is not None:
+            self._submit(self._client.aclose()).result()
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    # ------------------------------------------------------------------
+    # Montagem da requisição
+    # ------------------------------------------------------------------
+    def _carregar_imagem_base64(self, imagem):
+        """
+        Converte caminho ou imagem em memória (PIL/NumPy) para base64,
+        reenviando como JPEG reduzido (lado e tamanho limitados).
+        """
+        return image_to_base64(imagem, max_side=LLM_MAX_SIDE, max_bytes=LLM_MAX_BYTES)
+
+    def _montar_prompt(self, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho"):
+        """Prompt pericial com a classificação do CLIP e os conceitos detectados."""
         # --- 1. PREPARAR A LISTA DE CONCEITOS ---
         texto_conceitos = "Nenhum defeito específico listado pelo detector semântico."
         if conceitos_detectados:
@@ -80,18 +272,10 @@ class NemotronVL:
             4. Verificação de Defeitos: Olhando para a imagem original nessas áreas, você confirma a presença dos defeitos listados em {texto_conceitos}?
             . Veredito: Explique como a combinação do defect_map com os conceitos detectados confirma a classificação de "{classificacao_clip}".
         """
-        
-        # -------- REQUISIÇÃO OPENROUTER --------
-        url = "https://openrouter.ai/api/v1/chat/completions"
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost",
-            "X-Title": "Megatruth Analyzer"
-        }
+        return prompt
 
-        payload = {
+    def _montar_payload(self, img1_b64, img2_b64, prompt):
+        return {
             "model": self.model_name,
             "messages": [
                 {
@@ -105,22 +289,128 @@ class NemotronVL:
             ]
         }
 
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    async def _preparar_payload(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip,
+                                conceitos_detectados=None, color_overlay="vermelho"):
+        print("Carregando imagens...")
+        # A codificação JPEG é CPU: roda fora do loop para não travar as outras requisições
+        img1_b64, img2_b64 = await asyncio.gather(
+            asyncio.to_thread(self._carregar_imagem_base64, imagem_original),
+            asyncio.to_thread(self._carregar_imagem_base64, defect_map),
+        )
+
+        print("Imagens carregadas. Preparando prompt com conceitos...")
+        prompt = self._montar_prompt(classificacao_clip, probabilidade_clip, conceitos_detectados, color_overlay)
+        return self._montar_payload(img1_b64, img2_b64, prompt)
+
+    async def _analisar(self, *args, **kwargs):
+        """Uma chamada completa (analisar_imagens, aanalisar_imagens ou analisar_lote), cronometrada."""
+        with telemetry.span("nemotron"):
+            result = await self._analisar_uma(*args, **kwargs)
+        telemetry.count("megatruth_llm_requests_total", backend="nemotron",
+                        outcome="ok" if result is not None else "error")
+        return result
+
+    async def _analisar_uma(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip,
+                            conceitos_detectados=None, color_overlay="vermelho", deadline=None):
+        try:
+            payload = await self._preparar_payload(imagem_original, defect_map, classificacao_clip,
+                                                   probabilidade_clip, conceitos_detectados, color_overlay)
+        except Exception as e:
+            print(f"Erro ao carregar imagens: {e}")
+            return None
+
         # -------- ENVIO --------
+        start = time.perf_counter()
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=90) # Aumentei timeout para 90s
-            response.raise_for_status()
-            data = response.json()
+            # wait_for também limita a espera pelo semáforo ao prazo total
+            limit = deadline if deadline is not None else self.deadline
+            data = await asyncio.wait_for(self._post_chat(payload, limit), timeout=limit)
 
             if "choices" in data and len(data["choices"]) > 0:
                 result = data["choices"][0]["message"]["content"]
-                print("\n=== RESPOSTA DO NEMOTRON VL ===\n")
+                print(f"\n=== RESPOSTA DO NEMOTRON VL ({time.perf_counter() - start:.1f}s) ===\n")
                 print(result)
                 print("\n================================\n")
                 return result
             else:
                 print(f"Resposta inesperada da API: {data}")
+                self.stats["failures"] += 1
                 return None
 
         except Exception as e:
-            print(f"Erro ao enviar para o Nemotron: {e}")
-            return None
\ No newline at end of file
+            print(f"Erro ao enviar para o Nemotron: {e!r}")
+            self.stats["failures"] += 1
+            return None
+
+    async def aanalisar_imagens(self, *args, **kwargs):
+        """Versão assíncrona de analisar_imagens (pode ser aguardada de qualquer event loop)."""
+        return await asyncio.wrap_future(self._submit(self._analisar(*args, **kwargs)))
+
+    def analisar_imagens(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho", deadline=None):
+        """
+        Envia imagem original + defect_map + conceitos semânticos para o Nemotron.
+        `imagem_original` e `defect_map` podem ser caminhos ou imagens em memória (PIL/NumPy).
+        Bloqueia até a resposta (ou o fim do `deadline`) e retorna o texto ou None.
+        """
+        return self._submit(self._analisar(
+            imagem_original, defect_map, classificacao_clip, probabilidade_clip,
+            conceitos_detectados, color_overlay, deadline,
+        )).result()
+
+    def analisar_imagens_stream(self, imagem_original, defect_map, classificacao_clip, probabilidade_clip, conceitos_detectados=None, color_overlay="vermelho", deadline=None, cancel_event=None):
+        """
+        Igual a analisar_imagens, mas produz o laudo em trechos à medida que os tokens chegam (SSE).
+        Erros são lançados ao consumidor (antes do primeiro trecho, permitem cair no LLaVA).
+        O `deadline` limita a espera pelo início da resposta. Setar `cancel_event`
+        (threading.Event) de outra thread aborta a requisição, mesmo antes do primeiro token.
+        """
+        chunks = queue.Queue()
+        fim = object()
+
+        async def pump():
+            try:
+                payload = await self._preparar_payload(imagem_original, defect_map, classificacao_clip,
+                                                       probabilidade_clip, conceitos_detectados, color_overlay)
+                async for piece in self._stream_chat(payload, deadline):
+                    chunks.put(piece)
+            except Exception as e:
+                self.stats["failures"] += 1
+                chunks.put(e)
+            finally:
+                chunks.put(fim)
+
+        future = self._submit(pump())
+        try:
+            with telemetry.span("nemotron_stream"):
+                while True:
+                    try:
+                        item = chunks.get(timeout=0.1 if cancel_event is not None else None)
+                    except queue.Empty:
+                        if cancel_event.is_set():
+                            print("🛑 Requisição ao Nemotron cancelada.")
+                            telemetry.count("megatruth_llm_cancelled_total", backend="nemotron")
+                            return
+                        continue
+                    if item is fim:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            # Consumidor desistiu (ex: usuário saiu da página): cancela a requisição em andamento
+            future.cancel()
+
+    def analisar_lote(self, jobs, deadline=None):
+        """
+        Processa vários laudos em paralelo (limitados por max_concurrency).
+        Args:
+            jobs (list): dicts com os argumentos de analisar_imagens.
+        Returns:
+            list: Texto ou None por job, na ordem de entrada.
+        """
+        async def run_all():
+            return await asyncio.gather(*(self._analisar(**{"deadline": deadline, **job}) for job in jobs))
+        return self._submit(run_all()).result()
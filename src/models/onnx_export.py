@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import inspect
+
+import numpy as np
+import torch
+from PIL import Image
+
+from models import onnx_runtime
+from models.vision_model_clip import CLIPAIModel
+
+# O warm-up do CLIPAIModel segmenta com este alvo; ele entra no pacote junto com anchors/conceitos
+WARMUP_SEG_PROMPT = "hand"
+
+
+class _VisionEmbedder(torch.nn.Module):
+    """Torre de visão + projeção + normalização (o mesmo que CLIPAIModel._encode_images)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        embeds = self.visual_projection(self.vision_model(pixel_values=pixel_values).pooler_output)
+        return embeds / embeds.norm(dim=-1, keepdim=True)
+
+
+class _SegVision(torch.nn.Module):
+    """Visão do CLIPSeg devolvendo só as ativações das extract_layers."""
+
+    def __init__(self, seg_model):
+        super().__init__()
+        self.vision_model = seg_model.clip.vision_model
+        self.extract_layers = list(seg_model.extract_layers)
+
+    def forward(self, pixel_values):
+        hidden = self.vision_model(pixel_values=pixel_values, output_hidden_states=True).hidden_states
+        return tuple(hidden[layer + 1] for layer in self.extract_layers)
+
+
+class _SegDecoder(torch.nn.Module):
+    def __init__(self, seg_model):
+        super().__init__()
+        self.decoder = seg_model.decoder
+
+    def forward(self, *inputs):
+        *activations, conditional = inputs
+        return self.decoder(tuple(activations), conditional, return_dict=True).logits
+
+
+def _processor_config(processor):
+    """Só o que o OnnxImageProcessor precisa, em tipos simples (JSON)."""
+    d = processor.image_processor.to_dict()
+
+    def size_dict(value):
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return {"height": value, "width": value}
+        return {k: int(v) for k, v in dict(value).items() if v is not None}
+
+    return {
+        "do_resize": bool(d.get("do_resize", True)),
+        "size": size_dict(d.get("size")),
+        "resample": int(d["resample"]) if d.get("resample") is not None else int(Image.BICUBIC),
+        "do_center_crop": bool(d.get("do_center_crop", False)),
+        "crop_size": size_dict(d.get("crop_size")),
+        "do_rescale": bool(d.get("do_rescale", True)),
+        "rescale_factor": float(d.get("rescale_factor", 1 / 255)),
+        "do_normalize": bool(d.get("do_normalize", True)),
+        "image_mean": [float(v) for v in d["image_mean"]],
+        "image_std": [float(v) for v in d["image_std"]],
+    }
+
+
+def _export(module, args, path, input_names, output_names, opset):
+    # Eixo 0 (lote) dinâmico em todas as entradas e saídas
+    dynamic_axes = {name: {0: "batch"} for name in input_names + output_names}
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(module.eval(), args, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **kwargs)
+    print(f"📦 {os.path.basename(path)} ({os.path.getsize(path) / 1e6:.0f} MB)")
+
+
+def _quantize_int8(path):
+    """Quantização dinâmica (pesos int8) do grafo, no lugar do arquivo fp32."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    tmp = path + ".int8"
+    quantize_dynamic(path, tmp, weight_type=QuantType.QInt8)
+    os.replace(tmp, path)
+    print(f"⚖️ {os.path.basename(path)} quantizado em int8 ({os.path.getsize(path) / 1e6:.0f} MB)")
+
+
+def export_bundle(export_dir=None, precision="fp32", opset=17):
+    """
+    Exporta para ONNX as torres de visão do Tuned e do Base (com a normalização embutida)
+    e o CLIPSeg (visão + decoder), junto das matrizes de texto e dos embeddings
+    condicionais já calculados. O resultado é carregado por CLIPAIModel(runtime="onnx").
+    Returns:
+        str: Diretório do pacote.
+    """
+    directory = onnx_runtime.bundle_dir(export_dir, precision)
+    os.makedirs(directory, exist_ok=True)
+    t0 = time.perf_counter()
+
+    # Os grafos saem sempre do modelo eager em fp32; int8 é aplicado depois, no próprio ONNX
+    clip = CLIPAIModel(device="cpu", persist_outputs=False, precision="fp32").load()
+    dummy = [Image.new("RGB", (400, 300), (127, 127, 127))] * 2  # lote 2: o eixo do lote não vira constante
+
+    files = []
+    manifest = {
+        "format": onnx_runtime.BUNDLE_FORMAT,
+        "precision": precision,
+        "opset": opset,
+        "created_at": time.time(),
+        "torch": torch.__version__,
+    }
+
+    # 1. Tuned (classificação)
+    pixels = clip.proc_tuned(images=dummy, return_tensors="pt")["pixel_values"]
+    _export(_VisionEmbedder(clip.model_tuned), (pixels,), os.path.join(directory, "tuned_vision.onnx"),
+            ["pixel_values"], ["image_embeds"], opset)
+    files.append("tuned_vision.onnx")
+    np.save(os.path.join(directory, "class_text_matrix.npy"), clip.class_text_matrix.float().cpu().numpy())
+    manifest["tuned"] = {
+        "source": clip.path_tuned,
+        "model": "tuned_vision.onnx",
+        "processor": _processor_config(clip.proc_tuned),
+        "texts": clip.classes_eng,
+        "text_matrix": "class_text_matrix.npy",
+        "logit_scale": float(clip.logit_scale_tuned),
+    }
+
+    # 2. Base (conceitos): reaproveita o grafo do Tuned se a torre de visão for a mesma
+    base_file = "tuned_vision.onnx"
+    if not clip._shares_vision_tower():
+        base_file = "base_vision.onnx"
+        pixels = clip.proc_base(images=dummy, return_tensors="pt")["pixel_values"]
+        _export(_VisionEmbedder(clip.model_base), (pixels,), os.path.join(directory, base_file),
+                ["pixel_values"], ["image_embeds"], opset)
+        files.append(base_file)
+    np.save(os.path.join(directory, "concept_text_matrix.npy"), clip.concept_text_matrix.float().cpu().numpy())
+    manifest["base"] = {
+        "source": clip.path_base,
+        "model": base_file,
+        "processor": _processor_config(clip.proc_base),
+        "texts": clip.concept_prompts,
+        "text_matrix": "concept_text_matrix.npy",
+        "logit_scale": float(clip.logit_scale_base),
+    }
+
+    # 3. CLIPSeg: visão e decoder separados, como em _generate_segmentation_batch
+    seg_pixels = clip.seg_processor(images=dummy, return_tensors="pt")["pixel_values"]
+    seg_vision = _SegVision(clip.seg_model)
+    with torch.no_grad():
+        activations = seg_vision(seg_pixels)
+    activation_names = [f"activation_{i}" for i in range(len(activations))]
+    _export(seg_vision, (seg_pixels,), os.path.join(directory, "clipseg_vision.onnx"),
+            ["pixel_values"], activation_names, opset)
+
+    # Todos os alvos possíveis: âncoras, conceitos sem âncora e o alvo do warm-up
+    prompts = sorted(set(clip.visual_anchors.values()) | set(clip.concepts_eng) | {WARMUP_SEG_PROMPT})
+    prompt_embeds = clip._seg_prompt_embeddings(prompts).float().cpu()
+    _export(_SegDecoder(clip.seg_model), (*activations, prompt_embeds[:2]),
+            os.path.join(directory, "clipseg_decoder.onnx"),
+            activation_names + ["conditional_embeddings"], ["logits"], opset)
+    files += ["clipseg_vision.onnx", "clipseg_decoder.onnx"]
+    np.save(os.path.join(directory, "clipseg_prompts.npy"), prompt_embeds.numpy())
+    manifest["segment"] = {
+        "source": clip.seg_model.name_or_path,
+        "vision": "clipseg_vision.onnx",
+        "decoder": "clipseg_decoder.onnx",
+        "processor": _processor_config(clip.seg_processor),
+        "prompts": prompts,
+        "prompt_embeddings": "clipseg_prompts.npy",
+    }
+
+    if precision == "int8":
+        for name in files:
+            _quantize_int8(os.path.join(directory, name))
+
+    with open(os.path.join(directory, onnx_runtime.MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"✅ Pacote ONNX ({precision}) em {directory} ({time.perf_counter() - t0:.0f}s)")
+    return directory
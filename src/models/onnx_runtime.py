@@ -0,0 +1,195 @@
+import os
+import json
+import threading
+
+import numpy as np
+import torch
+
+# Pacote exportado por models/onnx_export.py: um diretório por precisão com os grafos,
+# as matrizes de texto já calculadas e a configuração dos processadores de imagem.
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exported")
+MANIFEST_NAME = "manifest.json"
+BUNDLE_FORMAT = 1
+ONNX_PRECISIONS = ("fp32", "int8")
+
+# Sessões e processadores compartilhados por arquivo/config (como no model_registry)
+_objects = {}
+_lock = threading.RLock()
+
+
+def bundle_dir(export_dir=None, precision="fp32"):
+    if precision not in ONNX_PRECISIONS:
+        raise ValueError(f"Precisão '{precision}' não suportada no runtime ONNX. Use {ONNX_PRECISIONS}.")
+    return os.path.join(export_dir or DEFAULT_EXPORT_DIR, precision)
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Pacote ONNX não encontrado em {directory}. Gere com: python src/megatruth.py export"
+        )
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Formato do pacote ONNX incompatível ({manifest.get('format')}); exporte novamente.")
+    return manifest
+
+
+def _shared(key, factory):
+    with _lock:
+        if key not in _objects:
+            _objects[key] = factory()
+        return _objects[key]
+
+
+def load_session(path):
+    """InferenceSession de CPU com todas as otimizações de grafo, compartilhada por caminho."""
+    def create():
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        print(f"⚙️ Carregando grafo ONNX: {os.path.basename(path)}")
+        return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    return _shared(("session", os.path.abspath(path)), create)
+
+
+class OnnxImageProcessor:
+    """
+    Pré-processamento do CLIPImageProcessor/ViTImageProcessor refeito em PIL + NumPy
+    a partir da configuração exportada (resize, center crop, rescale e normalização).
+    Mesma chamada do processador do transformers: proc(images=..., return_tensors="pt").
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._mean = np.array(config["image_mean"], dtype=np.float32)
+        self._std = np.array(config["image_std"], dtype=np.float32)
+
+    @property
+    def image_processor(self):
+        return self
+
+    def to_dict(self):
+        return dict(self.config)
+
+    def _resize(self, image):
+        size = self.config["size"]
+        w, h = image.size
+        if "shortest_edge" in size:
+            # Mesma regra do transformers: menor lado = shortest_edge, proporção mantida (truncada)
+            short, long = (w, h) if w <= h else (h, w)
+            new_short, new_long = size["shortest_edge"], int(size["shortest_edge"] * long / short)
+            new_w, new_h = (new_short, new_long) if w <= h else (new_long, new_short)
+        else:
+            new_w, new_h = size["width"], size["height"]
+        return image.resize((new_w, new_h), resample=self.config["resample"])
+
+    def _one(self, image):
+        c = self.config
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if c["do_resize"]:
+            image = self._resize(image)
+        arr = np.asarray(image, dtype=np.float32)
+        if c["do_center_crop"]:
+            crop_h, crop_w = c["crop_size"]["height"], c["crop_size"]["width"]
+            h, w = arr.shape[:2]
+            top, left = max(0, (h - crop_h) // 2), max(0, (w - crop_w) // 2)
+            arr = arr[top:top + crop_h, left:left + crop_w]
+        if c["do_rescale"]:
+            arr = arr * np.float32(c["rescale_factor"])
+        if c["do_normalize"]:
+            arr = (arr - self._mean) / self._std
+        return arr.transpose(2, 0, 1)
+
+    def __call__(self, images=None, return_tensors="pt", **kwargs):
+        if images is None:
+            raise ValueError("O runtime ONNX só pré-processa imagens (o texto já vem calculado no pacote).")
+        images = images if isinstance(images, list) else [images]
+        batch = np.ascontiguousarray(np.stack([self._one(im) for im in images]), dtype=np.float32)
+        return {"pixel_values": torch.from_numpy(batch)}
+
+
+class OnnxVisionTower:
+    """Torre de visão + projeção + normalização em um grafo: pixel_values -> embeddings normalizados."""
+
+    dtype = torch.float32
+
+    def __init__(self, path):
+        self.path = path
+        self.session = load_session(path)
+
+    def encode(self, pixel_values):
+        pixels = pixel_values.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.session.run(None, {"pixel_values": pixels})[0])
+
+
+class OnnxCLIPSeg:
+    """
+    CLIPSeg em dois grafos (visão -> ativações das extract_layers; decoder por par
+    imagem/prompt), com os embeddings condicionais dos alvos do anchors.txt/concepts.txt já calculados.
+    """
+
+    dtype = torch.float32
+
+    def __init__(self, vision_path, decoder_path, prompts, prompt_embeds):
+        self.vision = load_session(vision_path)
+        self.decoder = load_session(decoder_path)
+        self._activation_names = [o.name for o in self.vision.get_outputs()]
+        self._prompt_index = {p: i for i, p in enumerate(prompts)}
+        self._prompt_embeds = prompt_embeds
+
+    def activations(self, pixel_values):
+        pixels = pixel_values.detach().cpu().numpy().astype(np.float32, copy=False)
+        return [torch.from_numpy(a) for a in self.vision.run(None, {"pixel_values": pixels})]
+
+    def decode(self, activations, conditional):
+        feeds = {name: act.numpy() for name, act in zip(self._activation_names, activations)}
+        feeds["conditional_embeddings"] = conditional.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.decoder.run(None, feeds)[0])
+
+    def prompt_embeddings(self, prompts):
+        missing = [p for p in prompts if p not in self._prompt_index]
+        if missing:
+            raise KeyError(f"Prompts do CLIPSeg ausentes no pacote ONNX: {missing}. Exporte novamente.")
+        return torch.from_numpy(self._prompt_embeds[[self._prompt_index[p] for p in prompts]])
+
+
+def load_clip_role(directory, role, expected_texts):
+    """
+    Carrega o papel 'tuned' ou 'base' do pacote.
+    Returns:
+        tuple: (OnnxImageProcessor, OnnxVisionTower, matriz de texto (D, N), logit_scale)
+    Raises:
+        ValueError: Se os textos (classes/conceitos) mudaram desde a exportação.
+    """
+    manifest = read_manifest(directory)
+    entry = manifest[role]
+    if entry["texts"] != list(expected_texts):
+        raise ValueError(
+            f"Os textos de '{role}' mudaram desde a exportação (concepts.txt?). Exporte o pacote novamente."
+        )
+    processor = _shared(("processor", json.dumps(entry["processor"], sort_keys=True)),
+                        lambda: OnnxImageProcessor(entry["processor"]))
+    model_path = os.path.join(directory, entry["model"])
+    tower = _shared(("tower", os.path.abspath(model_path)), lambda: OnnxVisionTower(model_path))
+    text_matrix = torch.from_numpy(np.load(os.path.join(directory, entry["text_matrix"])))
+    return processor, tower, text_matrix, torch.tensor(entry["logit_scale"])
+
+
+def load_clipseg(directory):
+    """Returns: (OnnxImageProcessor, OnnxCLIPSeg) do pacote."""
+    entry = read_manifest(directory)["segment"]
+    processor = _shared(("processor", json.dumps(entry["processor"], sort_keys=True)),
+                        lambda: OnnxImageProcessor(entry["processor"]))
+
+    def create():
+        return OnnxCLIPSeg(
+            os.path.join(directory, entry["vision"]),
+            os.path.join(directory, entry["decoder"]),
+            entry["prompts"],
+            np.load(os.path.join(directory, entry["prompt_embeddings"])),
+        )
+    return processor, _shared(("clipseg", os.path.abspath(directory)), create)
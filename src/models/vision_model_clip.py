@@ -3,67 +3,101 @@ import numpy as np
 from PIL import Image
 import cv2
 import os
+import time
+import json
+import hashlib
+import threading
 import warnings
-from transformers import CLIPProcessor, CLIPModel, CLIPSegProcessor, CLIPSegForImageSegmentation
+
+from models import model_registry, onnx_runtime
+from pipeline import image_io, telemetry
+from pipeline.paths import overlay_filename
 
 warnings.filterwarnings("ignore", category=UserWarning, message=".*cuBLAS.*")
 
+BASE_MODEL_ID = "openai/clip-vit-base-patch16"
+SEG_MODEL_ID = "CIDAS/clipseg-rd64-refined"
+CONTROL_PROMPT = "a high quality natural photograph"
+TEXT_CACHE_DIR = os.path.join("outputs", "cache", "text_embeddings")
+
+STAGES = ("classify", "concepts", "segment")
+# Conceitos rodam nas imagens classificadas como IA ou com confiança abaixo disto
+SUSPECT_MAX_PROB = 0.85
+# Gating dos conceitos: probabilidade mínima quando a imagem foi classificada como real / como IA
+CONCEPT_THRESHOLD_REAL = 0.25
+CONCEPT_THRESHOLD_FAKE = 0.10
+RUNTIMES = ("torch", "onnx")
+
 class CLIPAIModel:
-    def __init__(self, model_path=None, device=None):
+    def __init__(self, model_path=None, device=None, stages=None, lazy=True, persist_outputs=True,
+                 max_side=None, precision="fp32", runtime="torch", export_dir=None):
+        """
+        Args:
+            model_path (str): Força o checkpoint do classificador (ex: BASE_MODEL_ID).
+            device (str): 'cuda' ou 'cpu' (padrão: automático).
+            stages (iterable): Estágios habilitados entre 'classify', 'concepts' e 'segment'.
+                A classificação é sempre habilitada; ex: ("classify",) para réplicas leves.
+            lazy (bool): Se True, cada modelo só é carregado no primeiro uso (ou em warmup()).
+            persist_outputs (bool): Se False, o overlay só é devolvido em memória
+                (`overlay_image`) e nada é gravado em outputs/defect_maps.
+            max_side (int): Lado maior da cópia de trabalho (overlay). JPEGs são
+                decodificados já reduzidos. Padrão None: resolução original (scan,
+                predict_batch); a interface e a API usam image_io.DISPLAY_MAX_SIDE.
+            precision (str): Só em CPU: 'fp32' (padrão), 'bf16' ou 'int8' (quantização
+                dinâmica das camadas Linear). Meça antes com src/test/precision_regression.py.
+            runtime (str): 'torch' (eager) ou 'onnx' (grafos de `megatruth.py export`, só CPU,
+                sem importar o transformers). No ONNX, precision escolhe o pacote: 'fp32' ou 'int8'.
+            export_dir (str): Raiz dos pacotes ONNX (padrão: src/models/exported).
+        """
         self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
         print(f"🔧 Dispositivo de Inferência: {self.device}")
         
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Runtime desconhecido: {runtime}. Use {RUNTIMES}.")
+        self.runtime = runtime
+        if runtime == "onnx" and self.device != "cpu":
+            print(f"⚠️ O runtime ONNX roda em CPU; ignorando device={self.device}.")
+            self.device = "cpu"
+
         if self.device == "cuda":
             torch.cuda.current_device()
+        self.precision = model_registry.resolve_precision(precision, self.device)
+        if self.precision != "fp32":
+            print(f"⚖️ Precisão reduzida em CPU: {self.precision}")
+        if runtime == "onnx":
+            self.bundle_dir = onnx_runtime.bundle_dir(export_dir, self.precision)
+            print(f"⚙️ Runtime ONNX: {self.bundle_dir}")
+
+        self.stages = set(stages) if stages else set(STAGES)
+        invalid = self.stages - set(STAGES)
+        if invalid:
+            raise ValueError(f"Estágios desconhecidos: {sorted(invalid)}. Use {STAGES}.")
+        self.stages.add("classify")
+        print(f"🧩 Estágios habilitados: {[s for s in STAGES if s in self.stages]}")
 
         # 1. Carrega Arquivos de Configuração (Conceitos e Âncoras)
         self._load_configurations()
+        self.concept_prompts = self.concepts_eng + [CONTROL_PROMPT]
 
-        # 2. Modelo Tuned (O Juiz - Classificação)
+        # 2. Resolve o caminho do Tuned (o carregamento em si é sob demanda)
         base_dir = os.path.dirname(os.path.abspath(__file__))
         default_path = os.path.join(base_dir, "clip_finetuned")
-        path_tuned = "openai/clip-vit-base-patch16" # Fallback
+        self.path_tuned = BASE_MODEL_ID # Fallback
 
-        if os.path.exists(default_path) and model_path != "openai/clip-vit-base-patch16":
-            path_tuned = default_path
-            print(f"🧠 Usando modelo Fine-Tuned (Especialista): {path_tuned}")
+        if os.path.exists(default_path) and model_path != BASE_MODEL_ID:
+            self.path_tuned = default_path
+            print(f"🧠 Usando modelo Fine-Tuned (Especialista): {self.path_tuned}")
         else:
             print("⚠️ Modelo Fine-Tuned não encontrado. Usando Base para tudo.")
+        self.path_base = BASE_MODEL_ID
 
-        try:
-            self.proc_tuned = CLIPProcessor.from_pretrained(path_tuned, use_fast=True)
-            self.model_tuned = CLIPModel.from_pretrained(
-                path_tuned,
-                dtype=torch.float16 if self.device == "cuda" else torch.float32
-            ).to(self.device)
-            self.model_tuned.eval()
-        except Exception as e:
-            print(f"Erro crítico ao carregar modelo Tuned: {e}")
-            raise e
-        
-        # 3. Modelo Base (O Semântico - Conceitos)
-        print("👁️ Carregando Modelo Base (Conceitos)...")
-        try:
-            self.proc_base = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch16", use_fast=True)
-            self.model_base = CLIPModel.from_pretrained(
-                "openai/clip-vit-base-patch16",
-                dtype=torch.float16 if self.device == "cuda" else torch.float32
-            ).to(self.device)
-            self.model_base.eval()
-        except Exception as e:
-             print(f"Erro ao carregar modelo Base: {e}")
-             self.model_base = self.model_tuned
-             self.proc_base = self.proc_tuned
-
-        # 4. CLIPSeg (O Desenhista - defect_maps Precisos)
-        print("🎨 Carregando CLIPSeg (Segmentação Visual)...")
-        try:
-            self.seg_processor = CLIPSegProcessor.from_pretrained("CIDAS/clipseg-rd64-refined", use_fast=True)
-            self.seg_model = CLIPSegForImageSegmentation.from_pretrained("CIDAS/clipseg-rd64-refined").to(self.device)
-            self.seg_model.eval()
-        except Exception as e:
-            print(f"❌ Erro ao baixar CLIPSeg: {e}")
-            raise e
+        # Sub-modelos carregados sob demanda (ver propriedades abaixo)
+        self._load_lock = threading.RLock()
+        self._model_tuned = self._proc_tuned = None
+        self._model_base = self._proc_base = None
+        self._seg_model = self._seg_processor = None
+        self._shared_pixels = None
+        self._seg_prompt_cache = {}
         
         # Classes internas em Inglês para o CLIP
         self.classes_eng = ["a real photograph", "an AI-generated image"]
@@ -74,6 +108,194 @@ class CLIPAIModel:
             "an AI-generated image": "Imagem Gerada por IA"
         }
 
+        # Estatísticas de vazão da última chamada a predict_batch
+        self.last_batch_stats = None
+        self.persist_outputs = persist_outputs
+        self.max_side = max_side
+
+        if not lazy:
+            self.load()
+
+    # ------------------------------------------------------------------
+    # Carregamento sob demanda
+    # ------------------------------------------------------------------
+    @property
+    def model_tuned(self):
+        if self._model_tuned is None:
+            self._load_tuned()
+        return self._model_tuned
+
+    @property
+    def proc_tuned(self):
+        if self._proc_tuned is None:
+            self._load_tuned()
+        return self._proc_tuned
+
+    @property
+    def model_base(self):
+        if self._model_base is None:
+            self._load_base()
+        return self._model_base
+
+    @property
+    def proc_base(self):
+        if self._proc_base is None:
+            self._load_base()
+        return self._proc_base
+
+    @property
+    def seg_model(self):
+        if self._seg_model is None:
+            self._load_segmentation()
+        return self._seg_model
+
+    @property
+    def seg_processor(self):
+        if self._seg_processor is None:
+            self._load_segmentation()
+        return self._seg_processor
+
+    def _load_tuned(self):
+        """Modelo Tuned (O Juiz - Classificação) + matriz de texto das classes."""
+        with self._load_lock:
+            if self._model_tuned is not None:
+                return
+            t0 = time.perf_counter()
+            if self.runtime == "onnx":
+                # Matriz de texto e escala vêm prontas do pacote exportado
+                proc, model, self.class_text_matrix, self.logit_scale_tuned = onnx_runtime.load_clip_role(
+                    self.bundle_dir, "tuned", self.classes_eng
+                )
+            else:
+                try:
+                    proc, model = model_registry.load_clip(self.path_tuned, self.device, self.precision)
+                except Exception as e:
+                    print(f"Erro crítico ao carregar modelo Tuned: {e}")
+                    raise e
+
+                # O texto é fixo, então cada requisição só precisa rodar a torre de visão.
+                self.class_text_matrix = self._load_text_embeddings(
+                    "classes", model, proc, self.path_tuned, self.classes_eng
+                )
+                self.logit_scale_tuned = model.logit_scale.exp().detach()
+            self._proc_tuned = proc
+            self._model_tuned = model
+            print(f"🧠 Modelo Tuned pronto em {time.perf_counter() - t0:.1f}s")
+
+    def _load_base(self):
+        """Modelo Base (O Semântico - Conceitos) + matriz de texto dos conceitos."""
+        with self._load_lock:
+            if self._model_base is not None:
+                return
+            print("👁️ Carregando Modelo Base (Conceitos)...")
+            t0 = time.perf_counter()
+            # Sem o Fine-Tuned, path_tuned == BASE_MODEL_ID e o registro devolve o mesmo objeto
+            tuned = self.model_tuned
+            if self.runtime == "onnx":
+                # Se a torre de visão é a mesma do Tuned, o pacote aponta para o mesmo grafo (mesma sessão)
+                proc, model, self.concept_text_matrix, self.logit_scale_base = onnx_runtime.load_clip_role(
+                    self.bundle_dir, "base", self.concept_prompts
+                )
+                self._proc_base = proc
+                self._model_base = model
+                print(f"👁️ Modelo Base pronto em {time.perf_counter() - t0:.1f}s")
+                return
+            try:
+                proc, model = model_registry.load_clip(BASE_MODEL_ID, self.device, self.precision)
+            except Exception as e:
+                print(f"Erro ao carregar modelo Base: {e}")
+                model = tuned
+                proc = self.proc_tuned
+                self.path_base = self.path_tuned
+
+            if model is not tuned:
+                shared = model_registry.share_identical_submodules(tuned, model)
+                if shared:
+                    print(f"♻️ Base e Tuned compartilham pesos idênticos: {shared}")
+
+            self.concept_text_matrix = self._load_text_embeddings(
+                "concepts", model, proc, self.path_base, self.concept_prompts
+            )
+            self.logit_scale_base = model.logit_scale.exp().detach()
+            self._proc_base = proc
+            self._model_base = model
+            print(f"👁️ Modelo Base pronto em {time.perf_counter() - t0:.1f}s")
+
+    def _load_segmentation(self):
+        """CLIPSeg (O Desenhista - defect_maps Precisos)."""
+        with self._load_lock:
+            if self._seg_model is not None:
+                return
+            print("🎨 Carregando CLIPSeg (Segmentação Visual)...")
+            t0 = time.perf_counter()
+            try:
+                if self.runtime == "onnx":
+                    processor, model = onnx_runtime.load_clipseg(self.bundle_dir)
+                else:
+                    processor, model = model_registry.load_clipseg(SEG_MODEL_ID, self.device, self.precision)
+            except Exception as e:
+                print(f"❌ Erro ao baixar CLIPSeg: {e}")
+                raise e
+            self._seg_processor = processor
+            self._seg_model = model
+            print(f"🎨 CLIPSeg pronto em {time.perf_counter() - t0:.1f}s")
+
+    def _pixels_are_shared(self):
+        """Se os dois processadores aplicam o mesmo resize/normalização, o tensor de pixels é compartilhado."""
+        if self._shared_pixels is None:
+            self._shared_pixels = (
+                self.proc_base is self.proc_tuned
+                or self.proc_base.image_processor.to_dict() == self.proc_tuned.image_processor.to_dict()
+            )
+        return self._shared_pixels
+
+    def _shares_vision_tower(self):
+        """True se Base e Tuned usam a mesma torre de visão (embeddings idênticos)."""
+        base, tuned = self.model_base, self.model_tuned
+        return base is tuned or (
+            isinstance(base, torch.nn.Module)
+            and base.vision_model is tuned.vision_model and base.visual_projection is tuned.visual_projection
+        )
+
+    def load(self):
+        """Carrega imediatamente todos os modelos dos estágios habilitados."""
+        self._load_tuned()
+        if "concepts" in self.stages:
+            self._load_base()
+        if "segment" in self.stages:
+            self._load_segmentation()
+        return self
+
+    def warmup(self):
+        """
+        Carrega os estágios habilitados e roda um forward fictício em cada modelo,
+        para que a primeira requisição real não pague inicialização de kernels/alocações.
+        Returns:
+            dict: Segundos gastos por estágio (carregamento + forward).
+        """
+        dummy = Image.new("RGB", (224, 224), (127, 127, 127))
+        timings = {}
+
+        t0 = time.perf_counter()
+        pixels_tuned, pixels_base = self._preprocess(dummy)
+        tuned_embeds = self._encode_images(self.model_tuned, pixels_tuned)
+        self._zero_shot_probs(tuned_embeds, self.class_text_matrix, self.logit_scale_tuned)
+        timings["classify"] = time.perf_counter() - t0
+
+        if "concepts" in self.stages:
+            t0 = time.perf_counter()
+            base_embeds = self._encode_images(self.model_base, pixels_base)
+            self._zero_shot_probs(base_embeds, self.concept_text_matrix, self.logit_scale_base)
+            timings["concepts"] = time.perf_counter() - t0
+
+        if "segment" in self.stages:
+            t0 = time.perf_counter()
+            self._generate_segmentation_batch([dummy], [["hand"]])
+            timings["segment"] = time.perf_counter() - t0
+
+        print("🔥 Warm-up concluído: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+        return timings
+
     def _load_configurations(self):
         """Lê os arquivos txt de conceitos e âncoras para memória."""
         self.concepts_eng = []      # Lista para o CLIP (Inglês)
@@ -109,145 +331,326 @@ class CLIPAIModel:
         except Exception as e:
             print(f"⚠️ Erro ao carregar anchors.txt: {e}")
 
-    def _generate_segmentation(self, image, prompts):
+    def _model_revision(self, model_path, model):
+        """Identifica a versão dos pesos (commit do Hub ou assinatura da pasta local)."""
+        commit = getattr(getattr(model, "config", None), "_commit_hash", None)
+        if commit:
+            return commit
+
+        if os.path.isdir(model_path):
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(model_path)):
+                full = os.path.join(model_path, name)
+                if os.path.isfile(full):
+                    st = os.stat(full)
+                    h.update(f"{name}:{st.st_size}:{int(st.st_mtime)}".encode("utf-8"))
+            return h.hexdigest()
+
+        return model_path
+
+    def cache_namespace(self):
         """
-        Usa CLIPSeg para gerar máscaras precisas.
+        Identifica as saídas deste modelo em caches persistentes de resultados: checkpoint e
+        sua revisão, precisão, runtime e estágios. Retreinar em clip_finetuned ou trocar
+        para int8/bf16/ONNX muda o namespace, e os resultados antigos deixam de valer.
         """
-        inputs = self.seg_processor(
-            text=prompts, 
-            images=[image] * len(prompts), 
-            padding=True, 
-            return_tensors="pt"
-        ).to(self.device)
+        if self.runtime == "onnx":
+            revision = self._model_revision(self.bundle_dir, None)
+        else:
+            # Pasta local: assinatura dos arquivos, sem carregar o modelo
+            revision = self._model_revision(self.path_tuned, self._model_tuned)
+        return "|".join([self.path_tuned, revision[:16], self.precision, self.runtime,
+                         ",".join(sorted(self.stages))])
+
+    def _load_text_embeddings(self, role, model, processor, model_path, texts):
+        """
+        Retorna a matriz (D, N) de embeddings de texto normalizados, já transposta
+        e no dispositivo/dtype do modelo.
+        O cache em disco é chaveado pela revisão do modelo e pelo hash dos prompts
+        (que vêm do concepts.txt), então editar o arquivo invalida o cache.
+        """
+        key_parts = [model_path, self._model_revision(model_path, model), str(model.dtype), texts]
+        if self.precision != "fp32":
+            key_parts.append(self.precision)  # int8 mantém o dtype float32, mas muda os embeddings
+        key_src = json.dumps(key_parts)
+        key = hashlib.sha256(key_src.encode("utf-8")).hexdigest()
+        cache_file = os.path.join(TEXT_CACHE_DIR, f"{role}_{key[:16]}.pt")
+
+        embeds = None
+        if os.path.exists(cache_file):
+            try:
+                cached = torch.load(cache_file, map_location="cpu")
+                if cached.get("key") == key:
+                    embeds = cached["embeds"]
+                    print(f"⚡ Embeddings de texto ({role}) carregados do cache.")
+                    telemetry.count("megatruth_cache_events_total", cache="text_embeddings", event="hit")
+            except Exception as e:
+                print(f"⚠️ Cache de embeddings inválido ({cache_file}): {e}")
+
+        if embeds is None:
+            telemetry.count("megatruth_cache_events_total", cache="text_embeddings", event="miss")
+            embeds = self._encode_texts(model, processor, texts).float().cpu()
+            try:
+                os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+                torch.save({"key": key, "texts": texts, "embeds": embeds}, cache_file)
+            except OSError as e:
+                print(f"⚠️ Não foi possível salvar o cache de embeddings: {e}")
+
+        return embeds.to(self.device, dtype=model.dtype).T.contiguous()
+
+    def _encode_texts(self, model, processor, texts):
+        """Roda apenas a torre de texto e devolve embeddings normalizados."""
+        inputs = processor(text=texts, return_tensors="pt", padding=True, truncation=True).to(self.device)
+
+        with torch.no_grad():
+            text_out = model.text_model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+            embeds = model.text_projection(text_out.pooler_output)
+        return embeds / embeds.norm(dim=-1, keepdim=True)
+
+    def _encode_images(self, model, pixel_values):
+        """Roda apenas a torre de visão e devolve embeddings normalizados."""
+        if self.runtime == "onnx":
+            return model.encode(pixel_values)  # projeção e normalização já estão no grafo
+        with torch.no_grad():
+            # non_blocking aproveita tensores em memória fixada (pinned) vindos do pipeline de pré-processamento
+            pixel_values = pixel_values.to(self.device, non_blocking=True).to(model.dtype)
+            vision_out = model.vision_model(pixel_values=pixel_values)
+            embeds = model.visual_projection(vision_out.pooler_output)
+        return embeds / embeds.norm(dim=-1, keepdim=True)
 
+    def _zero_shot_probs(self, image_embeds, text_matrix, logit_scale):
+        """Softmax sobre (escala * imagem @ texto), igual ao logits_per_image do CLIP."""
         with torch.no_grad():
-            outputs = self.seg_model(**inputs)
+            logits = logit_scale * (image_embeds @ text_matrix)
+            return logits.float().softmax(dim=-1).cpu().numpy()
+
+    def _load_image(self, image):
+        """
+        Normaliza a entrada para a cópia de trabalho (PIL RGB, lado maior <= max_side),
+        decodificada uma única vez. Aceita caminho, PIL.Image, array NumPy (RGB) ou o
+        par (imagem, caminho) de uma imagem já decodificada em outra thread (preserva
+        o nome do overlay). Retorna (imagem, caminho_de_origem ou None).
+        """
+        if isinstance(image, tuple):
+            decoded, path = image
+            return self._load_image(decoded)[0], path
+        path = os.fspath(image) if isinstance(image, (str, os.PathLike)) else None
+        return image_io.to_pil(image, max_side=self.max_side), path
+
+    def _preprocess(self, image):
+        """
+        Gera os tensores de pixels das torres Tuned e Base (o mesmo tensor quando possível).
+        pixels_base é None se o estágio de conceitos estiver desabilitado.
+        Os processadores recebem a cópia reduzida a 352 px no menor lado.
+        """
+        image = [image_io.model_copy(im) for im in image] if isinstance(image, list) else image_io.model_copy(image)
+        pixels_tuned = self.proc_tuned(images=image, return_tensors="pt")["pixel_values"]
+        if "concepts" not in self.stages:
+            return pixels_tuned, None
+        if self._pixels_are_shared():
+            return pixels_tuned, pixels_tuned
+        pixels_base = self.proc_base(images=image, return_tensors="pt")["pixel_values"]
+        return pixels_tuned, pixels_base
+
+    def _concepts_from_probs(self, probs, classificacao_preliminar=None):
+        """Aplica o gating sobre as probabilidades (conceitos + controle) de uma imagem."""
+        # Gating
+        if classificacao_preliminar == "a real photograph" or classificacao_preliminar == 0:
+            threshold = CONCEPT_THRESHOLD_REAL
+        else:
+            threshold = CONCEPT_THRESHOLD_FAKE
+
+        resultado = {}
         
-        preds = outputs.logits
+        # Varre apenas os conceitos (ignora o último que é o controle)
+        for i in range(len(self.concepts_eng)):
+            if probs[i] > threshold: 
+                resultado[self.concepts_eng[i]] = float(probs[i])
         
-        if len(preds.shape) == 2:
-            preds = preds.unsqueeze(0)
-            
-        masks = torch.sigmoid(preds).cpu().numpy()
+        return dict(sorted(resultado.items(), key=lambda item: item[1], reverse=True))
+
+    def _score_concepts(self, base_embeds, classificacao_preliminar=None):
+        """Aplica o gating de conceitos sobre um embedding já calculado pela torre Base."""
+        probs = self._zero_shot_probs(base_embeds, self.concept_text_matrix, self.logit_scale_base)[0]
+        return self._concepts_from_probs(probs, classificacao_preliminar)
+
+    def _visual_target(self, conceitos_eng):
+        """Converte o conceito mais forte no alvo visual do CLIPSeg (via anchors.txt)."""
+        if not conceitos_eng:
+            return None
+
+        original_concept = next(iter(conceitos_eng)) # Ex: "deformed fingers"
         
-        w, h = image.size
-        final_mask = np.zeros((h, w), dtype=np.float32)
+        # Busca âncora visual
+        visual_target = original_concept
+        for key, val in self.visual_anchors.items():
+            if key in original_concept.lower():
+                visual_target = val
+                break
         
-        for mask in masks:
-            if mask.ndim > 2:
-                mask = np.squeeze(mask)
-            mask_resized = cv2.resize(mask, (w, h))
-            final_mask = np.maximum(final_mask, mask_resized)
-            
-        return final_mask
+        print(f"   >>> CLIPSeg Alvo: '{visual_target}' (Origem: {original_concept})")
+        return visual_target
 
-    def predict_with_defect_map(self, image_path, overlay_color="red"):
+    @telemetry.traced("generate_segmentation")
+    def _generate_segmentation(self, image, prompts):
         """
-        Pipeline principal: Classifica -> Analisa Conceitos -> Gera defect_map -> Traduz Saída.
-        Args:
-            image_path (str): Caminho da imagem.
-            overlay_color (str): 'red', 'green', ou 'blue'. Define a cor da mancha.
+        Usa CLIPSeg para gerar máscaras precisas.
         """
-        os.makedirs("outputs/defect_maps", exist_ok=True)
-        image = Image.open(image_path).convert("RGB")
-        
-        # --- 1. Classificação (Tuned - Inglês) ---
-        inputs = self.proc_tuned(
-            text=self.classes_eng, 
-            images=image, 
-            return_tensors="pt", 
-            padding=True
-        ).to(self.device)
+        return self._generate_segmentation_batch([image], [prompts])[0]
 
-        with torch.no_grad():
-            outputs = self.model_tuned(**inputs)
-            probs = outputs.logits_per_image.softmax(dim=1).cpu().numpy()[0]
-            pred_idx = int(np.argmax(probs))
-            label_eng = self.classes_eng[pred_idx]
-            prob = float(probs[pred_idx])
-
-        # --- 2. Definição dos Prompts para o CLIPSeg ---
-        # Prompts padrão (fallback)
-        seg_prompts = None
-        conceitos_eng = {}
+    def _seg_prompt_embeddings(self, prompts):
+        """
+        Embeddings condicionais (texto) do CLIPSeg. Os alvos vêm do anchors.txt,
+        então cada prompt é codificado uma única vez e reaproveitado.
+        """
+        if self.runtime == "onnx":
+            return self.seg_model.prompt_embeddings(prompts)  # calculados na exportação
+        missing = [p for p in dict.fromkeys(prompts) if p not in self._seg_prompt_cache]
+        telemetry.count("megatruth_cache_events_total", len(prompts) - len(missing), cache="seg_prompts", event="hit")
+        if missing:
+            telemetry.count("megatruth_cache_events_total", len(missing), cache="seg_prompts", event="miss")
+            text_inputs = self.seg_processor(text=missing, padding=True, return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                embeds = self.seg_model.get_conditional_embeddings(
+                    batch_size=len(missing),
+                    input_ids=text_inputs["input_ids"],
+                    attention_mask=text_inputs["attention_mask"],
+                )
+            for prompt, embed in zip(missing, embeds):
+                self._seg_prompt_cache[prompt] = embed
+        return torch.stack([self._seg_prompt_cache[p] for p in prompts])
+
+    def _generate_segmentation_batch(self, images, prompts_per_image, upsample=True):
+        """
+        Gera as máscaras do CLIPSeg para várias imagens.
+        A torre de visão roda uma vez por imagem; só o decoder (leve) roda por par
+        (imagem, prompt), reaproveitando as ativações. O máximo entre os prompts é
+        tirado na resolução nativa (352x352) e cada imagem é redimensionada uma única vez.
+        Com upsample=False as máscaras ficam em 352x352 (o _render_overlay faz o resize).
+        Retorna uma máscara por imagem (None se não houver prompts).
+        """
+        pairs = [(i, prompt) for i, prompts in enumerate(prompts_per_image) for prompt in prompts]
+        final_masks = [None] * len(images)
+        if not pairs:
+            return final_masks
+
+        seg_indices = sorted({i for i, _ in pairs})
+        with telemetry.span("segment", images=len(seg_indices), prompts=len(pairs)):
+            position = {i: k for k, i in enumerate(seg_indices)}
+            pixel_values = self.seg_processor(
+                images=[image_io.model_copy(images[i]) for i in seg_indices],
+                return_tensors="pt"
+            )["pixel_values"].to(self.device, dtype=self.seg_model.dtype)
+
+            with torch.no_grad():
+                # 1. Visão: uma passada por imagem (mesmas camadas que o CLIPSeg usa internamente)
+                if self.runtime == "onnx":
+                    activations = self.seg_model.activations(pixel_values)
+                else:
+                    vision_out = self.seg_model.clip.vision_model(pixel_values=pixel_values, output_hidden_states=True)
+                    activations = [vision_out.hidden_states[layer + 1] for layer in self.seg_model.extract_layers]
+
+                # 2. Decoder: uma linha por par (imagem, prompt), sem recodificar a imagem
+                rows = torch.tensor([position[i] for i, _ in pairs], device=pixel_values.device)
+                pair_activations = tuple(act.index_select(0, rows) for act in activations)
+                conditional = self._seg_prompt_embeddings([prompt for _, prompt in pairs]).to(pair_activations[0].dtype)
+                if self.runtime == "onnx":
+                    logits = self.seg_model.decode(pair_activations, conditional)
+                else:
+                    logits = self.seg_model.decoder(pair_activations, conditional, return_dict=True).logits
+
+                if logits.ndim == 2:
+                    logits = logits.unsqueeze(0)
+                probs = torch.sigmoid(logits)
+
+                # 3. Máximo entre os prompts de cada imagem, ainda em 352x352
+                native = torch.stack([probs[rows == k].amax(dim=0) for k in range(len(seg_indices))])
         
-        # Se for FAKE ou incerto, buscamos o defeito específico
-        if pred_idx == 1 or prob < 0.85:
-            # Analisa conceitos (retorna dict em Inglês)
-            conceitos_eng = self.analisar_conceitos(image_path, classificacao_preliminar=label_eng)
-            
-            if conceitos_eng:
-                original_concept = list(conceitos_eng.keys())[0] # Ex: "deformed fingers"
-                
-                # Busca âncora visual
-                visual_target = original_concept
-                for key, val in self.visual_anchors.items():
-                    if key in original_concept.lower():
-                        visual_target = val
-                        break
-                
-                print(f"   >>> CLIPSeg Alvo: '{visual_target}' (Origem: {original_concept})")
-                seg_prompts = [visual_target]
-
-        # --- 3. Geração da Máscara ---
-        if seg_prompts and len(seg_prompts) > 0:
-            print(f"   >>> Gerando Segmentação para: {seg_prompts}")
-            defect_map = self._generate_segmentation(image, seg_prompts)
-
-            # --- 4. Pós-Processamento Visual ---
-            defect_map_min = np.min(defect_map)
-            defect_map_max = np.max(defect_map)
-            if defect_map_max > defect_map_min:
-                defect_map = (defect_map - defect_map_min) / (defect_map_max - defect_map_min)
+            native = native.float().cpu().numpy()
+        
+        for k, i in enumerate(seg_indices):
+            if upsample:
+                w, h = images[i].size
+                final_masks[i] = cv2.resize(native[k], (w, h))
             else:
-                defect_map = np.zeros_like(defect_map)
+                final_masks[i] = native[k]
             
-            # limiarização de 0.35 para  reduzir o ruído e manter apenas as áreas mais relevantes
-            defect_map[defect_map < 0.35] = 0
+        return final_masks
 
-            # --- SUAVIZAÇÃO ADAPTATIVA (Dinâmica) ---
-            h, w = defect_map.shape
-            # Define o kernel como 3% da menor dimensão da imagem
-            k_size = int(min(h, w) * 0.03)
-            
-            # O kernel precisa ser ímpar e ter tamanho mínimo de 3
-            if k_size % 2 == 0:
-                k_size += 1
-            if k_size < 3:
-                k_size = 3
-                
-            defect_map_smooth = cv2.GaussianBlur(defect_map, (k_size, k_size), 0)
-
-            # --- 5. GERAÇÃO DO OVERLAY COLORIDO ---
-            img_np = np.array(image)
-            color_mask = np.zeros_like(img_np)
-            
-            # Define a cor da máscara (RGB aqui, pois o PIL abriu como RGB)
-            if overlay_color == "green":
-                color_mask[:, :, 1] = 255  # Canal G (Verde)
-            elif overlay_color == "blue":
-                color_mask[:, :, 2] = 255  # Canal B (Azul)
-            else: # Default: Red
-                color_mask[:, :, 0] = 255  # Canal R (Vermelho)
-            
-            img_float = img_np.astype(np.float32) / 255.0
-            mask_float = color_mask.astype(np.float32) / 255.0
-            alpha = defect_map_smooth[:, :, None]
-            
-            # Mistura: (Cor * alpha) + (Imagem * (1 - alpha*0.3))
-            # O fator 0.3 no alpha negativo mantém a imagem original visível por baixo
-            overlay = (mask_float * alpha * 0.6) + (img_float * (1.0 - (alpha * 0.3)))
-            overlay = np.clip(overlay * 255, 0, 255).astype(np.uint8)
-            
-            # Converte RGB -> BGR para o OpenCV salvar corretamente
-            overlay_bgr = cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR)
-            
-            base = os.path.basename(image_path)
-            overlay_path = f"outputs/defect_maps/{base}_clipseg.png"
-            cv2.imwrite(overlay_path, overlay_bgr)
-            
+    @staticmethod
+    def _render_overlay(image, defect_map, overlay_color="red"):
+        """
+        Normaliza, suaviza e mistura o defect_map sobre a imagem. Retorna o overlay em RGB (uint8).
+
+        Todo o pós-processamento da máscara (normalização, limiar, blur) roda na
+        resolução da máscara (352x352 do CLIPSeg) e só o alpha final é ampliado,
+        uma única vez, como uint8. A mistura é feita em uint8 sobre o array de 3 canais
+        (uma cópia da imagem, que é o overlay devolvido, e um buffer de pesos), sem
+        separar os canais nem criar cópias float32 da imagem inteira.
+        """
+        w, h = image.size
+
+        # --- 4. Pós-Processamento Visual (na resolução da máscara) ---
+        defect_map = np.array(defect_map, dtype=np.float32)
+        defect_map_min = float(defect_map.min())
+        defect_map_max = float(defect_map.max())
+        if defect_map_max > defect_map_min:
+            defect_map -= defect_map_min
+            defect_map *= 1.0 / (defect_map_max - defect_map_min)
         else:
-            overlay_path = image_path  # Sem overlay gerado
+            defect_map.fill(0)
+        
+        # limiarização de 0.35 para  reduzir o ruído e manter apenas as áreas mais relevantes
+        defect_map[defect_map < 0.35] = 0
+
+        # --- SUAVIZAÇÃO ADAPTATIVA (Dinâmica) ---
+        # Kernel = 3% da menor dimensão da imagem final, convertido para a escala de cada eixo da máscara
+        mh, mw = defect_map.shape
+        k_full = min(h, w) * 0.03
+
+        def odd_kernel(size):
+            # O kernel precisa ser ímpar e ter tamanho mínimo de 3
+            size = int(size)
+            if size % 2 == 0:
+                size += 1
+            return max(size, 3)
+
+        k_x = odd_kernel(k_full * mw / w)
+        k_y = odd_kernel(k_full * mh / h)
+        cv2.GaussianBlur(defect_map, (k_x, k_y), 0, dst=defect_map)
+
+        # Único upsample: alpha em uint8 (0-255) na resolução da imagem
+        alpha8 = cv2.resize(cv2.convertScaleAbs(defect_map, alpha=255.0), (w, h), interpolation=cv2.INTER_LINEAR)
+
+        # --- 5. GERAÇÃO DO OVERLAY COLORIDO ---
+        # Mistura: (Cor * alpha * 0.6) + (Imagem * (1 - alpha*0.3))
+        # O fator 0.3 no alpha negativo mantém a imagem original visível por baixo
+        keep8 = cv2.addWeighted(alpha8, -0.3, alpha8, 0.0, 255.0)  # 255 * (1 - 0.3 * alpha)
+
+        # Define a cor da máscara (RGB aqui, pois o PIL abriu como RGB)
+        color_channel = {"green": 1, "blue": 2}.get(overlay_color, 0)  # Default: Red
+
+        out = np.array(image, dtype=np.uint8)  # (H, W, 3): vira o overlay devolvido
+        weights = cv2.merge((keep8, keep8, keep8))
+        cv2.multiply(out, weights, dst=out, scale=1.0 / 255.0)
+        # O mesmo buffer vira a camada de cor: só o canal escolhido recebe 0.6 * alpha
+        weights.fill(0)
+        weights[..., color_channel] = cv2.convertScaleAbs(alpha8, alpha=0.6)
+        return cv2.add(out, weights, dst=out)
+
+    def _save_overlay(self, overlay_image, image_path, index=0):
+        """Grava o overlay (RGB) em outputs/defect_maps e devolve o caminho."""
+        os.makedirs("outputs/defect_maps", exist_ok=True)
+        name = overlay_filename(image_path) if image_path else f"memory_{int(time.time() * 1000)}_{index}_clipseg.png"
+        overlay_path = f"outputs/defect_maps/{name}"
+        # Converte RGB -> BGR para o OpenCV salvar corretamente
+        cv2.imwrite(overlay_path, cv2.cvtColor(overlay_image, cv2.COLOR_RGB2BGR))
+        return overlay_path
+
+    def _build_result(self, probs, conceitos_eng, overlay_path, overlay_color, overlay_image=None):
+        """Monta o dicionário de saída (PT-BR) a partir das probabilidades e conceitos."""
+        pred_idx = int(np.argmax(probs))
+        label_eng = self.classes_eng[pred_idx]
 
         # --- 6. TRADUÇÃO PARA SAÍDA (PT-BR) ---
         label_pt = self.classes_pt_map.get(label_eng, label_eng)
@@ -261,52 +664,251 @@ class CLIPAIModel:
 
         return {
             "label": label_pt,
-            "probability": prob, 
+            "probability": float(probs[pred_idx]), 
             "probabilities": probs_pt,
             "defect_map_path": overlay_path,
             "overlay_path": overlay_path, 
             "conceitos": conceitos_pt,
-            "color_used": overlay_color 
+            "color_used": overlay_color,
+            "overlay_image": overlay_image
+        }
+
+    def score_pixels(self, pixels_tuned, pixels_base=None):
+        """
+        Classificação + conceitos de um lote já pré-processado, sem CLIPSeg nem overlays
+        (a primeira parte de _predict_loaded, usada também pela avaliação).
+        Returns:
+            dict:
+                embeddings (N, D) float32: torre Tuned, normalizados.
+                class_probs (N, 2): probabilidades das classes.
+                suspects (S,): índices das imagens IA ou incertas (as únicas que passam pelos conceitos).
+                concept_probs (S, C+1): conceitos + controle das suspeitas.
+                concepts_fired (N, C) bool: conceitos acima do gating (sempre False fora das suspeitas).
+        """
+        n = len(pixels_tuned)
+
+        # --- 1. Classificação (Tuned - Inglês) ---
+        with telemetry.span("classify", images=n):
+            image_embeds = self._encode_images(self.model_tuned, pixels_tuned)
+            probs = self._zero_shot_probs(image_embeds, self.class_text_matrix, self.logit_scale_tuned)
+        pred_idx = probs.argmax(axis=1)
+        top_prob = probs[np.arange(n), pred_idx]
+
+        # --- 2. Conceitos ---
+        # Se for FAKE ou incerto, buscamos o defeito específico (se o estágio estiver habilitado)
+        if "concepts" in self.stages:
+            suspects = np.flatnonzero((pred_idx == 1) | (top_prob < SUSPECT_MAX_PROB))
+        else:
+            suspects = np.array([], dtype=np.int64)
+        concept_probs = np.zeros((0, len(self.concept_prompts)), dtype=np.float32)
+        fired = np.zeros((n, len(self.concepts_eng)), dtype=bool)
+
+        if len(suspects) > 0:
+            # Torre Base só roda nas imagens suspeitas, reaproveitando os pixels já processados
+            with telemetry.span("concepts", images=len(suspects)):
+                rows = torch.as_tensor(suspects, dtype=torch.long)
+                if self._shares_vision_tower():
+                    base_embeds = image_embeds[rows.to(image_embeds.device)]
+                else:
+                    base_embeds = self._encode_images(self.model_base, pixels_base[rows])
+                concept_probs = self._zero_shot_probs(base_embeds, self.concept_text_matrix, self.logit_scale_base)
+            thresholds = np.where(pred_idx[suspects] == 0, CONCEPT_THRESHOLD_REAL, CONCEPT_THRESHOLD_FAKE)
+            fired[suspects] = concept_probs[:, :len(self.concepts_eng)] > thresholds[:, None]
+
+        return {
+            "embeddings": image_embeds.float().cpu().numpy(),
+            "class_probs": probs,
+            "suspects": suspects,
+            "concept_probs": concept_probs,
+            "concepts_fired": fired,
+        }
+
+    def _predict_loaded(self, loaded, overlay_color="red", pixels=None):
+        """
+        Executa o pipeline completo sobre um lote de imagens já decodificadas.
+        Args:
+            loaded (list): Pares (PIL.Image RGB, caminho de origem ou None).
+            overlay_color (str | list): Uma cor para o lote todo ou uma por imagem.
+            pixels (tuple): (pixels_tuned, pixels_base) já pré-processados, opcional.
+        """
+        images = [image for image, _ in loaded]
+        n = len(images)
+        colors = list(overlay_color) if isinstance(overlay_color, (list, tuple)) else [overlay_color] * n
+        pixels_tuned, pixels_base = pixels if pixels is not None else self._preprocess(images)
+
+        # --- 1 e 2. Classificação + Conceitos ---
+        scores = self.score_pixels(pixels_tuned, pixels_base)
+        probs, embeddings = scores["class_probs"], scores["embeddings"]
+        pred_idx = probs.argmax(axis=1)
+
+        # --- Prompts para o CLIPSeg ---
+        conceitos_eng = [{} for _ in range(n)]
+        seg_prompts = [[] for _ in range(n)]
+        for i, row in zip(scores["suspects"], scores["concept_probs"]):
+            conceitos_eng[i] = self._concepts_from_probs(row, self.classes_eng[pred_idx[i]])
+            if not conceitos_eng[i]:
+                telemetry.count("megatruth_empty_concepts_total")
+            visual_target = self._visual_target(conceitos_eng[i]) if "segment" in self.stages else None
+            if visual_target:
+                seg_prompts[i] = [visual_target]
+
+        # --- 3. Geração das Máscaras (um único forward do CLIPSeg para o lote) ---
+        if any(seg_prompts):
+            print(f"   >>> Gerando Segmentação para: {[p for p in seg_prompts if p]}")
+        defect_maps = self._generate_segmentation_batch(images, seg_prompts, upsample=False)
+
+        results = []
+        for i, (image, image_path) in enumerate(loaded):
+            overlay_image = None
+            overlay_path = image_path  # Sem overlay gerado (None se a imagem veio da memória)
+
+            if defect_maps[i] is not None:
+                with telemetry.span("overlay"):
+                    overlay_image = self._render_overlay(image, defect_maps[i], colors[i])
+                if self.persist_outputs:
+                    with telemetry.span("save_overlay"):
+                        overlay_path = self._save_overlay(overlay_image, image_path, i)
+                else:
+                    overlay_path = None
+
+            result = self._build_result(probs[i], conceitos_eng[i], overlay_path, colors[i], overlay_image)
+            result["embedding"] = embeddings[i]  # Torre Tuned, normalizado (ver pipeline/embedding_store.py)
+            results.append(result)
+            telemetry.count("megatruth_images_total", label=self.classes_eng[pred_idx[i]])
+
+        return results
+
+    def prepare_image(self, image):
+        """
+        Decodifica e pré-processa uma imagem, sem tocar nos modelos.
+        Seguro para rodar em threads de trabalho enquanto o modelo processa outro lote.
+        Returns:
+            tuple: (PIL.Image, caminho ou None, pixels_tuned, pixels_base), tensores com shape (1, 3, H, W).
+        """
+        image, path = self._load_image(image)
+        pixels_tuned, pixels_base = self._preprocess(image)
+        return image, path, pixels_tuned, pixels_base
+
+    def embed_images(self, images):
+        """
+        Só os embeddings normalizados da torre Tuned (os mesmos de result["embedding"]),
+        sem classificar nem segmentar. Usado para buscar imagens parecidas já analisadas.
+        Returns:
+            np.ndarray: (N, D) float32.
+        """
+        pil_images = [image_io.model_copy(self._load_image(im)[0]) for im in images]
+        pixels = self.proc_tuned(images=pil_images, return_tensors="pt")["pixel_values"]
+        with telemetry.span("embed", images=len(pil_images)):
+            return self._encode_images(self.model_tuned, pixels).float().cpu().numpy()
+
+    def collate_prepared(self, prepared):
+        """
+        Empilha imagens de prepare_image em um lote. Em CUDA os tensores vão para
+        memória fixada (pinned), permitindo cópia assíncrona para a GPU.
+        """
+        loaded = [(image, path) for image, path, _, _ in prepared]
+        pixels_tuned = torch.cat([p[2] for p in prepared])
+        first_base = prepared[0][3]
+        if first_base is None or first_base is prepared[0][2]:
+            pixels_base = None if first_base is None else pixels_tuned
+        else:
+            pixels_base = torch.cat([p[3] for p in prepared])
+
+        if self.device == "cuda":
+            shared = pixels_base is pixels_tuned
+            pixels_tuned = pixels_tuned.pin_memory()
+            if shared:
+                pixels_base = pixels_tuned
+            elif pixels_base is not None:
+                pixels_base = pixels_base.pin_memory()
+
+        return loaded, (pixels_tuned, pixels_base)
+
+    def predict_collated(self, collated, overlay_color="red"):
+        """
+        Roda o pipeline completo sobre um lote montado por collate_prepared.
+        `overlay_color` pode ser uma lista com a cor de cada imagem (ex: pedidos de usuários diferentes).
+        """
+        loaded, pixels = collated
+        return self._predict_loaded(loaded, overlay_color, pixels=pixels)
+
+    @telemetry.traced("predict_with_defect_map")
+    def predict_with_defect_map(self, image, overlay_color="red"):
+        """
+        Pipeline principal: Classifica -> Analisa Conceitos -> Gera defect_map -> Traduz Saída.
+        A imagem é decodificada e pré-processada uma única vez e compartilhada
+        entre o Tuned, o Base e o CLIPSeg.
+        Args:
+            image (str | PIL.Image | np.ndarray): Caminho ou imagem já em memória.
+            overlay_color (str): 'red', 'green', ou 'blue'. Define a cor da mancha.
+        """
+        with telemetry.span("decode"):
+            loaded = self._load_image(image)
+        return self._predict_loaded([loaded], overlay_color)[0]
+
+    def predict_batch(self, images, batch_size=16, overlay_color="red"):
+        """
+        Versão em lote de predict_with_defect_map.
+        As imagens são agrupadas em lotes de tamanho fixo para o Tuned, o Base e o CLIPSeg.
+        Args:
+            images (iterable): Caminhos, PIL.Image ou arrays NumPy (pode ser um gerador).
+            batch_size (int): Quantidade de imagens por forward.
+            overlay_color (str): 'red', 'green', ou 'blue'.
+        Returns:
+            list: Um dict por imagem, na ordem de entrada, no mesmo formato de
+            predict_with_defect_map. Imagens ilegíveis retornam {"error": ...}.
+            A vazão da última chamada fica em `self.last_batch_stats`.
+        """
+        results = []
+        start = time.perf_counter()
+
+        def flush(chunk):
+            loaded = [item for item in chunk if not isinstance(item, dict)]
+            preds = iter(self._predict_loaded(loaded, overlay_color)) if loaded else iter(())
+            results.extend(item if isinstance(item, dict) else next(preds) for item in chunk)
+
+        chunk = []
+        for item in images:
+            try:
+                chunk.append(self._load_image(item))
+            except Exception as e:
+                print(f"⚠️ Falha ao abrir imagem {item}: {e}")
+                chunk.append({"error": str(e)})
+
+            if len(chunk) >= batch_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+
+        elapsed = time.perf_counter() - start
+        n = len(results)
+        self.last_batch_stats = {
+            "images": n,
+            "seconds": elapsed,
+            "images_per_sec": n / elapsed if elapsed > 0 else 0.0,
         }
+        print(f"⚡ Lote concluído: {n} imagens em {elapsed:.2f}s ({self.last_batch_stats['images_per_sec']:.1f} img/s)")
+        return results
         
-    def analisar_conceitos(self, image_path, classificacao_preliminar=None):
+    @telemetry.traced("analisar_conceitos")
+    def analisar_conceitos(self, image, classificacao_preliminar=None):
         """
         Testa a imagem contra a lista de conceitos carregada (Inglês).
+        Args:
+            image: Caminho, PIL.Image, array NumPy ou tensor `pixel_values` já pré-processado.
         """
-        # Adiciona prompt de controle
-        conceitos_completos = self.concepts_eng + ["a high quality natural photograph"]
-
         try:
-            image = Image.open(image_path).convert("RGB")
-            
-            # Gating
-            if classificacao_preliminar == "a real photograph" or classificacao_preliminar == 0:
-                threshold = 0.25 
+            if isinstance(image, torch.Tensor):
+                pixel_values = image
             else:
-                threshold = 0.10
-                
-            inputs = self.proc_base(
-                text=conceitos_completos,
-                images=image,
-                return_tensors="pt",
-                padding=True,
-                truncation=True
-            ).to(self.device)
-
-            with torch.no_grad():
-                outputs = self.model_base(**inputs)
-                logits_per_image = outputs.logits_per_image 
-                probs = logits_per_image.softmax(dim=1).cpu().numpy()[0]
+                pil_image, _ = self._load_image(image)
+                pixel_values = self.proc_base(images=image_io.model_copy(pil_image), return_tensors="pt")["pixel_values"]
 
-            resultado = {}
-            
-            # Varre apenas os conceitos (ignora o último que é o controle)
-            for i in range(len(self.concepts_eng)):
-                if probs[i] > threshold: 
-                    resultado[self.concepts_eng[i]] = float(probs[i])
-            
-            return dict(sorted(resultado.items(), key=lambda item: item[1], reverse=True))
+            # Só a torre de visão roda aqui; o texto (conceitos + controle) já está em concept_text_matrix
+            image_embeds = self._encode_images(self.model_base, pixel_values)
+            return self._score_concepts(image_embeds, classificacao_preliminar)
 
         except Exception as e:
             print(f"Erro na análise de conceitos: {e}")
-            return {}
\ No newline at end of file
+            return {}
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+DEFAULT_STORE_DIR = os.path.join("outputs", "embeddings")
+FAKE_LABEL = "Imagem Gerada por IA"
+REAL_LABEL = "Fotografia Real"
+# Similaridade de cosseno a partir da qual duas imagens são a mesma (recompressão, redimensionamento, print)
+DUPLICATE_SIMILARITY = 0.97
+# Até aqui a busca exata (~20 ms com 512 dimensões) basta; acima, usa o índice IVF
+EXACT_SEARCH_ROWS = 10_000
+# O índice é refeito (em segundo plano) quando as linhas fora dele passam desta fração das indexadas
+REINDEX_FRACTION = 0.25
+GROWTH_ROWS = 4096
+SEARCH_CHUNK = 65_536
+
+
+class EmbeddingStore:
+    """
+    Embeddings CLIP (Tuned, normalizados) das imagens já analisadas, com o rótulo,
+    a probabilidade, os conceitos e o veredito do analista.
+
+      - vectors.f16: matriz float16 (linhas x dim) mapeada em memória; cresce em blocos.
+      - meta.sqlite: uma linha por imagem (id = linha da matriz + 1), WAL para vários processos.
+      - index.npz: índice IVF (k-means esférico + listas invertidas), feito pelo comando
+        `index` ou refeito em uma thread de fundo quando fica desatualizado.
+
+    A busca é exata até EXACT_SEARCH_ROWS imagens; acima disso percorre só as `n_probe`
+    listas mais próximas, mais as linhas adicionadas depois do último índice. Uma consulta
+    nunca espera o índice ser refeito: sem índice, a busca é exata.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, namespace="", n_probe=8,
+                 duplicate_similarity=DUPLICATE_SIMILARITY):
+        self.directory = directory
+        self.n_probe = n_probe
+        self.duplicate_similarity = duplicate_similarity
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._index = None
+        self._index_mtime = None
+        self._reindexing = False
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f16")
+        self._index_path = os.path.join(directory, "index.npz")
+
+        self._db = sqlite3.connect(os.path.join(directory, "meta.sqlite"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " id INTEGER PRIMARY KEY, key TEXT UNIQUE, path TEXT, label TEXT, probability REAL,"
+            " conceitos TEXT, verdict TEXT, created_at REAL NOT NULL)"
+        )
+        # Rótulo efetivo (veredito do analista ou do modelo), usado para filtrar a busca
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_effective_label ON items (COALESCE(verdict, label))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+        # Embeddings de modelos diferentes não são comparáveis (namespace=None: aceita o que estiver gravado)
+        stored = self._info("namespace")
+        if stored is None and namespace is not None:
+            self._set_info("namespace", namespace)
+        elif namespace is not None and stored != namespace:
+            raise ValueError(f"{directory} guarda embeddings de outro modelo ({stored}). Use outra pasta.")
+        dim = self._info("dim")
+        self.dim = int(dim) if dim is not None else None
+
+    # ------------------------------------------------------------------
+    # Metadados e matriz
+    # ------------------------------------------------------------------
+    def _info(self, name):
+        row = self._db.execute("SELECT value FROM info WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_info(self, name, value):
+        self._db.execute("INSERT OR REPLACE INTO info (name, value) VALUES (?, ?)", (name, str(value)))
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+
+    def _map(self, rows):
+        """Garante que a matriz mapeada tenha pelo menos `rows` linhas (outro processo pode tê-la aumentado)."""
+        if self._vectors is not None and self._vectors.shape[0] >= rows:
+            return self._vectors
+        row_bytes = self.dim * 2
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        if size < rows * row_bytes:
+            capacity = max(rows, 2 * (size // row_bytes), GROWTH_ROWS)
+            capacity = -(-capacity // GROWTH_ROWS) * GROWTH_ROWS
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            size = capacity * row_bytes
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode="r+", shape=(size // row_bytes, self.dim))
+        return self._vectors
+
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def add(self, embedding, key=None, path=None, label=None, probability=None, conceitos=None):
+        """
+        Guarda um embedding e seus metadados. Com `key` (ex: hash do conteúdo), uma imagem
+        já guardada não é repetida.
+        Returns:
+            int: id da imagem.
+        """
+        vec = self._normalize(embedding)
+        with self._lock:
+            if key is not None:
+                row = self._db.execute("SELECT id FROM items WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    return row[0]
+            if self.dim is None:
+                self.dim = len(vec)
+                self._set_info("dim", self.dim)
+            elif len(vec) != self.dim:
+                raise ValueError(f"Embedding com dimensão {len(vec)}; a base usa {self.dim}.")
+
+            cursor = self._db.execute(
+                "INSERT INTO items (key, path, label, probability, conceitos, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, path, label, probability, json.dumps(conceitos or {}, ensure_ascii=False), time.time()),
+            )
+            item_id = cursor.lastrowid
+            # O vetor vai para a matriz antes do commit: quem lê o id já encontra a linha preenchida
+            self._map(item_id)[item_id - 1] = vec.astype(np.float16)
+            self._db.commit()
+        return item_id
+
+    def add_result(self, result, key=None, path=None):
+        """Guarda a saída do CLIPAIModel (precisa de result["embedding"])."""
+        return self.add(result["embedding"], key=key, path=path, label=result.get("label"),
+                        probability=result.get("probability"), conceitos=result.get("conceitos"))
+
+    def adjudicate(self, item_id, verdict):
+        """Registra o veredito do analista (FAKE_LABEL ou REAL_LABEL), que passa a valer no lugar do rótulo."""
+        if verdict not in (FAKE_LABEL, REAL_LABEL, None):
+            raise ValueError(f"Veredito deve ser '{FAKE_LABEL}' ou '{REAL_LABEL}'")
+        with self._lock:
+            updated = self._db.execute("UPDATE items SET verdict = ? WHERE id = ?", (verdict, item_id)).rowcount
+            self._db.commit()
+        if not updated:
+            raise KeyError(f"Imagem {item_id} não está na base de embeddings")
+
+    def _rows(self, ids):
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, key, path, label, probability, conceitos, verdict, created_at FROM items "
+                f"WHERE id IN ({','.join('?' * len(ids))})", [int(i) for i in ids]
+            ).fetchall()
+        return {
+            r[0]: {"id": r[0], "key": r[1], "path": r[2], "label": r[3], "probability": r[4],
+                   "conceitos": json.loads(r[5]) if r[5] else {}, "verdict": r[6], "created_at": r[7]}
+            for r in rows
+        }
+
+    def get(self, item_id):
+        return self._rows([item_id]).get(item_id)
+
+    def id_for_key(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT id FROM items WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def vector(self, item_id):
+        """Embedding guardado (float32) ou None."""
+        with self._lock:
+            if self.dim is None or not 0 < item_id <= len(self):
+                return None
+            return self._map(item_id)[item_id - 1].astype(np.float32)
+
+    # ------------------------------------------------------------------
+    # Índice IVF
+    # ------------------------------------------------------------------
+    def build_index(self, n_lists=None, iterations=10, seed=0):
+        """
+        K-means esférico sobre uma amostra (até 64 vetores por lista) e atribuição de todas
+        as linhas à lista do centróide mais próximo. Grava index.npz.
+        """
+        with self._lock:
+            n = len(self)
+            if n == 0:
+                return None
+            matrix = self._map(n)[:n]
+        n_lists = n_lists or int(np.clip(np.sqrt(n), 16, 4096))
+        n_lists = min(n_lists, n)
+        t0 = time.perf_counter()
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, n_lists * 64), replace=False))
+        points = matrix[sample].astype(np.float32)
+        centroids = points[rng.choice(len(points), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = (points @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, points)
+            filled = np.bincount(assign, minlength=n_lists) > 0
+            centroids[filled] = sums[filled]  # Listas vazias mantêm o centróide anterior
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SEARCH_CHUNK):
+            block = matrix[start:start + SEARCH_CHUNK].astype(np.float32)
+            assign[start:start + len(block)] = (block @ centroids.T).argmax(axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))]).astype(np.int64)
+
+        tmp = self._index_path + f".{os.getpid()}.tmp.npz"
+        np.savez(tmp, centroids=centroids, order=order, offsets=offsets, rows=np.int64(n))
+        os.replace(tmp, self._index_path)
+        print(f"🗂️ Índice de embeddings: {n} imagens em {n_lists} listas ({time.perf_counter() - t0:.1f}s)")
+        return self._load_index()
+
+    def _load_index(self):
+        """Relê index.npz se outro processo (ou a thread de fundo) o refez."""
+        with self._lock:
+            if not os.path.exists(self._index_path):
+                return None
+            mtime = os.path.getmtime(self._index_path)
+            if self._index is None or mtime != self._index_mtime:
+                with np.load(self._index_path) as data:
+                    self._index = {k: data[k] for k in ("centroids", "order", "offsets")}
+                    self._index["rows"] = int(data["rows"])
+                self._index_mtime = mtime
+            return self._index
+
+    def _reindex_in_background(self):
+        """Refaz o índice em uma thread de fundo (no máximo uma por vez neste processo)."""
+        with self._lock:
+            if self._reindexing:
+                return
+            self._reindexing = True
+
+        def run():
+            try:
+                self.build_index()
+            except Exception as e:
+                print(f"⚠️ Falha ao refazer o índice de embeddings: {e}")
+            finally:
+                self._reindexing = False
+
+        threading.Thread(target=run, name="embeddings-reindex", daemon=True).start()
+
+    def _candidates(self, query, n, n_probe):
+        """
+        Linhas a comparar com a consulta: todas (None, busca exata) ou as `n_probe` listas
+        mais próximas + as não indexadas.
+        Returns:
+            tuple: (linhas ou None, True se a busca cobriu a base inteira)
+        """
+        if n <= EXACT_SEARCH_ROWS:
+            return None, True
+        index = self._load_index()
+        if index is None or n - index["rows"] > REINDEX_FRACTION * index["rows"]:
+            # Desatualizado: a consulta segue com o que há (as linhas novas entram pela busca exata)
+            self._reindex_in_background()
+            if index is None:
+                return None, True
+        n_lists = len(index["centroids"])
+        probes = np.argsort(index["centroids"] @ query)[::-1][:n_probe]
+        offsets, order = index["offsets"], index["order"]
+        parts = [order[offsets[p]:offsets[p + 1]] for p in probes]
+        parts.append(np.arange(index["rows"], n, dtype=np.int64))
+        return np.sort(np.concatenate(parts)), n_probe >= n_lists
+
+    # ------------------------------------------------------------------
+    # Busca
+    # ------------------------------------------------------------------
+    def _allowed_rows(self, n, label, exclude):
+        """Máscara (n,) das linhas que podem ser devolvidas, ou None se todas podem."""
+        if label is None and not exclude:
+            return None
+        if label is None:
+            allowed = np.ones(n, dtype=bool)
+        else:
+            allowed = np.zeros(n, dtype=bool)
+            with self._lock:
+                ids = self._db.execute(
+                    "SELECT id FROM items WHERE COALESCE(verdict, label) = ? AND id <= ?", (label, n)
+                ).fetchall()
+            allowed[np.array([r[0] for r in ids], dtype=np.int64) - 1] = True
+        for item_id in exclude:
+            if 0 < int(item_id) <= n:
+                allowed[int(item_id) - 1] = False
+        return allowed
+
+    @staticmethod
+    def _top_k(matrix, query, rows, k):
+        """(linha, similaridade) das `k` mais parecidas entre `rows` (None = todas), em blocos."""
+        n = len(matrix)
+        best_rows, best_sims = [], []
+        total = n if rows is None else len(rows)
+        for start in range(0, total, SEARCH_CHUNK):
+            block_rows = np.arange(start, min(start + SEARCH_CHUNK, n)) if rows is None else rows[start:start + SEARCH_CHUNK]
+            block = matrix[start:start + SEARCH_CHUNK] if rows is None else matrix[block_rows]
+            sims = block.astype(np.float32) @ query
+            if len(sims) > k:
+                top = np.argpartition(sims, -k)[-k:]
+                block_rows, sims = block_rows[top], sims[top]
+            best_rows.append(block_rows)
+            best_sims.append(sims)
+        if not best_rows:
+            return []
+        best_rows, best_sims = np.concatenate(best_rows), np.concatenate(best_sims)
+        order = np.argsort(-best_sims)[:k]
+        return [(int(r), float(s)) for r, s in zip(best_rows[order], best_sims[order])]
+
+    def search(self, embedding, k=5, exclude=(), label=None):
+        """
+        Vizinhos mais próximos por similaridade de cosseno.
+        Args:
+            label (str): Só imagens com este rótulo (o veredito do analista, se houver; senão o do modelo).
+            exclude (iterable): ids que não podem ser devolvidos.
+        Com o índice IVF, se as listas visitadas tiverem menos de `k` imagens permitidas,
+        a busca visita cada vez mais listas, até achar `k` ou percorrer a base inteira.
+        Returns:
+            list: Metadados de cada vizinho, com "similarity", do mais parecido ao menos.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            n = len(self)
+            if n == 0 or self.dim is None:
+                return []
+            matrix = self._map(n)[:n]
+        allowed = self._allowed_rows(n, label, exclude)
+
+        n_probe = self.n_probe
+        while True:
+            rows, exhaustive = self._candidates(query, n, n_probe)
+            if allowed is not None:
+                rows = np.flatnonzero(allowed) if rows is None else rows[allowed[rows]]
+            ranked = self._top_k(matrix, query, rows, k)
+            if len(ranked) >= k or exhaustive:
+                break
+            n_probe *= 4
+
+        meta = self._rows([r + 1 for r, _ in ranked])
+        return [{**meta[r + 1], "similarity": s} for r, s in ranked if r + 1 in meta]
+
+    def find_duplicate(self, embedding, exclude=()):
+        """A imagem guardada mais parecida, se passar de `duplicate_similarity`; senão None."""
+        hits = self.search(embedding, k=1, exclude=exclude)
+        return hits[0] if hits and hits[0]["similarity"] >= self.duplicate_similarity else None
+
+    def similar(self, embedding, k=5, label=FAKE_LABEL, exclude=()):
+        """
+        As `k` imagens mais parecidas com um rótulo (o veredito do analista, se houver;
+        senão o do modelo), ex: "fakes conhecidas semelhantes". Menos de `k` só se a
+        base não tiver tantas com esse rótulo.
+        """
+        return self.search(embedding, k=k, exclude=exclude, label=label)
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._db.close()
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import shutil
+
+import numpy as np
+
+from pipeline.prefetch import PreprocessPipeline
+from pipeline.paths import walk_images
+
+# Nome da subpasta (sem diferenciar maiúsculas) -> índice em CLIPAIModel.classes_eng
+LABEL_DIRS = {
+    "real": 0, "reais": 0, "reals": 0,
+    "ia": 1, "ai": 1, "fake": 1, "fakes": 1, "generated": 1,
+}
+CLASS_NAMES = ("real", "IA")
+
+
+def iter_labeled_images(root):
+    """
+    Gera (caminho, rótulo) das subpastas de `root` com nome conhecido (ex: images/experiment/{real,IA}).
+    As demais (ex: erros/) são ignoradas.
+    """
+    found = False
+    for name in sorted(os.listdir(root)):
+        directory = os.path.join(root, name)
+        if not os.path.isdir(directory):
+            continue
+        label = LABEL_DIRS.get(name.lower())
+        if label is None:
+            print(f"ℹ️ Pasta ignorada (sem rótulo): {directory}")
+            continue
+        found = True
+        for path in walk_images(directory):
+            yield path, label
+    if not found:
+        raise FileNotFoundError(f"Nenhuma pasta rotulada em {root}. Esperado: {sorted(LABEL_DIRS)}")
+
+
+def confusion_matrix(labels, preds, n_classes=2):
+    """Linhas = rótulo verdadeiro, colunas = previsto."""
+    return np.bincount(labels * n_classes + preds, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+
+def roc_auc(labels, scores):
+    """
+    ROC-AUC pela estatística de Mann-Whitney (postos médios nos empates), sem laço por limiar.
+    Returns:
+        float | None: None se faltar uma das classes.
+    """
+    n_pos = int(labels.sum())
+    n_neg = len(labels) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return None
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(counts) - (counts - 1) / 2.0)[inverse]  # postos a partir de 1
+    return float((ranks[labels == 1].sum() - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg))
+
+
+def concept_firing(fired, suspect, labels, concepts):
+    """
+    Fração das imagens de cada classe em que cada conceito aparece para o usuário.
+    `fired` (N, C) e `suspect` (N,) vêm de CLIPAIModel.score_pixels: só as imagens
+    suspeitas passam pelos conceitos, as demais contam como sem conceito.
+    Returns:
+        tuple: (taxas por conceito, fração de suspeitas por classe)
+    """
+    per_class = {name: fired[labels == c].mean(axis=0) if (labels == c).any() else None
+                 for c, name in enumerate(CLASS_NAMES)}
+    overall = fired.mean(axis=0)
+    rates = {
+        concept: {
+            "all": float(overall[j]),
+            **{name: None if r is None else float(r[j]) for name, r in per_class.items()},
+        }
+        for j, concept in enumerate(concepts)
+    }
+    suspects = {name: float(suspect[labels == c].mean()) if (labels == c).any() else None
+                for c, name in enumerate(CLASS_NAMES)}
+    return rates, suspects
+
+
+def _copy_errors(paths, labels, preds, output_dir):
+    """Copia os erros para erros/falso_positivo e erros/falso_negativo (como em images/experiment/erros)."""
+    counts = {}
+    for kind, mask in (("falso_positivo", (labels == 0) & (preds == 1)),
+                       ("falso_negativo", (labels == 1) & (preds == 0))):
+        directory = os.path.join(output_dir, "erros", kind)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for i in np.flatnonzero(mask):
+            name = os.path.basename(paths[i])
+            target = os.path.join(directory, name)
+            if os.path.exists(target):
+                target = os.path.join(directory, f"{i}_{name}")
+            shutil.copy2(paths[i], target)
+        counts[kind] = int(mask.sum())
+    return counts
+
+
+def run_evaluation(clip_model, root, output_dir, batch_size=32, workers=4, queue_depth=4,
+                   threshold=0.5, copy_errors=True):
+    """
+    Avalia o CLIPAIModel em um diretório rotulado, só com as torres de visão
+    (sem CLIPSeg, overlays nem LLM). Os embeddings vêm em lote pelo PreprocessPipeline e
+    as métricas (acurácia, ROC-AUC, matriz de confusão, disparo de conceitos) são
+    calculadas de uma vez em NumPy no fim.
+
+    Grava em `output_dir`: report.json, predictions.jsonl (uma linha por imagem) e,
+    com `copy_errors`, as cópias dos falsos positivos/negativos.
+    Returns:
+        dict: O relatório.
+    """
+    labeled = list(iter_labeled_images(root))
+    if not labeled:
+        raise FileNotFoundError(f"Nenhuma imagem rotulada em {root}")
+    label_of = dict(labeled)
+    print(f"🧪 Avaliando {len(labeled)} imagens de {root}")
+
+    clip_model.load()
+    pipeline = PreprocessPipeline(clip_model, batch_size=batch_size, workers=workers, queue_depth=queue_depth)
+
+    paths, labels, class_probs, fired, suspect, errors = [], [], [], [], [], []
+    start = time.perf_counter()
+    for items, collated in pipeline.batches(p for p, _ in labeled):
+        for path, prepared in items:
+            if isinstance(prepared, Exception):
+                errors.append({"path": path, "error": str(prepared)})
+            else:
+                paths.append(path)
+                labels.append(label_of[path])
+        if collated is None:
+            continue
+
+        t0 = time.perf_counter()
+        _, (pixels_tuned, pixels_base) = collated
+        # Mesmo caminho de _predict_loaded (classificação + conceitos só nas suspeitas)
+        scores = clip_model.score_pixels(pixels_tuned, pixels_base)
+        class_probs.append(scores["class_probs"])
+        fired.append(scores["concepts_fired"])
+        mask = np.zeros(len(pixels_tuned), dtype=bool)
+        mask[scores["suspects"]] = True
+        suspect.append(mask)
+        pipeline.metrics.add("model", time.perf_counter() - t0)
+        pipeline.metrics.count(images=len(items), errors=len(items) - len(collated[0]), batches=1)
+
+        done = len(paths) + len(errors)
+        if done % (batch_size * 20) < batch_size:
+            print(f"⏳ {done}/{len(labeled)} ({done / (time.perf_counter() - start):.1f} img/s)")
+    elapsed = time.perf_counter() - start
+
+    if not paths:
+        raise RuntimeError(f"Nenhuma imagem de {root} pôde ser lida")
+
+    labels = np.array(labels, dtype=np.int64)
+    class_probs = np.concatenate(class_probs)
+    p_fake = class_probs[:, 1]
+    preds = (p_fake >= threshold).astype(np.int64)
+    cm = confusion_matrix(labels, preds)
+    tn, fp, fn, tp = cm.ravel()
+
+    report = {
+        "root": root,
+        "images": len(paths),
+        "unreadable": errors,
+        "threshold": threshold,
+        "seconds": elapsed,
+        "images_per_sec": len(paths) / elapsed if elapsed > 0 else 0.0,
+        "accuracy": float((preds == labels).mean()),
+        "roc_auc": roc_auc(labels, p_fake),
+        "confusion_matrix": {"labels": list(CLASS_NAMES), "rows_true_cols_pred": cm.tolist()},
+        "precision_ia": float(tp / (tp + fp)) if tp + fp else None,
+        "recall_ia": float(tp / (tp + fn)) if tp + fn else None,
+        "false_positive_rate": float(fp / (fp + tn)) if fp + tn else None,
+        "per_class": {name: int((labels == c).sum()) for c, name in enumerate(CLASS_NAMES)},
+        "pipeline": pipeline.metrics.summary(),
+    }
+
+    if "concepts" in clip_model.stages:
+        report["concepts"], report["suspect_rate"] = concept_firing(
+            np.concatenate(fired), np.concatenate(suspect), labels, clip_model.concepts_eng)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "predictions.jsonl"), "w", encoding="utf-8") as f:
+        for i, path in enumerate(paths):
+            f.write(json.dumps({"path": path, "label": CLASS_NAMES[labels[i]], "pred": CLASS_NAMES[preds[i]],
+                                "p_ia": float(p_fake[i])}, ensure_ascii=False) + "\n")
+    if copy_errors:
+        report["errors_copied"] = _copy_errors(paths, labels, preds, output_dir)
+    with open(os.path.join(output_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    _print_report(report)
+    print(f"💾 Relatório em {os.path.join(output_dir, 'report.json')}")
+    return report
+
+
+def _print_report(report):
+    cm = report["confusion_matrix"]["rows_true_cols_pred"]
+    auc = report["roc_auc"]
+    print(f"\n📊 {report['images']} imagens em {report['seconds']:.1f}s ({report['images_per_sec']:.1f} img/s)")
+    print(f"✅ Acurácia: {report['accuracy']:.2%} | ROC-AUC: {'—' if auc is None else f'{auc:.4f}'}")
+    print(f"{'':>12} {'prev. real':>11} {'prev. IA':>9}")
+    for name, row in zip(CLASS_NAMES, cm):
+        print(f"{'true ' + name:>12} {row[0]:>11} {row[1]:>9}")
+    if report["unreadable"]:
+        print(f"⚠️ {len(report['unreadable'])} imagens ilegíveis (fora das métricas)")
+
+    concepts = report.get("concepts")
+    if concepts:
+        # Conceitos que mais separam IA de real
+        ranked = sorted(concepts.items(), key=lambda kv: (kv[1]["IA"] or 0.0) - (kv[1]["real"] or 0.0), reverse=True)
+        suspects = report["suspect_rate"]
+        print(f"\n🔎 Disparo dos conceitos (IA x real); passam pelos conceitos: "
+              f"IA {suspects['IA'] or 0.0:.1%}, real {suspects['real'] or 0.0:.1%}")
+        for concept, r in ranked[:10]:
+            print(f"   - {concept:<40} IA {r['IA'] or 0.0:6.1%}  real {r['real'] or 0.0:6.1%}")
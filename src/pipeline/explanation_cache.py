@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+from PIL import Image
+
+from pipeline import telemetry
+
+
+def file_hash(path):
+    """Hash dos bytes do arquivo (imagem original ou overlay)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def evidence_hash(image):
+    """Hash da imagem original/overlay, venha ela de um arquivo ou da memória (PIL/NumPy)."""
+    if isinstance(image, (str, os.PathLike)):
+        return file_hash(image)
+
+    pixels = np.ascontiguousarray(np.asarray(image.convert("RGB") if isinstance(image, Image.Image) else image))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{pixels.shape}:{pixels.dtype}:".encode("utf-8"))
+    h.update(pixels.tobytes())
+    return h.hexdigest()
+
+
+def explanation_key(image_hash, overlay_hash, label, probability, conceitos, overlay_color, model_name, bucket=0.05):
+    """
+    Monta a chave do laudo a partir da evidência enviada ao modelo multimodal.
+    A probabilidade entra em faixas (`bucket`) e os conceitos entram só pelo nome,
+    já que pequenas variações de score não mudam o laudo.
+    """
+    evidence = {
+        "image": image_hash,
+        "overlay": overlay_hash,
+        "label": label,
+        "prob_bucket": int(round(probability / bucket)),
+        "concepts": sorted(conceitos or {}),
+        "color": overlay_color,
+        "model": model_name,
+    }
+    return hashlib.sha256(json.dumps(evidence, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ExplanationCache:
+    """
+    Cache persistente (SQLite) de laudos gerados pelo Nemotron/LLaVA.
+    Entradas expiram após `ttl_seconds` e as mais antigas são removidas
+    quando o total passa de `max_entries` ou `max_bytes`.
+    """
+
+    def __init__(self, db_path=os.path.join("outputs", "cache", "explanations.sqlite"),
+                 ttl_seconds=7 * 24 * 3600, max_entries=5000, max_bytes=64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "expired": 0}
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS explanations ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_explanations_created ON explanations(created_at)")
+        self._db.commit()
+
+    def get(self, key):
+        """Retorna (texto, modelo) ou None se não houver laudo válido."""
+        with self._lock:
+            row = self._db.execute("SELECT text, model, created_at FROM explanations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                telemetry.count("megatruth_cache_events_total", cache="explanation", event="miss")
+                return None
+
+            if time.time() - row[2] > self.ttl_seconds:
+                self._db.execute("DELETE FROM explanations WHERE key = ?", (key,))
+                self._db.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                telemetry.count("megatruth_cache_events_total", cache="explanation", event="expired")
+                return None
+
+            self.stats["hits"] += 1
+            telemetry.count("megatruth_cache_events_total", cache="explanation", event="hit")
+            return row[0], row[1]
+
+    def put(self, key, text, model_name):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO explanations (key, model, text, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, text, len(text.encode("utf-8")), time.time()),
+            )
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM explanations WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self):
+        self._db.execute("DELETE FROM explanations WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM explanations").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM explanations ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM explanations WHERE key = ?", (row[0],))
+            count -= 1
+            total -= row[1]
@@ -0,0 +1,183 @@
+import time
+import queue
+import threading
+
+from pipeline import telemetry
+
+STRATEGIES = ("sequential", "race", "hedge")
+
+# Limites dos buckets (segundos) do histograma de latência, em escala aproximadamente logarítmica
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 1.5, 2, 3, 4, 6, 8, 10, 15, 20, 30, 45, 60, 90, 120)
+
+_FIM = object()
+
+
+class HedgedRunner:
+    """
+    Executa backends de streaming (ex: Nemotron e LLaVA) segundo uma estratégia:
+      - "sequential": o próximo só começa quando o anterior falha (comportamento antigo).
+      - "race": todos começam juntos; vence o primeiro a produzir um token.
+      - "hedge": o próximo começa quando o atual falha ou quando passa do percentil
+        `hedge_percentile` do tempo até o primeiro token (histograma do backend).
+    O perdedor é cancelado assim que há um vencedor. Um backend cancelado antes do primeiro
+    token entra no histograma com o tempo decorrido (limite inferior censurado do TTFT), senão
+    o histograma só veria os backends rápidos e o atraso do hedge ficaria curto demais.
+    """
+
+    def __init__(self, strategy="hedge", hedge_percentile=0.9, min_delay=2.0, max_delay=20.0,
+                 default_delay=8.0, min_samples=5):
+        """
+        Args:
+            strategy (str): Uma de STRATEGIES.
+            hedge_percentile (float): Percentil do tempo até o primeiro token que dispara o hedge.
+            min_delay, max_delay (float): Limites do atraso do hedge, em segundos.
+            default_delay (float): Atraso usado enquanto o histograma tem menos de `min_samples`.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Estratégia desconhecida: {strategy}. Use {STRATEGIES}.")
+        self.strategy = strategy
+        self.hedge_percentile = hedge_percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.histograms = {}
+        self._lock = threading.Lock()
+        # Serializa "primeiro token" x "cancelamento" para cada tentativa contar uma única vez
+        self._ttft_lock = threading.Lock()
+
+    def histogram(self, label):
+        with self._lock:
+            if label not in self.histograms:
+                self.histograms[label] = telemetry.LatencyHistogram(LATENCY_BUCKETS)
+            return self.histograms[label]
+
+    def hedge_delay(self, label):
+        """Quanto esperar pelo primeiro token de `label` antes de acionar o próximo backend."""
+        hist = self.histogram(label)
+        if hist.count < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, hist.percentile(self.hedge_percentile)))
+
+    def _first_token(self, label, attempt):
+        """Registra o TTFT da tentativa; False se ela já foi cancelada."""
+        with self._ttft_lock:
+            if attempt["cancel"].is_set():
+                return False
+            attempt["responded"] = True
+        ttft = time.perf_counter() - attempt["t0"]
+        self.histogram(label).observe(ttft)
+        telemetry.observe("megatruth_llm_ttft_seconds", ttft, backend=label)
+        return True
+
+    def _cancel(self, label, attempt, failed=False):
+        """
+        Cancela a tentativa. Se ela ainda não respondeu nem falhou, o tempo decorrido entra no
+        histograma como amostra censurada (o TTFT real é pelo menos isso).
+        """
+        with self._ttft_lock:
+            if attempt["cancel"].is_set():
+                return
+            attempt["cancel"].set()
+            censored = not attempt["responded"] and not failed
+        if censored:
+            elapsed = time.perf_counter() - attempt["t0"]
+            self.histogram(label).observe(elapsed)
+            telemetry.observe("megatruth_llm_ttft_censored_seconds", elapsed, backend=label)
+
+    def _worker(self, label, start, attempt, events):
+        cancel = attempt["cancel"]
+        first = True
+        try:
+            for piece in start(cancel):
+                if cancel.is_set():
+                    break
+                if first:
+                    if not self._first_token(label, attempt):
+                        break
+                    first = False
+                events.put((label, piece))
+            events.put((label, _FIM))
+        except Exception as e:
+            events.put((label, e))
+
+    def stream(self, backends):
+        """
+        Args:
+            backends (list): Pares (rótulo, start) em ordem de preferência. `start(cancel_event)`
+                devolve um iterável de trechos de texto e deve parar quando o evento for setado.
+        Yields:
+            tuple: (rótulo do vencedor, trecho).
+        Raises:
+            RuntimeError: Se todos os backends falharem antes do primeiro token.
+            Exception: A exceção do vencedor, se ele falhar no meio do laudo.
+        """
+        events = queue.Queue()
+        attempts = {}
+        errors = {}
+        pending = list(backends)
+        preferred = pending[0][0]
+        winner = None
+
+        def launch():
+            label, start = pending.pop(0)
+            attempts[label] = {"cancel": threading.Event(), "t0": time.perf_counter(), "responded": False}
+            threading.Thread(target=self._worker, args=(label, start, attempts[label], events),
+                             name=f"hedge-{label}", daemon=True).start()
+            print(f"🏁 Backend iniciado: {label}")
+            return label
+
+        current = launch()
+        while self.strategy == "race" and pending:
+            launch()
+        hedge_at = time.perf_counter() + self.hedge_delay(current)
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and pending and self.strategy == "hedge":
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    label, item = events.get(timeout=timeout)
+                except queue.Empty:
+                    # Hedge: o backend atual passou do percentil sem responder
+                    print(f"⏱️ {current} sem resposta após {self.hedge_delay(current):.1f}s, acionando hedge...")
+                    telemetry.count("megatruth_llm_hedges_total", backend=current)
+                    current = launch()
+                    hedge_at = time.perf_counter() + self.hedge_delay(current)
+                    continue
+
+                if winner is not None and label != winner:
+                    continue
+                if item is _FIM and label == winner:
+                    return
+
+                if isinstance(item, Exception) and label == winner:
+                    raise item
+                if isinstance(item, Exception) or item is _FIM:
+                    # Falhou (ou terminou sem produzir nada) antes do primeiro token
+                    errors[label] = item if item is not _FIM else RuntimeError("resposta vazia")
+                    print(f"⚠️ {label} falhou: {errors[label]}")
+                    telemetry.count("megatruth_llm_failures_total", backend=label)
+                    if len(errors) == len(attempts):
+                        if not pending:
+                            raise RuntimeError("; ".join(f"{k}: {v}" for k, v in errors.items()))
+                        current = launch()
+                        hedge_at = time.perf_counter() + self.hedge_delay(current)
+                    continue
+
+                if winner is None:
+                    winner = label
+                    for other, attempt in attempts.items():
+                        if other != winner:
+                            self._cancel(other, attempt, failed=other in errors)
+                    pending.clear()
+                    print(f"🥇 Vencedor: {winner}")
+                    telemetry.count("megatruth_llm_wins_total", backend=winner)
+                    if winner != preferred:
+                        # Ex: laudo entregue pelo LLaVA em vez do Nemotron
+                        telemetry.count("megatruth_llm_fallbacks_total", backend=winner)
+                yield label, item
+        finally:
+            for label, attempt in attempts.items():
+                self._cancel(label, attempt, failed=label in errors)
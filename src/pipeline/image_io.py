@@ -0,0 +1,123 @@
+import io
+import os
+import base64
+
+import numpy as np
+from PIL import Image
+
+# Maior entrada dos modelos de visão: CLIPSeg usa 352x352 (o CLIP usa 224x224)
+MODEL_MIN_SIDE = 352
+# Cópia de trabalho usada no overlay/exibição (None = resolução original)
+DISPLAY_MAX_SIDE = 1536
+# Limites das imagens enviadas ao Nemotron/LLaVA
+LLM_MAX_SIDE = 1024
+LLM_MAX_BYTES = 512 * 1024
+LLM_JPEG_QUALITIES = (90, 80, 70, 60, 50)
+
+
+def _scaled_size(size, max_side=None, min_side=None):
+    """
+    Tamanho (w, h) após reduzir a imagem mantendo a proporção: o lado maior
+    fica <= max_side e o menor >= min_side (min_side prevalece). Nunca amplia.
+    """
+    w, h = size
+    scale = 1.0
+    if max_side:
+        scale = max_side / max(w, h)
+    if min_side:
+        scale = max(scale, min_side / min(w, h)) if max_side else min_side / min(w, h)
+    scale = min(scale, 1.0)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def downscale(image, max_side=None, min_side=None):
+    """Reduz uma PIL.Image (ver _scaled_size). Devolve a própria imagem se não houver redução."""
+    target = _scaled_size(image.size, max_side, min_side)
+    if target == image.size:
+        return image
+    # reducing_gap: reduz por fator inteiro (rápido) antes do filtro bicúbico final
+    return image.resize(target, Image.BICUBIC, reducing_gap=3.0)
+
+
+def open_image(source, max_side=None, min_side=None):
+    """
+    Abre um arquivo (caminho ou bytes) já na resolução de trabalho.
+    Em JPEGs usa o modo draft do PIL: o decodificador reduz por 1/2, 1/4 ou 1/8
+    durante a própria decodificação, sem materializar a imagem inteira.
+    """
+    image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    if (max_side or min_side) and image.format == "JPEG":
+        # draft garante um resultado >= ao tamanho pedido
+        image.draft("RGB", _scaled_size(image.size, max_side, min_side))
+    image = image.convert("RGB")
+    return downscale(image, max_side, min_side) if (max_side or min_side) else image
+
+
+def to_pil(image, max_side=None):
+    """
+    Converte caminho, bytes, array NumPy (RGB) ou PIL.Image em PIL.Image RGB.
+    Com `max_side`, o lado maior é limitado (arquivos JPEG já são decodificados reduzidos).
+    """
+    if isinstance(image, Image.Image):
+        pil_image = image if image.mode == "RGB" else image.convert("RGB")
+    elif isinstance(image, np.ndarray):
+        pil_image = Image.fromarray(image).convert("RGB")
+    else:
+        return open_image(image, max_side=max_side)
+    return downscale(pil_image, max_side) if max_side else pil_image
+
+
+def model_copy(image, min_side=MODEL_MIN_SIDE):
+    """Cópia de trabalho dos modelos de visão: menor lado reduzido a `min_side` (nunca amplia)."""
+    return downscale(image, min_side=min_side)
+
+
+def encode_image(image, fmt="JPEG", quality=95):
+    """Codifica uma imagem em memória (sem passar pelo disco) e devolve os bytes."""
+    buffer = io.BytesIO()
+    pil_image = to_pil(image)
+    if fmt.upper() == "JPEG":
+        pil_image.save(buffer, format="JPEG", quality=quality)
+    elif fmt.upper() == "PNG":
+        # compress_level baixo: o PNG aqui é só para cache/transferência, vale mais a velocidade
+        pil_image.save(buffer, format="PNG", compress_level=1)
+    else:
+        pil_image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def encode_jpeg_capped(image, max_side=LLM_MAX_SIDE, max_bytes=LLM_MAX_BYTES, qualities=LLM_JPEG_QUALITIES):
+    """
+    JPEG com lado maior <= max_side e, se possível, tamanho <= max_bytes.
+    Baixa a qualidade passo a passo e, se ainda não couber, reduz a resolução pela metade.
+    """
+    pil_image = to_pil(image, max_side=max_side)
+    while True:
+        for quality in qualities:
+            data = encode_image(pil_image, fmt="JPEG", quality=quality)
+            if max_bytes is None or len(data) <= max_bytes:
+                return data
+        if min(pil_image.size) <= 64:
+            return data
+        pil_image = downscale(pil_image, max_side=max(pil_image.size) // 2)
+
+
+def image_to_base64(image, fmt="JPEG", quality=95, max_side=None, max_bytes=None):
+    """
+    Base64 para os clientes multimodais. Sem limites, caminhos são lidos como estão
+    e imagens em memória (PIL/NumPy) são codificadas direto no buffer.
+    Com `max_side`/`max_bytes`, tudo é reenviado como JPEG reduzido (ver encode_jpeg_capped).
+    """
+    if isinstance(image, (str, os.PathLike)) and not os.path.exists(image):
+        raise FileNotFoundError(f"Arquivo não encontrado: {image}")
+
+    if max_side or max_bytes:
+        data = encode_jpeg_capped(image, max_side=max_side, max_bytes=max_bytes)
+    elif isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            data = f.read()
+    elif isinstance(image, (bytes, bytearray)):
+        data = bytes(image)
+    else:
+        data = encode_image(image, fmt=fmt, quality=quality)
+    return base64.b64encode(data).decode("utf-8")
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+JOB_STATUSES = ("queued", "running", "done", "error")
+
+
+class JobStore:
+    """
+    Estado dos jobs assíncronos da API (ex: laudos do Nemotron/LLaVA) em SQLite.
+    A API roda em um único processo (ver cmd_serve): os jobs são executados nas threads
+    de laudo desse processo e ficam em disco só para o resultado sobreviver a um reinício.
+    Ao abrir, os jobs que um processo anterior deixou em 'queued'/'running' viram 'error'
+    (ninguém mais vai executá-los), para o cliente parar o polling.
+    Jobs terminados expiram após `ttl_seconds`.
+    """
+
+    def __init__(self, db_path=os.path.join("outputs", "cache", "jobs.sqlite"), ttl_seconds=24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        # WAL: o polling lê sem esperar as threads de laudo que estão gravando
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)")
+        orphaned = self._db.execute(
+            "UPDATE jobs SET status = 'error', error = ?, updated_at = ? WHERE status IN ('queued', 'running')",
+            ("Interrompido: a API foi reiniciada antes do fim do job", time.time()),
+        ).rowcount
+        self._db.commit()
+        if orphaned:
+            print(f"⚠️ {orphaned} jobs interrompidos por um reinício da API marcados como 'error'")
+
+    def create(self, kind):
+        """Registra um job novo como 'queued' e devolve seu id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, now, now),
+            )
+            self._evict()
+            self._db.commit()
+        return job_id
+
+    def update(self, job_id, status, result=None, error=None):
+        if status not in JOB_STATUSES:
+            raise ValueError(f"Status desconhecido: {status}. Use {JOB_STATUSES}.")
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+            self._db.commit()
+
+    def get(self, job_id):
+        """Retorna o job como dict ou None se não existir (ou já tiver expirado)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def _evict(self):
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'error') AND updated_at < ?",
+            (time.time() - self.ttl_seconds,),
+        )
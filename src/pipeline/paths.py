@@ -0,0 +1,54 @@
+import os
+import glob
+import hashlib
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+def walk_images(directory):
+    """Percorre a árvore de forma preguiçosa (ordem determinística por pasta)."""
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        print(f"⚠️ Não foi possível listar {directory}: {e}")
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_images(entry.path)
+        elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+            yield entry.path
+
+
+def iter_image_paths(source):
+    """
+    Gera os caminhos das imagens a partir de uma pasta, um padrão glob
+    ou um arquivo .txt com um caminho por linha, sempre na mesma ordem (o
+    --resume pula as N primeiras). Só o padrão glob monta a lista, para ordená-la.
+    """
+    if os.path.isdir(source):
+        yield from walk_images(source)
+    elif any(ch in source for ch in "*?["):
+        # A ordem do iglob depende do sistema de arquivos: ordena para o resume ser estável
+        for path in sorted(glob.iglob(source, recursive=True)):
+            if os.path.isfile(path):
+                yield path
+    elif os.path.isfile(source):
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                path = line.strip()
+                if path and not path.startswith("#"):
+                    yield path
+    else:
+        raise FileNotFoundError(f"Fonte de imagens não encontrada: {source}")
+
+
+def overlay_filename(image_path):
+    """
+    Nome do arquivo do overlay de `image_path` em outputs/defect_maps. Leva um hash curto
+    do caminho absoluto: imagens com o mesmo nome em pastas diferentes (comum no scan
+    recursivo) não sobrescrevem o overlay uma da outra.
+    """
+    digest = hashlib.blake2b(os.path.abspath(image_path).encode("utf-8"), digest_size=5).hexdigest()
+    return f"{os.path.basename(image_path)}_{digest}_clipseg.png"
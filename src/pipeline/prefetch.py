@@ -0,0 +1,167 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PipelineMetrics:
+    """Acumula o tempo gasto em cada estágio do pipeline (thread-safe)."""
+
+    STAGES = ("decode", "preprocess", "collate", "wait", "model")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {stage: 0.0 for stage in self.STAGES}
+        self.images = 0
+        self.errors = 0
+        self.batches = 0
+        self.started_at = time.perf_counter()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def count(self, images=0, errors=0, batches=0):
+        with self._lock:
+            self.images += images
+            self.errors += errors
+            self.batches += batches
+
+    def summary(self):
+        """
+        Retorna os totais por estágio e a média por imagem (ms).
+        decode/preprocess somam o tempo de todos os workers; `wait` é o tempo em que
+        o modelo ficou parado esperando um lote (GPU ociosa).
+        """
+        with self._lock:
+            wall = time.perf_counter() - self.started_at
+            n = max(self.images, 1)
+            return {
+                "images": self.images,
+                "errors": self.errors,
+                "batches": self.batches,
+                "wall_seconds": wall,
+                "images_per_sec": self.images / wall if wall > 0 else 0.0,
+                "stage_seconds": dict(self.seconds),
+                "stage_ms_per_image": {k: v * 1000.0 / n for k, v in self.seconds.items()},
+            }
+
+    def report(self):
+        s = self.summary()
+        print(f"📊 Pipeline: {s['images']} imagens, {s['batches']} lotes, {s['images_per_sec']:.1f} img/s")
+        for stage in self.STAGES:
+            print(f"   - {stage:<10} {s['stage_seconds'][stage]:8.2f}s  ({s['stage_ms_per_image'][stage]:.1f} ms/img)")
+
+
+class PreprocessPipeline:
+    """
+    Produtor/consumidor entre a leitura das imagens e o CLIPAIModel.
+
+    Um pool de threads decodifica e pré-processa as imagens (PIL + CLIPProcessor),
+    uma thread monta os lotes (em memória fixada quando há CUDA) e os coloca em
+    uma fila limitada; o chamador consome os lotes e roda o modelo. Assim o lote
+    N+1 é preparado enquanto o lote N está no modelo.
+    """
+
+    def __init__(self, clip_model, batch_size=16, workers=4, queue_depth=4):
+        self.clip_model = clip_model
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.metrics = PipelineMetrics()
+
+    def _prepare_one(self, path):
+        t0 = time.perf_counter()
+        try:
+            image, source = self.clip_model._load_image(path)
+            t1 = time.perf_counter()
+            self.metrics.add("decode", t1 - t0)
+
+            prepared = self.clip_model.prepare_image((image, source))
+            self.metrics.add("preprocess", time.perf_counter() - t1)
+            return path, prepared
+        except Exception as e:
+            self.metrics.add("decode", time.perf_counter() - t0)
+            return path, e
+
+    def _chunks(self, paths):
+        chunk = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) >= self.batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _produce(self, paths, fila, fim, parar):
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode") as pool:
+                for chunk in self._chunks(paths):
+                    if parar.is_set():
+                        break
+                    items = list(pool.map(self._prepare_one, chunk))
+
+                    t0 = time.perf_counter()
+                    ok = [prepared for _, prepared in items if not isinstance(prepared, Exception)]
+                    collated = self.clip_model.collate_prepared(ok) if ok else None
+                    self.metrics.add("collate", time.perf_counter() - t0)
+
+                    fila.put((items, collated))
+        except Exception as e:
+            fila.put(e)
+        finally:
+            fila.put(fim)
+
+    def batches(self, paths):
+        """
+        Gera, a cada lote, (items, collated): os pares (caminho, prepare_image ou Exception)
+        e o lote montado por collate_prepared (None se nenhuma imagem abriu), sem rodar o modelo.
+        """
+        fila = queue.Queue(maxsize=self.queue_depth)
+        fim = object()
+        parar = threading.Event()
+        produtor = threading.Thread(target=self._produce, args=(paths, fila, fim, parar), name="batch-producer", daemon=True)
+        produtor.start()
+
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = fila.get()
+                self.metrics.add("wait", time.perf_counter() - t0)
+
+                if item is fim:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Libera o produtor caso o consumidor pare no meio (ex: exceção ou break)
+            parar.set()
+            while produtor.is_alive():
+                try:
+                    fila.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def run(self, paths, overlay_color="red"):
+        """
+        Consome `paths` (qualquer iterável, inclusive geradores) e gera, a cada lote,
+        uma lista de (caminho, resultado). Imagens ilegíveis geram {"error": ...}.
+        """
+        for items, collated in self.batches(paths):
+            t0 = time.perf_counter()
+            preds = iter(self.clip_model.predict_collated(collated, overlay_color) if collated else ())
+            self.metrics.add("model", time.perf_counter() - t0)
+
+            batch = []
+            errors = 0
+            for path, prepared in items:
+                if isinstance(prepared, Exception):
+                    errors += 1
+                    batch.append((path, {"error": str(prepared)}))
+                else:
+                    batch.append((path, next(preds)))
+
+            self.metrics.count(images=len(items), errors=errors, batches=1)
+            yield batch
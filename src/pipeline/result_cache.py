@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+from pipeline import telemetry
+
+# Caminhos, o overlay em memória e o embedding não vão para o JSON
+# (o overlay é guardado como PNG à parte; o embedding, na base de embeddings)
+EXCLUDED_KEYS = ("overlay_path", "defect_map_path", "overlay_image", "embedding")
+
+
+# Distância de Hamming máxima (bits do dHash) para considerar duas imagens a mesma
+MAX_HASH_DISTANCE = 4
+# Verificação dos candidatos: diferença média máxima (0-255) entre as miniaturas 16x16 em cinza
+MAX_THUMB_DIFF = 10.0
+_HASH_BITS = 64
+
+
+def perceptual_hash(image):
+    """dHash de 64 bits: compara pixels vizinhos de uma miniatura 9x8 em tons de cinza."""
+    small = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def content_hash(image):
+    """Hash dos pixels decodificados (independe do formato/metadados do arquivo enviado)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def thumbnail(image):
+    return np.asarray(image.convert("L").resize((16, 16), Image.BILINEAR), dtype=np.uint8).tobytes()
+
+
+def hash_bands(phash, max_distance=MAX_HASH_DISTANCE):
+    """
+    Divide o hash em max_distance + 1 faixas de bits. Se dois hashes diferem em até
+    max_distance bits, pelo menos uma faixa é idêntica (casa das gavetas): as faixas
+    servem de índice exato no SQLite para achar os candidatos.
+    """
+    n = max_distance + 1
+    widths = [_HASH_BITS // n + (1 if i < _HASH_BITS % n else 0) for i in range(n)]
+    bands, shift = [], 0
+    for i, width in enumerate(widths):
+        bands.append((i, (phash >> shift) & ((1 << width) - 1)))
+        shift += width
+    return bands
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _to_sqlite_int(phash):
+    # INTEGER do SQLite é 64 bits com sinal
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+
+class CacheKey(namedtuple("CacheKey", "key scope phash content thumb")):
+    """
+    key: chave exata (escopo + conteúdo); scope: namespace + parâmetros extras (ex: cor do overlay);
+    phash/thumb: usados para achar quase-duplicatas (recompressão, redimensionamento).
+    """
+
+    __slots__ = ()
+
+
+class ResultCache:
+    """
+    Cache de resultados do CLIPAIModel em dois níveis:
+      1. Memória: LRU limitado por quantidade de itens e bytes.
+      2. Disco: SQLite, com despejo dos itens acessados há mais tempo quando passa de `max_disk_bytes`.
+    Cada entrada guarda o dict de predict_with_defect_map (sem os caminhos) e o PNG do overlay.
+
+    A busca tenta primeiro a chave exata (hash do conteúdo) e depois quase-duplicatas:
+    dHash a até `max_distance` bits (via faixas do hash), confirmadas pela miniatura 16x16.
+    Entre candidatos à mesma distância, o de mesmo conteúdo vence.
+    """
+
+    def __init__(self, db_path=os.path.join("outputs", "cache", "results.sqlite"), namespace="",
+                 max_memory_items=256, max_memory_bytes=256 * 1024 * 1024, max_disk_bytes=2 * 1024 ** 3,
+                 max_distance=MAX_HASH_DISTANCE, max_thumb_diff=MAX_THUMB_DIFF):
+        self.namespace = namespace
+        self.max_memory_items = max_memory_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_distance = max_distance
+        self.max_thumb_diff = max_thumb_diff
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "near_hits": 0, "misses": 0}
+
+        self._db = None
+        self._disk_bytes = 0
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, result TEXT NOT NULL, overlay BLOB,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            # Caches gravados antes das quase-duplicatas: as colunas novas ficam NULL nas linhas antigas
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(results)")}
+            for column, kind in (("scope", "TEXT"), ("phash", "INTEGER"), ("thumb", "BLOB")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE results ADD COLUMN {column} {kind}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hash_bands ("
+                " band INTEGER NOT NULL, value INTEGER NOT NULL, key TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results(last_access)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_bands ON hash_bands(band, value)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_bands_key ON hash_bands(key)")
+            self._db.commit()
+            # Total em disco mantido em memória (uma única soma na abertura)
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def make_key(self, image, *extra):
+        """Chave da imagem: escopo (namespace + parâmetros extras, ex: cor do overlay) + hashes do conteúdo."""
+        scope = "|".join([self.namespace] + [str(e) for e in extra])
+        content = content_hash(image)
+        return CacheKey(f"{scope}|{content}", scope, perceptual_hash(image), content, thumbnail(image))
+
+    def _similar(self, cache_key, phash, thumb):
+        """Distância de Hamming se o candidato passar na verificação da miniatura; senão None."""
+        if phash is None or thumb is None:
+            return None
+        distance = _hamming(cache_key.phash, phash & ((1 << 64) - 1))
+        if distance > self.max_distance:
+            return None
+        diff = np.abs(np.frombuffer(cache_key.thumb, dtype=np.uint8).astype(np.int16)
+                      - np.frombuffer(thumb, dtype=np.uint8).astype(np.int16)).mean()
+        return distance if diff <= self.max_thumb_diff else None
+
+    def _nearest(self, cache_key, candidates):
+        """Melhor candidato (key, phash, thumb): menor distância; empate decidido pelo mesmo conteúdo."""
+        best = None
+        for key, phash, thumb in candidates:
+            distance = self._similar(cache_key, phash, thumb)
+            if distance is None:
+                continue
+            rank = (distance, not key.endswith("|" + cache_key.content))
+            if best is None or rank < best[0]:
+                best = (rank, key)
+        return best[1] if best else None
+
+    def get(self, cache_key):
+        """Retorna (resultado, overlay_png ou None) ou None em caso de miss."""
+        with self._lock:
+            entry = self._memory.get(cache_key.key)
+            if entry is not None:
+                self._memory.move_to_end(cache_key.key)
+                self.stats["memory_hits"] += 1
+                telemetry.count("megatruth_cache_events_total", cache="result", event="memory_hit")
+                return json.loads(entry[0]), entry[1]
+
+            if self._db is None:
+                key = self._nearest(cache_key, [(k, e[3].phash, e[3].thumb) for k, e in self._memory.items()
+                                                if e[3].scope == cache_key.scope])
+                if key is not None:
+                    entry = self._memory[key]
+                    self._memory.move_to_end(key)
+                    self.stats["near_hits"] += 1
+                    telemetry.count("megatruth_cache_events_total", cache="result", event="near_hit")
+                    return json.loads(entry[0]), entry[1]
+            else:
+                row = self._db.execute("SELECT key, result, overlay FROM results WHERE key = ?",
+                                       (cache_key.key,)).fetchone()
+                event = "disk_hit"
+                if row is None:
+                    bands = hash_bands(cache_key.phash, self.max_distance)
+                    where = " OR ".join("(b.band = ? AND b.value = ?)" for _ in bands)
+                    candidates = self._db.execute(
+                        "SELECT DISTINCT r.key, r.phash, r.thumb FROM hash_bands b JOIN results r ON r.key = b.key"
+                        f" WHERE r.scope = ? AND ({where})",
+                        [cache_key.scope] + [v for band in bands for v in band],
+                    ).fetchall()
+                    key = self._nearest(cache_key, candidates)
+                    if key is not None:
+                        row = self._db.execute("SELECT key, result, overlay FROM results WHERE key = ?",
+                                               (key,)).fetchone()
+                        event = "near_hit"
+                if row is not None:
+                    self._db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), row[0]))
+                    self._db.commit()
+                    self.stats["disk_hits" if event == "disk_hit" else "near_hits"] += 1
+                    telemetry.count("megatruth_cache_events_total", cache="result", event=event)
+                    # Em memória fica sob a chave exata desta imagem
+                    self._remember(cache_key, row[1], row[2])
+                    return json.loads(row[1]), row[2]
+
+            self.stats["misses"] += 1
+            telemetry.count("megatruth_cache_events_total", cache="result", event="miss")
+            return None
+
+    def put(self, cache_key, result, overlay_png=None):
+        """Armazena o resultado nos dois níveis. Caminhos e o overlay em memória não são guardados no JSON."""
+        payload = json.dumps({k: v for k, v in result.items() if k not in EXCLUDED_KEYS}, ensure_ascii=False)
+        with self._lock:
+            self._remember(cache_key, payload, overlay_png)
+
+            if self._db is not None:
+                size = len(payload) + (len(overlay_png) if overlay_png else 0)
+                old = self._db.execute("SELECT size FROM results WHERE key = ?", (cache_key.key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, result, overlay, size, last_access, scope, phash, thumb)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key.key, payload, overlay_png, size, time.time(), cache_key.scope,
+                     _to_sqlite_int(cache_key.phash), cache_key.thumb),
+                )
+                if old is None:
+                    self._db.executemany("INSERT INTO hash_bands (band, value, key) VALUES (?, ?, ?)",
+                                         [(band, value, cache_key.key)
+                                          for band, value in hash_bands(cache_key.phash, self.max_distance)])
+                self._disk_bytes += size - (old[0] if old else 0)
+                self._evict_disk()
+                self._db.commit()
+
+    def _remember(self, cache_key, payload, overlay_png):
+        size = len(payload) + (len(overlay_png) if overlay_png else 0)
+        old = self._memory.pop(cache_key.key, None)
+        if old is not None:
+            self._memory_bytes -= old[2]
+        self._memory[cache_key.key] = (payload, overlay_png, size, cache_key)
+        self._memory_bytes += size
+
+        while self._memory and (len(self._memory) > self.max_memory_items or self._memory_bytes > self.max_memory_bytes):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted[2]
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            row = self._db.execute("SELECT key, size FROM results ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                self._disk_bytes = 0
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (row[0],))
+            self._db.execute("DELETE FROM hash_bands WHERE key = ?", (row[0],))
+            self._disk_bytes -= row[1]
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import itertools
+
+from pipeline.paths import iter_image_paths
+from pipeline.prefetch import PreprocessPipeline
+from pipeline.worker_pool import WorkerPool
+
+def _read_checkpoint(checkpoint_path):
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_checkpoint(checkpoint_path, state):
+    """Escrita atômica (tmp + replace) para não corromper o checkpoint em caso de queda."""
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _to_record(path, result):
+    """Converte a saída do CLIPAIModel em uma linha JSONL."""
+    if "error" in result:
+        return {"path": path, "error": result["error"]}
+
+    return {
+        "path": path,
+        "label": result["label"],
+        "probability": result["probability"],
+        "probabilities": result["probabilities"],
+        "conceitos": result["conceitos"],
+        "overlay_path": result["overlay_path"],
+    }
+
+
+def run_scan(clip_model, source, output_path, batch_size=16, workers=4, queue_depth=4,
+             resume=False, checkpoint_every=500, overlay_color="red", processes=0, threads_per_worker=None,
+             store=None):
+    """
+    Varre `source` e grava um resultado por linha em `output_path` (JSONL),
+    assim que cada lote termina.
+
+    O checkpoint (`<output>.ckpt`) guarda quantas imagens já foram gravadas e o
+    tamanho do JSONL nesse ponto. Com `resume=True`, o JSONL é truncado nesse
+    offset e as primeiras N imagens da fonte são puladas.
+
+    A leitura e o pré-processamento rodam em `workers` threads, com até
+    `queue_depth` lotes prontos esperando o modelo (ver PreprocessPipeline).
+    Com `processes` > 0 (CPU), os lotes vão para um pool de processos que
+    compartilham os pesos do modelo (ver WorkerPool).
+
+    Com `store` (EmbeddingStore), o embedding e o resultado de cada imagem também
+    vão para a base de embeddings, com o caminho absoluto como chave.
+    """
+    checkpoint_path = output_path + ".ckpt"
+    processed = 0
+    offset = 0
+
+    if resume and os.path.exists(checkpoint_path):
+        state = _read_checkpoint(checkpoint_path)
+        if state.get("source") != source:
+            raise ValueError(f"Checkpoint pertence a outra fonte: {state.get('source')}")
+        processed = state["processed"]
+        offset = state["offset"]
+        print(f"↩️ Retomando após {processed} imagens ({checkpoint_path})")
+
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    mode = "r+b" if offset and os.path.exists(output_path) else "wb"
+    paths = itertools.islice(iter_image_paths(source), processed, None)
+    start = time.perf_counter()
+    done_this_run = 0
+    last_checkpoint = processed
+
+    if processes:
+        pipeline = WorkerPool(clip_model, processes=processes, batch_size=batch_size,
+                              threads_per_worker=threads_per_worker)
+    else:
+        pipeline = PreprocessPipeline(clip_model, batch_size=batch_size, workers=workers, queue_depth=queue_depth)
+    try:
+        with open(output_path, mode) as out:
+            out.seek(offset)
+            out.truncate()
+
+            for batch in pipeline.run(paths, overlay_color=overlay_color):
+                for path, result in batch:
+                    line = json.dumps(_to_record(path, result), ensure_ascii=False) + "\n"
+                    out.write(line.encode("utf-8"))
+                    if store is not None and "error" not in result:
+                        store.add_result(result, key=f"path:{os.path.abspath(path)}", path=path)
+                out.flush()
+
+                processed += len(batch)
+                done_this_run += len(batch)
+
+                if processed - last_checkpoint >= checkpoint_every:
+                    os.fsync(out.fileno())
+                    _write_checkpoint(checkpoint_path, {"source": source, "processed": processed, "offset": out.tell()})
+                    last_checkpoint = processed
+
+                    elapsed = time.perf_counter() - start
+                    print(f"📦 {processed} imagens gravadas ({done_this_run / elapsed:.1f} img/s)")
+
+            os.fsync(out.fileno())
+            _write_checkpoint(checkpoint_path, {"source": source, "processed": processed, "offset": out.tell()})
+    finally:
+        if processes:
+            # Encerra os workers mesmo se a varredura falhar ou for interrompida
+            pipeline.close()
+
+    elapsed = time.perf_counter() - start
+    rate = done_this_run / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Varredura concluída: {processed} imagens ({rate:.1f} img/s) -> {output_path}")
+    pipeline.metrics.report()
+    return processed
@@ -0,0 +1,151 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from pipeline import telemetry
+
+
+class SchedulerFull(RuntimeError):
+    """A fila do agendador está cheia (backpressure): o pedido deve ser recusado ou repetido depois."""
+
+
+class MicroBatchScheduler:
+    """
+    Agendador de micro-lotes na frente do CLIPAIModel.
+
+    Cada pedido é decodificado e pré-processado na própria thread de quem o envia
+    (ex: o worker do Gradio de cada sessão) e entra em uma fila limitada. Uma única
+    thread de GPU junta os pedidos que chegam dentro de `max_wait_ms` (até
+    `max_batch_size`), roda um forward em lote e devolve cada resultado ao seu
+    pedido via Future. Com a fila cheia, submit() falha com SchedulerFull em vez
+    de acumular memória.
+    """
+
+    def __init__(self, clip_model, max_batch_size=8, max_wait_ms=20, queue_depth=32):
+        """
+        Args:
+            clip_model (CLIPAIModel): Modelo compartilhado (só a thread do agendador o executa).
+            max_batch_size (int): Máximo de imagens por forward.
+            max_wait_ms (float): Quanto esperar por mais pedidos depois do primeiro do lote.
+            queue_depth (int): Pedidos aguardando além do lote em execução.
+        """
+        self.clip_model = clip_model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.queue_depth = max(1, queue_depth)
+
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "images": 0, "errors": 0,
+                      "queue_wait_seconds": 0.0, "model_seconds": 0.0}
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="clip-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, overlay_color="red", timeout=0.0):
+        """
+        Enfileira uma imagem (caminho, PIL, NumPy ou par (imagem, caminho)).
+        Args:
+            timeout (float): Quanto esperar por espaço na fila (0 = recusa na hora).
+        Returns:
+            concurrent.futures.Future: Resolve com o dict de predict_with_defect_map.
+        Raises:
+            SchedulerFull: Fila cheia após `timeout`.
+        """
+        # Pré-processamento fora da thread da GPU: pedidos diferentes são preparados em paralelo
+        prepared = self.clip_model.prepare_image(image)
+        future = Future()
+        try:
+            self._queue.put((prepared, overlay_color, future, time.perf_counter()),
+                            block=timeout > 0, timeout=timeout if timeout > 0 else None)
+        except queue.Full:
+            with self._lock:
+                self.stats["rejected"] += 1
+            telemetry.count("megatruth_scheduler_rejected_total")
+            raise SchedulerFull(f"Fila de inferência cheia ({self.queue_depth} pedidos aguardando)")
+        with self._lock:
+            self.stats["requests"] += 1
+        return future
+
+    def predict(self, image, overlay_color="red", timeout=None, queue_timeout=0.0):
+        """
+        Versão bloqueante de submit(): espera o resultado (até `timeout` segundos).
+        No timeout o pedido é cancelado, para não ocupar um lugar no lote de ninguém.
+        """
+        future = self.submit(image, overlay_color, timeout=queue_timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    def _collect(self):
+        """
+        Bloqueia até o primeiro pedido e junta os que chegarem dentro de max_wait.
+        Pedidos cancelados (ex: timeout em predict, sessão encerrada) são descartados
+        aqui e não ocupam lugar no lote; os aceitos passam a RUNNING e não podem mais ser cancelados.
+        """
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first] if first[2].set_running_or_notify_cancel() else []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[2].set_running_or_notify_cancel():
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for item in batch:
+                telemetry.observe("megatruth_queue_wait_seconds", started - item[3])
+            telemetry.count("megatruth_scheduler_batches_total")
+            try:
+                collated = self.clip_model.collate_prepared([item[0] for item in batch])
+                results = self.clip_model.predict_collated(collated, overlay_color=[item[1] for item in batch])
+                for (_, _, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                print(f"⚠️ Erro no lote do agendador ({len(batch)} imagens): {e}")
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                with self._lock:
+                    self.stats["errors"] += len(batch)
+
+            with self._lock:
+                self.stats["batches"] += 1
+                self.stats["images"] += len(batch)
+                self.stats["queue_wait_seconds"] += sum(started - item[3] for item in batch)
+                self.stats["model_seconds"] += time.perf_counter() - started
+
+    def summary(self):
+        with self._lock:
+            s = dict(self.stats)
+        s["queued"] = self._queue.qsize()
+        s["avg_batch_size"] = s["images"] / s["batches"] if s["batches"] else 0.0
+        s["avg_queue_wait_ms"] = s["queue_wait_seconds"] * 1000.0 / s["images"] if s["images"] else 0.0
+        return s
+
+    def close(self):
+        """Para a thread do agendador; pedidos ainda na fila são cancelados."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        while True:
+            try:
+                _, _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
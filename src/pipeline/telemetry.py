@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Limites (s) dos histogramas de estágio: do pré-processamento (ms) ao laudo do LLM (dezenas de s)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SPAN_BUFFER = 2048
+
+
+class LatencyHistogram:
+    """
+    Histograma de latências com buckets fixos (ex: tempo até o primeiro token de um backend).
+    O percentil é estimado pelo limite superior do bucket que o contém,
+    o que é suficiente para decidir o atraso do hedge.
+    """
+
+    def __init__(self, bounds=STAGE_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # último bucket = acima do maior limite
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def merge(self, counts, count, total):
+        """Soma as contagens de outro histograma com os mesmos limites (ex: vindo de um worker)."""
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.total += total
+
+    def percentile(self, q):
+        """Latência abaixo da qual estão `q` (0-1) das observações; None se vazio."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = q * self.count
+            seen = 0
+            for i, c in enumerate(self.counts):
+                seen += c
+                if seen >= target:
+                    return self.bounds[i] if i < len(self.bounds) else float("inf")
+            return float("inf")
+
+    def snapshot(self):
+        """(limites, contagem por bucket, total de observações, soma) lidos de uma vez."""
+        with self._lock:
+            return self.bounds, list(self.counts), self.count, self.total
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels, extra=None):
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class Telemetry:
+    """
+    Spans, contadores e histogramas de latência do processo.
+
+    span(estágio) cronometra um trecho e alimenta o histograma megatruth_stage_seconds;
+    os spans aninhados guardam o span pai, ficam nos últimos `span_buffer` registros e,
+    se configurado, vão para um arquivo JSONL. Tudo sai no formato de texto do Prometheus
+    (rota /metrics da API ou arquivo gravado periodicamente).
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS, span_buffer=SPAN_BUFFER):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.spans = deque(maxlen=span_buffer)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._current = contextvars.ContextVar("megatruth_span", default=None)
+        self._trace_file = None
+        self._trace_lock = threading.Lock()
+        self._exporter = None
+
+    # ------------------------------------------------------------------
+    # Registro
+    # ------------------------------------------------------------------
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = LatencyHistogram(self.buckets)
+        hist.observe(seconds)
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """Cronometra o bloco como um estágio. Exceções são contadas e repassadas."""
+        span_id = next(self._ids)
+        parent = self._current.get()
+        token = self._current.set(span_id)
+        started_at = time.time()
+        t0 = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - t0
+            try:
+                self._current.reset(token)
+            except ValueError:
+                pass  # gerador retomado em outra thread/contexto (ex: streaming do Gradio)
+            self.observe("megatruth_stage_seconds", seconds, stage=stage)
+            if status == "error":
+                self.count("megatruth_stage_errors_total", stage=stage)
+            record = {"id": span_id, "parent": parent, "pid": os.getpid(), "stage": stage,
+                      "start": started_at, "seconds": seconds, "status": status, **attrs}
+            self.spans.append(record)
+            self._write_span(record)
+
+    def traced(self, stage):
+        """Decorador: cada chamada da função vira um span `stage`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def drain(self):
+        """
+        Retira (e zera) os contadores, histogramas e spans registrados até aqui, em um dict
+        que pode ir por pickle. Os workers do WorkerPool devolvem isso ao pai junto com cada lote.
+        """
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+        spans = []
+        while self.spans:
+            spans.append(self.spans.popleft())
+        return {
+            "counters": counters,
+            "histograms": {key: hist.snapshot() for key, hist in histograms.items()},
+            "spans": spans,
+        }
+
+    def merge(self, drained):
+        """Soma ao registro deste processo o que veio de drain() em outro processo."""
+        with self._lock:
+            for key, value in drained["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (bounds, counts, count, total) in drained["histograms"].items():
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = LatencyHistogram(bounds)
+                hist.merge(counts, count, total)
+        # Os spans já foram gravados no arquivo de trace pelo próprio worker
+        self.spans.extend(drained["spans"])
+
+    # ------------------------------------------------------------------
+    # Exportação
+    # ------------------------------------------------------------------
+    def render_prometheus(self):
+        """Contadores e histogramas no formato de texto do Prometheus (0.0.4)."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels_text(labels)} {value}")
+
+        for (name, labels), hist in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            bounds, counts, count, total = hist.snapshot()
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {total}")
+            lines.append(f"{name}_count{_labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Grava o texto do Prometheus de forma atômica (ex: textfile collector do node_exporter)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+    def start_file_exporter(self, path, interval=15.0):
+        """Regrava `path` a cada `interval` segundos e uma última vez ao sair do processo."""
+        if self._exporter is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_prometheus(path)
+                except OSError as e:
+                    print(f"⚠️ Falha ao gravar métricas em {path}: {e}")
+
+        self._exporter = threading.Thread(target=loop, name="metrics-exporter", daemon=True)
+        self._exporter.start()
+        atexit.register(self.write_prometheus, path)
+        print(f"📈 Métricas (Prometheus) em {path} a cada {interval:.0f}s")
+
+    def trace_to(self, path):
+        """Acrescenta cada span concluído como uma linha JSON em `path`."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._trace_lock:
+            self._trace_file = open(path, "a", encoding="utf-8", buffering=1)
+        print(f"🧵 Spans em {path}")
+
+    def _write_span(self, record):
+        if self._trace_file is None:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._trace_lock:
+            self._trace_file.write(line + "\n")
+
+
+telemetry = Telemetry()
+
+# Atalhos para o registro do processo
+count = telemetry.count
+observe = telemetry.observe
+span = telemetry.span
+traced = telemetry.traced
+drain = telemetry.drain
+merge = telemetry.merge
+
+
+def configure_from_env():
+    """
+    MEGATRUTH_METRICS_FILE: arquivo de métricas (Prometheus), regravado a cada
+    MEGATRUTH_METRICS_INTERVAL segundos (padrão 15). MEGATRUTH_TRACE_FILE: spans em JSONL.
+    Ambos aceitam {pid}, para vários processos (ex: a API e um scan rodando juntos) não gravarem no mesmo arquivo.
+    """
+    metrics_file = os.getenv("MEGATRUTH_METRICS_FILE")
+    if metrics_file:
+        telemetry.start_file_exporter(metrics_file.format(pid=os.getpid()),
+                                      float(os.getenv("MEGATRUTH_METRICS_INTERVAL", "15")))
+    trace_file = os.getenv("MEGATRUTH_TRACE_FILE")
+    if trace_file and telemetry._trace_file is None:
+        telemetry.trace_to(trace_file.format(pid=os.getpid()))
@@ -0,0 +1,180 @@
+import os
+import time
+import multiprocessing as mp
+
+import torch
+
+from pipeline import telemetry
+from pipeline.prefetch import PipelineMetrics
+
+# Modelo herdado pelos processos filhos (fork). Definido no pai antes de criar o pool.
+_POOL_MODEL = None
+
+
+def default_threads_per_worker(processes):
+    """Divide os núcleos disponíveis entre os workers para não haver sobreinscrição."""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(1, cores // max(1, processes))
+
+
+def _init_worker(threads):
+    # Cada worker usa só a sua fatia de núcleos (intra-op) e nenhum paralelismo inter-op
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # já definido neste processo
+    # O fork copiou a telemetria do pai: descarta para não contar duas vezes ao devolver
+    telemetry.drain()
+
+
+def _run_chunk(paths, overlay_color):
+    """Executado no worker: decodifica e roda o pipeline completo em um lote de caminhos."""
+    clip = _POOL_MODEL
+    t0 = time.perf_counter()
+    results = [None] * len(paths)
+    loaded, positions = [], []
+    for i, path in enumerate(paths):
+        try:
+            loaded.append(clip._load_image(path))
+            positions.append(i)
+        except Exception as e:
+            results[i] = {"error": str(e)}
+    t1 = time.perf_counter()
+
+    preds = clip._predict_loaded(loaded, overlay_color) if loaded else []
+    for i, pred in zip(positions, preds):
+        # O overlay em memória não volta pelo pipe (já foi gravado em disco se persist_outputs)
+        pred.pop("overlay_image", None)
+        results[i] = pred
+    # Contadores e spans do worker voltam ao pai (senão sumiriam com o processo)
+    return results, t1 - t0, time.perf_counter() - t1, telemetry.drain()
+
+
+def process_memory_mb(pid):
+    """(RSS, PSS) em MB de um processo via /proc (Linux). O PSS divide as páginas compartilhadas entre os processos."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            fields = {line.split(":")[0]: line.split()[1] for line in f if ":" in line}
+        return int(fields["Rss"]) / 1024.0, int(fields["Pss"]) / 1024.0
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class WorkerPool:
+    """
+    Pool de processos para inferência em CPU com os pesos carregados uma única vez.
+
+    O pai carrega todos os modelos dos estágios habilitados e só então cria os workers
+    via fork: as páginas dos pesos são herdadas (copy-on-write) e, como a inferência só
+    as lê, todos usam os mesmos pesos, sem cópia. A telemetria de cada worker volta
+    ao pai junto com os resultados de cada lote. Os lotes de caminhos são distribuídos por uma
+    fila com no máximo `max_in_flight` lotes pendentes, e os resultados voltam na
+    ordem de entrada. Cada worker usa `threads_per_worker` threads do PyTorch
+    (padrão: núcleos / processos). Mesma interface de PreprocessPipeline (run + metrics).
+    """
+
+    def __init__(self, clip_model, processes=None, batch_size=8, threads_per_worker=None, max_in_flight=None):
+        if "fork" not in mp.get_all_start_methods():
+            raise RuntimeError("WorkerPool requer fork (Linux). Use o pipeline de threads (PreprocessPipeline).")
+        if clip_model.device != "cpu":
+            raise ValueError("WorkerPool é para inferência em CPU; em GPU use o pipeline de threads.")
+        if clip_model.runtime != "torch":
+            # As threads internas do ONNX Runtime não sobrevivem ao fork
+            raise ValueError("WorkerPool compartilha pesos do PyTorch; com runtime ONNX use o pipeline de threads.")
+
+        self.clip_model = clip_model
+        self.processes = processes or default_threads_per_worker(1)
+        self.batch_size = max(1, batch_size)
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.processes)
+        self.max_in_flight = max_in_flight or self.processes * 2
+        self.metrics = PipelineMetrics()
+        self._pool = None
+        self._parent_threads = None
+
+    def _share_weights(self):
+        global _POOL_MODEL
+        # Uma thread no pai: nenhum pool OpenMP ativo no momento do fork (restaurado em close)
+        self._parent_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        self.clip_model.load()
+        if "concepts" in self.clip_model.stages:
+            self.clip_model._pixels_are_shared()  # resolvido uma vez no pai, herdado pelos workers
+        # Sem share_memory(): com fork ele só copiaria os pesos para /dev/shm e dobraria o RSS
+        _POOL_MODEL = self.clip_model
+
+    def start(self):
+        if self._pool is None:
+            self._share_weights()
+            print(f"🧵 WorkerPool: {self.processes} processos x {self.threads_per_worker} threads")
+            ctx = mp.get_context("fork")
+            self._pool = ctx.Pool(self.processes, initializer=_init_worker, initargs=(self.threads_per_worker,))
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._parent_threads is not None:
+            torch.set_num_threads(self._parent_threads)
+            self._parent_threads = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def memory_report(self):
+        """RSS e PSS (MB) somados do pai e dos workers vivos."""
+        pids = [os.getpid()] + [p.pid for p in mp.active_children()]
+        rss = pss = 0.0
+        for pid in pids:
+            r, p = process_memory_mb(pid)
+            if r is None:
+                return None
+            rss += r
+            pss += p
+        return {"processes": len(pids), "rss_mb": rss, "pss_mb": pss}
+
+    def _chunks(self, paths):
+        chunk = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) >= self.batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self, paths, overlay_color="red"):
+        """
+        Consome `paths` (qualquer iterável) e gera, a cada lote, uma lista de
+        (caminho, resultado) na ordem de entrada. Imagens ilegíveis geram {"error": ...}.
+        """
+        self.start()
+        pending = []
+        chunks = self._chunks(paths)
+
+        def fill():
+            while len(pending) < self.max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                pending.append((chunk, self._pool.apply_async(_run_chunk, (chunk, overlay_color))))
+
+        fill()
+        while pending:
+            chunk, async_result = pending.pop(0)
+            t0 = time.perf_counter()
+            results, decode_s, model_s, worker_telemetry = async_result.get()
+            telemetry.merge(worker_telemetry)
+            self.metrics.add("wait", time.perf_counter() - t0)
+            self.metrics.add("decode", decode_s)
+            self.metrics.add("model", model_s)
+            fill()
+
+            errors = sum(1 for r in results if "error" in r)
+            self.metrics.count(images=len(chunk), errors=errors, batches=1)
+            yield list(zip(chunk, results))
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from pipeline import embedding_store                                            # noqa: E402
+from pipeline.embedding_store import EmbeddingStore, FAKE_LABEL, REAL_LABEL     # noqa: E402
+
+
+def clustered(rng, n, dim, clusters=64, spread=0.35):
+    """Vetores agrupados (como embeddings de imagens parecidas), já normalizados."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)] + spread * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Base de embeddings: persistência, duplicatas e recall do índice IVF")
+    parser.add_argument("--rows", type=int, default=60_000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = clustered(rng, args.rows, args.dim)
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name} {detail}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory(prefix="megatruth_embeddings_") as directory:
+        store = EmbeddingStore(directory, namespace="test")
+        t0 = time.perf_counter()
+        for i, vec in enumerate(data):
+            # Um rótulo raro (~1 a cada 10 mil), para a busca filtrada ter que alargar as listas do IVF
+            label = "raro" if i % 10_000 == 7 else FAKE_LABEL if i % 2 else REAL_LABEL
+            store.add(vec, key=f"img{i}", label=label, probability=0.9)
+        print(f"ℹ️ {args.rows} embeddings gravados em {time.perf_counter() - t0:.1f}s")
+        check("Chave repetida não duplica", store.add(data[0], key="img0") == 1 and len(store) == args.rows)
+
+        # Quase-duplicata: o mesmo vetor com um pouco de ruído
+        noisy = data[123] + 0.005 * rng.standard_normal(args.dim).astype(np.float32)
+        dup = store.find_duplicate(noisy)
+        check("Quase-duplicata", dup is not None and dup["key"] == "img123",
+              f"(similaridade {dup['similarity']:.3f})" if dup else "")
+
+        similar = store.similar(data[10], k=5, exclude=[11])
+        check("Fakes semelhantes", len(similar) == 5 and all(h["label"] == FAKE_LABEL for h in similar)
+              and all(h["id"] != 11 for h in similar))
+        store.adjudicate(1, FAKE_LABEL)
+        check("Veredito do analista", store.get(1)["verdict"] == FAKE_LABEL
+              and any(h["id"] == 1 for h in store.similar(data[0], k=5)))
+
+        # Recall do IVF x busca exata
+        queries = clustered(rng, args.queries, args.dim)
+        exact_limit = embedding_store.EXACT_SEARCH_ROWS
+        embedding_store.EXACT_SEARCH_ROWS = args.rows + 1
+        exact = [[h["id"] for h in store.search(q, k=args.k)] for q in queries]
+        t0 = time.perf_counter()
+        for q in queries:
+            store.search(q, k=args.k)
+        exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        embedding_store.EXACT_SEARCH_ROWS = 0
+        store.build_index()
+        t0 = time.perf_counter()
+        approx = [[h["id"] for h in store.search(q, k=args.k)] for q in queries]
+        ivf_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        rare = store.similar(queries[0], k=3, label="raro")
+        check("Rótulo raro com IVF", len(rare) == 3 and all(h["label"] == "raro" for h in rare))
+        embedding_store.EXACT_SEARCH_ROWS = exact_limit
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+        check("Recall do IVF", recall >= args.min_recall,
+              f"recall@{args.k} {recall:.3f} | {ivf_ms:.2f} ms x {exact_ms:.2f} ms (exata)")
+        store.close()
+
+        # Persistência: reabre a pasta
+        reopened = EmbeddingStore(directory, namespace="test")
+        vec = reopened.vector(reopened.id_for_key("img42"))
+        check("Persistência", len(reopened) == args.rows and float(vec @ data[42]) > 0.999)
+        try:
+            EmbeddingStore(directory, namespace="outro-modelo")
+            check("Outro modelo recusado", False)
+        except ValueError:
+            check("Outro modelo recusado", True)
+        reopened.close()
+
+    if failures:
+        print(f"\n❌ Falhas: {failures}")
+        sys.exit(1)
+    print("\n✅ Base de embeddings OK.")
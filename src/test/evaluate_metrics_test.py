@@ -0,0 +1,63 @@
+import os
+import sys
+import itertools
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from pipeline.evaluate import confusion_matrix, roc_auc, concept_firing      # noqa: E402
+
+
+def roc_auc_pairs(labels, scores):
+    """Referência: fração dos pares (IA, real) ordenados corretamente, empates valem 1/2."""
+    pos, neg = scores[labels == 1], scores[labels == 0]
+    total = sum(1.0 if p > n else 0.5 if p == n else 0.0 for p, n in itertools.product(pos, neg))
+    return total / (len(pos) * len(neg))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name} {detail}")
+        if not ok:
+            failures.append(name)
+
+    # ROC-AUC vetorizado x pares, com e sem empates
+    for trial in range(20):
+        n = int(rng.integers(2, 200))
+        labels = rng.integers(0, 2, n)
+        labels[:2] = [0, 1]
+        scores = rng.random(n) if trial % 2 else np.round(rng.random(n), 1)
+        got, want = roc_auc(labels, scores), roc_auc_pairs(labels, scores)
+        if abs(got - want) > 1e-9:
+            check(f"ROC-AUC (n={n})", False, f"{got} != {want}")
+            break
+    else:
+        check("ROC-AUC", True, "igual à contagem de pares em 20 sorteios")
+    check("ROC-AUC com uma classe só", roc_auc(np.zeros(5, dtype=np.int64), rng.random(5)) is None)
+
+    labels = np.array([0, 0, 0, 1, 1, 1, 1])
+    preds = np.array([0, 1, 0, 1, 1, 0, 1])
+    cm = confusion_matrix(labels, preds)
+    check("Matriz de confusão", cm.tolist() == [[2, 1], [1, 3]], str(cm.tolist()))
+
+    # Imagens não suspeitas nunca disparam conceitos (como no pipeline)
+    fired = np.array([[True, False],
+                      [False, False],
+                      [True, True],
+                      [False, False]])
+    suspect = np.array([True, False, True, True])
+    rates, suspects = concept_firing(fired, suspect, np.array([0, 0, 1, 1]), ["a", "b"])
+    check("Disparo de conceitos", rates["a"]["real"] == 0.5 and rates["a"]["IA"] == 0.5
+          and rates["b"]["real"] == 0.0 and rates["b"]["IA"] == 0.5 and rates["a"]["all"] == 0.5, str(rates))
+    check("Fração de suspeitas", suspects == {"real": 0.5, "IA": 1.0}, str(suspects))
+
+    if failures:
+        print(f"\n❌ Falhas: {failures}")
+        sys.exit(1)
+    print("\n✅ Métricas da avaliação corretas.")
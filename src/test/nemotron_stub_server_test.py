@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from models.multimodal_model_nemotron import NemotronVL  # noqa: E402
+
+
+class StubState:
+    """Contadores compartilhados pelo servidor de teste."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = set()
+        self.delay = (0.05, 0.2)
+        self.fail_every = 4  # a cada N requisições, responde 429 ou 503
+
+
+STATE = StubState()
+
+
+class ChatCompletionsStub(BaseHTTPRequestHandler):
+    """Imita POST /api/v1/chat/completions do OpenRouter, com falhas transitórias e latência."""
+
+    protocol_version = "HTTP/1.1"  # mantém a conexão viva (keep-alive), como a API real
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply_stream(self, text):
+        """Server-Sent Events no formato do OpenRouter: um delta por palavra, comentário de keep-alive e [DONE]."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+        for word in text.split(" "):
+            event = {"choices": [{"delta": {"content": word + " "}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(0.02)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with STATE.lock:
+            STATE.requests += 1
+            n = STATE.requests
+            STATE.in_flight += 1
+            STATE.max_in_flight = max(STATE.max_in_flight, STATE.in_flight)
+            STATE.connections.add(self.client_address)
+
+        try:
+            time.sleep(random.uniform(*STATE.delay))
+            if self.path != "/api/v1/chat/completions":
+                return self._reply(404, {"error": "not found"})
+            if STATE.fail_every and n % STATE.fail_every == 0:
+                if n % (2 * STATE.fail_every) == 0:
+                    return self._reply(429, {"error": "rate limited"}, {"Retry-After": "0.1"})
+                return self._reply(503, {"error": "unavailable"})
+
+            images = [c for c in payload["messages"][0]["content"] if c["type"] == "image_url"]
+            text = f"Laudo de teste ({len(images)} imagens, modelo {payload['model']})"
+            if payload.get("stream"):
+                return self._reply_stream(text)
+            return self._reply(200, {"choices": [{"message": {"role": "assistant", "content": text}}]})
+        finally:
+            with STATE.lock:
+                STATE.in_flight -= 1
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("MEGATRUTH - TESTE DO CLIENTE NEMOTRON (SERVIDOR LOCAL)")
+    print("=" * 60)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionsStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+    os.environ.setdefault("OPENROUTER_API_KEY", "stub-key")
+
+    max_concurrency = 4
+    client = NemotronVL(base_url=base_url, max_concurrency=max_concurrency,
+                        max_retries=5, timeout=5.0, deadline=20.0, backoff_base=0.05, backoff_max=0.5)
+
+    original = Image.new("RGB", (2000, 1500), (120, 90, 60))
+    overlay = Image.new("RGB", (2000, 1500), (200, 40, 40))
+    jobs = [
+        {
+            "imagem_original": original,
+            "defect_map": overlay,
+            "classificacao_clip": "Imagem Gerada por IA",
+            "probabilidade_clip": 0.9,
+            "conceitos_detectados": {"deformed hands": 0.4},
+        }
+        for _ in range(24)
+    ]
+
+    # --- 1. Lote concorrente com falhas transitórias (429/503) ---
+    start = time.perf_counter()
+    results = client.analisar_lote(jobs)
+    elapsed = time.perf_counter() - start
+
+    ok = sum(r is not None for r in results)
+    print(f"\n✅ {ok}/{len(jobs)} laudos em {elapsed:.2f}s")
+    print(f"   Requisições: {STATE.requests} | Repetições: {client.stats['retries']}")
+    print(f"   Máx. simultâneas no servidor: {STATE.max_in_flight} (limite {max_concurrency})")
+    print(f"   Conexões TCP distintas: {len(STATE.connections)}")
+    assert ok == len(jobs), "Todos os laudos deveriam ter sido gerados apesar das falhas transitórias"
+    assert STATE.max_in_flight <= max_concurrency, "O semáforo deveria limitar as requisições simultâneas"
+    assert len(STATE.connections) <= max_concurrency, "O pool deveria reaproveitar as conexões"
+
+    # --- 2. Chamada síncrona reaproveita o mesmo pool ---
+    connections_before = len(STATE.connections)
+    assert client.analisar_imagens(**jobs[0]) is not None
+    assert len(STATE.connections) == connections_before, "A chamada síncrona deveria usar uma conexão do pool"
+    print("✅ Chamada síncrona reaproveitou o pool de conexões")
+
+    # --- 3. Streaming (SSE): trechos chegam antes do fim do laudo ---
+    start = time.perf_counter()
+    first_piece_at = None
+    pieces = []
+    for piece in client.analisar_imagens_stream(**jobs[0]):
+        if first_piece_at is None:
+            first_piece_at = time.perf_counter() - start
+        pieces.append(piece)
+    total = time.perf_counter() - start
+    print(f"✅ Streaming: {len(pieces)} trechos, primeiro em {first_piece_at:.2f}s, total {total:.2f}s")
+    assert len(pieces) > 1 and "".join(pieces).startswith("Laudo de teste"), "O laudo deveria chegar em trechos"
+    assert first_piece_at < total, "O primeiro trecho deveria chegar antes do fim"
+
+    # --- 4. Prazo (deadline) respeitado com servidor lento ---
+    STATE.delay = (2.0, 2.0)
+    STATE.fail_every = 0
+    start = time.perf_counter()
+    result = client.analisar_imagens(**jobs[0], deadline=0.5)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Servidor lento: retorno em {elapsed:.2f}s (prazo 0.5s) -> {result!r}")
+    assert result is None and elapsed < 1.5, "A requisição deveria ser abandonada no fim do prazo"
+
+    client.close()
+    server.shutdown()
+    print("\n🏁 Todos os cenários passaram.")
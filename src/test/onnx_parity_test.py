@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import argparse
+from itertools import islice
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from models.vision_model_clip import CLIPAIModel        # noqa: E402
+from pipeline.scan import iter_image_paths              # noqa: E402
+
+SEG_PROMPT = "hand"
+
+
+def cold_start(**kwargs):
+    """Segundos do construtor até o fim do warm-up (carregamento + primeiro forward)."""
+    t0 = time.perf_counter()
+    model = CLIPAIModel(device="cpu", persist_outputs=False, **kwargs)
+    model.warmup()
+    return model, time.perf_counter() - t0
+
+
+def min_cosine(a, b):
+    a, b = a.float(), b.float()
+    return float(((a * b).sum(-1) / (a.norm(dim=-1) * b.norm(dim=-1))).min())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paridade do runtime ONNX com o PyTorch eager")
+    parser.add_argument("--images", nargs="+",
+                        default=[os.path.join("images", "inferences"), os.path.join("images", "experiment")])
+    parser.add_argument("--limit", type=int, default=64, help="Máximo de imagens no pipeline completo")
+    parser.add_argument("--precision", choices=["fp32", "int8"], default="fp32", help="Pacote ONNX testado")
+    parser.add_argument("--export-dir", default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-cosine", type=float, default=None,
+                        help="Similaridade mínima dos embeddings (padrão: 0.999 fp32, 0.98 int8)")
+    parser.add_argument("--max-mask-diff", type=float, default=None,
+                        help="Diferença máxima das máscaras do CLIPSeg (padrão: 0.01 fp32, 0.1 int8)")
+    parser.add_argument("--min-agreement", type=float, default=None,
+                        help="Concordância mínima de rótulo (padrão: 1.0 fp32, 0.97 int8)")
+    args = parser.parse_args()
+
+    fp32 = args.precision == "fp32"
+    min_cos = args.min_cosine if args.min_cosine is not None else (0.999 if fp32 else 0.98)
+    max_mask = args.max_mask_diff if args.max_mask_diff is not None else (0.01 if fp32 else 0.1)
+    min_agree = args.min_agreement if args.min_agreement is not None else (1.0 if fp32 else 0.97)
+
+    paths = list(islice((p for source in args.images for p in iter_image_paths(source)), args.limit))
+    if not paths:
+        sys.exit(f"❌ Nenhuma imagem em {args.images}")
+
+    # ONNX primeiro: a partida a frio é medida antes de o transformers ser importado pelo eager
+    onnx_model, onnx_start = cold_start(runtime="onnx", precision=args.precision, export_dir=args.export_dir)
+    eager_model, eager_start = cold_start(runtime="torch")
+
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"{'✅' if ok else '❌'} {name}: {detail}")
+        if not ok:
+            failures.append(name)
+
+    # 1. Pré-processamento (PIL/NumPy x processador do transformers)
+    sample = [eager_model._load_image(p)[0] for p in paths[:args.batch_size]]
+    eager_tuned, eager_base = eager_model._preprocess(sample)
+    onnx_tuned, _ = onnx_model._preprocess(sample)
+    print(f"ℹ️ Pré-processamento: diferença máx. dos pixels {float((eager_tuned - onnx_tuned).abs().max()):.4f} "
+          f"(resize do PIL x transformers)")
+
+    # 2. Grafos com os mesmos pixels de entrada
+    cos = min_cosine(eager_model._encode_images(eager_model.model_tuned, eager_tuned),
+                     onnx_model._encode_images(onnx_model.model_tuned, eager_tuned))
+    check("Tuned (visão)", cos >= min_cos, f"cosseno mínimo {cos:.5f} (limite {min_cos})")
+
+    base_pixels = eager_base if eager_base is not None else eager_tuned
+    cos = min_cosine(eager_model._encode_images(eager_model.model_base, base_pixels),
+                     onnx_model._encode_images(onnx_model.model_base, base_pixels))
+    check("Base (visão)", cos >= min_cos, f"cosseno mínimo {cos:.5f} (limite {min_cos})")
+
+    prompts = [[SEG_PROMPT]] * len(sample)
+    eager_masks = eager_model._generate_segmentation_batch(sample, prompts, upsample=False)
+    onnx_masks = onnx_model._generate_segmentation_batch(sample, prompts, upsample=False)
+    diff = max(float(np.abs(e - o).max()) for e, o in zip(eager_masks, onnx_masks))
+    check("CLIPSeg", diff <= max_mask, f"diferença máx. das máscaras {diff:.4f} (limite {max_mask})")
+
+    # 3. Pipeline completo nas imagens de exemplo
+    eager_results = eager_model.predict_batch(paths, batch_size=args.batch_size)
+    eager_rate = eager_model.last_batch_stats["images_per_sec"]
+    onnx_results = onnx_model.predict_batch(paths, batch_size=args.batch_size)
+    onnx_rate = onnx_model.last_batch_stats["images_per_sec"]
+
+    pairs = [(e, o) for e, o in zip(eager_results, onnx_results) if "error" not in e and "error" not in o]
+    agreement = sum(e["label"] == o["label"] for e, o in pairs) / len(pairs) if pairs else 0.0
+    delta_p = max((abs(e["probability"] - o["probability"]) for e, o in pairs if e["label"] == o["label"]),
+                  default=0.0)
+    same_concepts = sum(set(e["conceitos"]) == set(o["conceitos"]) for e, o in pairs) / len(pairs) if pairs else 0.0
+    check("Rótulos", agreement >= min_agree, f"concordância {agreement:.1%} em {len(pairs)} imagens")
+    print(f"ℹ️ |Δp| máx. {delta_p:.4f}, conceitos idênticos em {same_concepts:.1%}")
+
+    print(f"\n{'runtime':<8} {'partida (s)':>12} {'img/s':>8}")
+    print(f"{'torch':<8} {eager_start:12.1f} {eager_rate:8.2f}")
+    print(f"{'onnx':<8} {onnx_start:12.1f} {onnx_rate:8.2f}")
+
+    if failures:
+        print(f"\n❌ Paridade falhou: {failures}")
+        sys.exit(1)
+    print("\n✅ Runtime ONNX equivalente ao eager.")
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from pipeline.paths import overlay_filename, iter_image_paths      # noqa: E402
+
+
+if __name__ == "__main__":
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name} {detail}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory(prefix="megatruth_paths_") as root:
+        # O mesmo nome em pastas diferentes (como 00047_img.jpg em images/experiment e images/inferences)
+        for folder in ("experiment/real", "inferences/real"):
+            os.makedirs(os.path.join(root, folder))
+            open(os.path.join(root, folder, "00047_img.jpg"), "wb").close()
+
+        paths = list(iter_image_paths(os.path.join(root, "**", "*.jpg")))
+        names = [overlay_filename(p) for p in paths]
+        check("Scan encontra as duas imagens", len(paths) == 2, str(paths))
+        check("Overlays distintos", len(set(names)) == len(paths), str(names))
+        check("Nome estável", names == [overlay_filename(p) for p in paths])
+        check("Caminho relativo = absoluto",
+              overlay_filename(os.path.relpath(paths[0])) == names[0])
+        check("Nome legível", all(n.startswith("00047_img.jpg_") and n.endswith("_clipseg.png") for n in names))
+
+    if failures:
+        print(f"\n❌ Falhas: {failures}")
+        sys.exit(1)
+    print("\n✅ Nomes dos overlays OK.")
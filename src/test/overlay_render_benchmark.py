@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import multiprocessing as mp
+
+import numpy as np
+import cv2
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from models.vision_model_clip import CLIPAIModel  # noqa: E402
+
+
+def legacy_render_overlay(image, native_mask, overlay_color="red"):
+    """Renderizador anterior: máscara ampliada antes de tudo e mistura em float32 na resolução cheia."""
+    w, h = image.size
+    defect_map = cv2.resize(native_mask, (w, h))
+
+    defect_map_min = np.min(defect_map)
+    defect_map_max = np.max(defect_map)
+    if defect_map_max > defect_map_min:
+        defect_map = (defect_map - defect_map_min) / (defect_map_max - defect_map_min)
+    else:
+        defect_map = np.zeros_like(defect_map)
+    defect_map[defect_map < 0.35] = 0
+
+    k_size = int(min(h, w) * 0.03)
+    if k_size % 2 == 0:
+        k_size += 1
+    if k_size < 3:
+        k_size = 3
+    defect_map_smooth = cv2.GaussianBlur(defect_map, (k_size, k_size), 0)
+
+    img_np = np.array(image)
+    color_mask = np.zeros_like(img_np)
+    color_mask[:, :, {"green": 1, "blue": 2}.get(overlay_color, 0)] = 255
+
+    img_float = img_np.astype(np.float32) / 255.0
+    mask_float = color_mask.astype(np.float32) / 255.0
+    alpha = defect_map_smooth[:, :, None]
+    overlay = (mask_float * alpha * 0.6) + (img_float * (1.0 - (alpha * 0.3)))
+    return np.clip(overlay * 255, 0, 255).astype(np.uint8)
+
+
+RENDERERS = {
+    "legacy": legacy_render_overlay,
+    "novo": lambda image, mask, color="red": CLIPAIModel._render_overlay(image, mask, color),
+}
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.0 if sys.platform != "darwin" else peak / (1024.0 * 1024.0)
+
+
+def _run_case(impl, megapixels, repeats, queue):
+    """Roda em um processo separado para que o pico de RSS de um caso não contamine o outro."""
+    rng = np.random.default_rng(0)
+    w = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    image = Image.fromarray(rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8))
+    mask = rng.random((352, 352), dtype=np.float32)
+
+    render = RENDERERS[impl]
+    render(image, mask)  # aquecimento
+
+    tracemalloc.start()
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        render(image, mask)
+        latencies.append(time.perf_counter() - t0)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queue.put({
+        "impl": impl,
+        "megapixels": megapixels,
+        "resolution": f"{w}x{h}",
+        "latency_ms_p50": float(np.median(latencies) * 1000),
+        "traced_peak_mb": traced_peak / (1024 * 1024),
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara o renderizador de overlay antigo com o atual")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 12, 24])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print("=" * 60)
+    print("MEGATRUTH - BENCHMARK DO RENDERIZADOR DE OVERLAY")
+    print("=" * 60)
+
+    for mpx in args.megapixels:
+        for impl in RENDERERS:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run_case, args=(impl, mpx, args.repeats, queue))
+            proc.start()
+            r = queue.get()
+            proc.join()
+            rss = f"{r['peak_rss_mb']:.0f} MB" if r["peak_rss_mb"] is not None else "n/d"
+            print(
+                f"{r['resolution']:>11} ({mpx:>4.0f} MP) | {impl:<6} | "
+                f"p50 {r['latency_ms_p50']:8.1f} ms | alocado (pico) {r['traced_peak_mb']:7.1f} MB | RSS pico {rss}"
+            )
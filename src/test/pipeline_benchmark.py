@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from itertools import islice
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+sys.path.append(current_dir)
+
+from models.vision_model_clip import CLIPAIModel                   # noqa: E402
+from pipeline import image_io, telemetry                           # noqa: E402
+from pipeline.scan import iter_image_paths                         # noqa: E402
+
+STAGES = ("decode", "preprocess", "classify", "concepts", "segment", "overlay", "png_write", "llm")
+FALLBACK_SEG_PROMPT = "hand"  # Com --segment-all, imagens sem alvo visual também passam pelo CLIPSeg
+
+
+class StageTimer:
+    """Durações (s) de cada chamada por estágio, com o número de imagens da chamada."""
+
+    def __init__(self):
+        self.calls = {stage: [] for stage in STAGES}
+
+    def time(self, stage, n, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.calls[stage].append((time.perf_counter() - t0, n))
+        return out
+
+    def add(self, stage, seconds, n):
+        """Registra uma duração medida por fora (ex: span da telemetria)."""
+        self.calls[stage].append((seconds, n))
+
+    def summary(self):
+        out = {}
+        for stage, calls in self.calls.items():
+            if not calls:
+                continue
+            ms = np.array([d for d, _ in calls]) * 1000.0
+            images = sum(n for _, n in calls)
+            out[stage] = {
+                "calls": len(calls),
+                "images": images,
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)),
+                "mean_ms": float(ms.mean()),
+                "ms_per_image": float(ms.sum() / images) if images else None,
+            }
+        return out
+
+
+def peak_rss_mb():
+    # ru_maxrss é em KB no Linux (bytes no macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=src_dir, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def measure_load(clip):
+    """Tempo de carregamento de cada modelo e do warm-up (primeiro forward)."""
+    timings = {}
+    for name, loader in (("tuned", clip._load_tuned), ("base", clip._load_base),
+                         ("segment", clip._load_segmentation)):
+        t0 = time.perf_counter()
+        loader()
+        timings[name] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    clip.warmup()
+    timings["warmup"] = time.perf_counter() - t0
+    return timings
+
+
+def run_stages(clip, paths, batch_size, timer, out_dir, llm=None, segment_all=False):
+    """
+    Executa o pipeline estágio a estágio (mesmo caminho de _predict_loaded), cronometrando cada um.
+    Classificação e conceitos passam por score_pixels, então os conceitos só rodam nas imagens
+    suspeitas, como em produção; o tempo de cada parte vem dos spans da telemetria. Os estágios
+    por lote contam todas as imagens do lote, para o ms/img ser o custo médio real.
+    Returns:
+        int: Imagens suspeitas (as que passaram pelos conceitos).
+    """
+    spans = telemetry.telemetry.spans
+    suspects = 0
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        images = [timer.time("decode", 1, clip._load_image, p)[0] for p in chunk]
+        n = len(images)
+
+        pixels_tuned, pixels_base = timer.time("preprocess", n, clip._preprocess, images)
+
+        last_id = spans[-1]["id"] if spans else 0
+        scores = clip.score_pixels(pixels_tuned, pixels_base)
+        new_spans = [s for s in list(spans) if s["id"] > last_id]
+        for stage in ("classify", "concepts"):
+            # Sem suspeitas no lote, os conceitos custam 0 (como em produção)
+            timer.add(stage, sum(s["seconds"] for s in new_spans if s["stage"] == stage), n)
+        suspects += len(scores["suspects"])
+
+        probs = scores["class_probs"]
+        pred_idx = probs.argmax(axis=1)
+        found = [{} for _ in range(n)]
+        for i, row in zip(scores["suspects"], scores["concept_probs"]):
+            found[i] = clip._concepts_from_probs(row, clip.classes_eng[pred_idx[i]])
+
+        prompts = []
+        for c in found:
+            target = clip._visual_target(c) if c else None
+            prompts.append([target] if target else [FALLBACK_SEG_PROMPT] if segment_all else [])
+        masks = timer.time("segment", n, clip._generate_segmentation_batch, images, prompts, upsample=False)
+
+        for i, (image, mask) in enumerate(zip(images, masks)):
+            overlay = None
+            if mask is not None:
+                overlay = timer.time("overlay", 1, clip._render_overlay, image, mask, "red")
+
+                def write_png():
+                    with open(os.path.join(out_dir, f"overlay_{start + i}.png"), "wb") as f:
+                        f.write(image_io.encode_image(overlay, fmt="PNG"))
+                timer.time("png_write", 1, write_png)
+
+            if llm is not None:
+                label = int(pred_idx[i])
+                timer.time("llm", 1, llm.analisar_imagens, imagem_original=image,
+                           defect_map=overlay if overlay is not None else image,
+                           classificacao_clip=clip.classes_pt_map[clip.classes_eng[label]],
+                           probabilidade_clip=float(probs[i][label]),
+                           conceitos_detectados=dict(list(found[i].items())[:5]) or None)
+    return suspects
+
+
+def start_llm_stub(delay):
+    """Servidor local que imita o OpenRouter (sem falhas, latência fixa) e um NemotronVL apontado para ele."""
+    from nemotron_stub_server_test import ChatCompletionsStub, STATE
+    from models.multimodal_model_nemotron import NemotronVL
+
+    STATE.fail_every = 0
+    STATE.delay = (delay, delay)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionsStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.setdefault("OPENROUTER_API_KEY", "stub-key")
+    client = NemotronVL(base_url=f"http://127.0.0.1:{server.server_address[1]}/api/v1", timeout=10.0, deadline=30.0)
+    return server, client
+
+
+def compare(current, baseline, threshold):
+    """Imprime a variação em relação a um resultado anterior. Retorna a lista de regressões."""
+    regressions = []
+    print(f"\n📈 Comparação com {baseline['meta'].get('timestamp')} (commit {baseline['meta'].get('git')})")
+    for key in ("suspects", "segment_all"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            # Outro número de suspeitas muda o custo médio dos conceitos/CLIPSeg por imagem
+            print(f"ℹ️ {key} diferente: {baseline['meta'].get(key)} -> {current['meta'].get(key)}")
+    for stage, cur in current["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            change = (cur[key] - old[key]) / old[key] if old[key] else 0.0
+            flag = "❌" if change > threshold else "  "
+            print(f"{flag} {stage:<11} {key:<7} {old[key]:9.2f} -> {cur[key]:9.2f} ms ({change:+.1%})")
+            if change > threshold:
+                regressions.append(f"{stage} {key} {change:+.1%}")
+    for bs, cur in current["throughput"].items():
+        old = baseline.get("throughput", {}).get(bs)
+        if not old:
+            continue
+        change = (cur - old) / old
+        flag = "❌" if -change > threshold else "  "
+        print(f"{flag} lote {bs:<6} img/s   {old:9.2f} -> {cur:9.2f}    ({change:+.1%})")
+        if -change > threshold:
+            regressions.append(f"lote {bs} img/s {change:+.1%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do pipeline MegaTruth")
+    parser.add_argument("--images", nargs="+",
+                        default=[os.path.join("images", "inferences"), os.path.join("images", "experiment")])
+    parser.add_argument("--limit", type=int, default=64, help="Máximo de imagens (ordem fixa)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Lote da medição por estágio")
+    parser.add_argument("--throughput-batches", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--runtime", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--threads", type=int, default=None, help="Threads do PyTorch (padrão: do sistema)")
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="Latência fixa do stub do LLM (s)")
+    parser.add_argument("--no-llm", action="store_true", help="Não mede o estágio do LLM")
+    parser.add_argument("--segment-all", action="store_true",
+                        help="Passa todas as imagens pelo CLIPSeg (padrão: só as com alvo visual, como em produção)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSON de saída (padrão: outputs/benchmarks/bench_<data>.json)")
+    parser.add_argument("--compare", default=None, help="JSON de uma execução anterior")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Piora tolerada na comparação (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    paths = sorted(p for source in args.images for p in iter_image_paths(source))
+    paths = list(islice(paths, args.limit))
+    if not paths:
+        sys.exit(f"❌ Nenhuma imagem em {args.images}")
+
+    t0 = time.perf_counter()
+    clip = CLIPAIModel(device=args.device, persist_outputs=False, precision=args.precision, runtime=args.runtime)
+    init_s = time.perf_counter() - t0
+    load = measure_load(clip)
+    load["init"] = init_s
+
+    server = llm = None
+    if not args.no_llm:
+        server, llm = start_llm_stub(args.llm_delay)
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory(prefix="megatruth_bench_") as out_dir:
+        suspects = run_stages(clip, paths, args.batch_size, timer, out_dir, llm, args.segment_all)
+
+    throughput = {}
+    for bs in args.throughput_batches:
+        clip.predict_batch(paths, batch_size=bs)
+        throughput[str(bs)] = clip.last_batch_stats["images_per_sec"]
+
+    if llm is not None:
+        llm.close()
+        server.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "images": len(paths),
+            "sources": args.images,
+            "batch_size": args.batch_size,
+            "suspects": suspects,
+            "segment_all": args.segment_all,
+            "device": clip.device,
+            "precision": clip.precision,
+            "runtime": clip.runtime,
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpu": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "llm_stub_delay_s": None if args.no_llm else args.llm_delay,
+        },
+        "load_seconds": load,
+        "stages": timer.summary(),
+        "throughput": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"\n📊 {len(paths)} imagens ({suspects} suspeitas) | {clip.device} | {clip.runtime}/{clip.precision} | "
+          f"{torch.get_num_threads()} threads")
+    print("⏳ Carregamento: " + ", ".join(f"{k} {v:.2f}s" for k, v in load.items()))
+    print(f"\n{'estágio':<11} {'chamadas':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ms/img':>9}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<11} {s['calls']:>8} {s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['p99_ms']:9.2f} "
+              f"{s['ms_per_image']:9.2f}")
+    print("\n🚀 Vazão: " + ", ".join(f"lote {bs}: {v:.2f} img/s" for bs, v in throughput.items()))
+    print(f"🧠 Pico de RSS: {report['peak_rss_mb']:.0f} MB")
+
+    output = args.output or os.path.join("outputs", "benchmarks", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultado salvo em {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n❌ Regressões acima de {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
+        print("\n✅ Sem regressões acima do limite.")
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import cv2
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from models import model_registry                       # noqa: E402
+from models.vision_model_clip import CLIPAIModel        # noqa: E402
+from pipeline.scan import iter_image_paths              # noqa: E402
+
+AI_LABEL = "Imagem Gerada por IA"
+THUMB_SIDE = 256  # Overlays de referência guardados reduzidos para comparar sem estourar a memória
+
+
+def ground_truth(path):
+    """
+    Rótulo esperado a partir das pastas: IA/AI -> "ai", real -> "real".
+    Em erros/falso_positivo a imagem é real (o modelo disse IA) e em erros/falso_negativo é IA.
+    """
+    parts = [p.lower() for p in os.path.normpath(path).split(os.sep)]
+    if "falso_positivo" in parts:
+        return "real"
+    if "falso_negativo" in parts:
+        return "ai"
+    if "ia" in parts or "ai" in parts:
+        return "ai"
+    if "real" in parts:
+        return "real"
+    return None
+
+
+def _thumb(overlay):
+    if overlay is None:
+        return None
+    h, w = overlay.shape[:2]
+    scale = THUMB_SIDE / max(h, w)
+    return cv2.resize(overlay, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def run_precision(precision, paths, stages, batch_size):
+    """Roda o pipeline inteiro em CPU na precisão pedida. Retorna (img/s, resumo por imagem)."""
+    clip_model = CLIPAIModel(device="cpu", stages=stages, persist_outputs=False, precision=precision)
+    clip_model.warmup()
+    results = clip_model.predict_batch(paths, batch_size=batch_size)
+    rate = clip_model.last_batch_stats["images_per_sec"]
+
+    summary = []
+    for r in results:
+        if "error" in r:
+            summary.append(None)
+            continue
+        summary.append({
+            "label": "ai" if r["label"] == AI_LABEL else "real",
+            "p_ai": r["probabilities"][AI_LABEL],
+            "conceitos": set(r["conceitos"]),
+            "overlay": _thumb(r.get("overlay_image")),
+        })
+
+    # Libera os pesos antes da próxima precisão
+    del clip_model
+    model_registry.clear()
+    return rate, summary
+
+
+def compare(summary, reference, truths):
+    """Métricas de uma precisão contra a verdade (pastas) e contra a referência fp32."""
+    correct = labelled = agree = both = 0
+    deltas, jaccards, overlay_diffs = [], [], []
+    for cur, ref, truth in zip(summary, reference, truths):
+        if cur is None or ref is None:
+            continue
+        both += 1
+        agree += cur["label"] == ref["label"]
+        deltas.append(abs(cur["p_ai"] - ref["p_ai"]))
+        union = cur["conceitos"] | ref["conceitos"]
+        jaccards.append(len(cur["conceitos"] & ref["conceitos"]) / len(union) if union else 1.0)
+        if cur["overlay"] is not None and ref["overlay"] is not None and cur["overlay"].shape == ref["overlay"].shape:
+            overlay_diffs.append(np.abs(cur["overlay"].astype(np.int16) - ref["overlay"]).mean() / 255.0)
+        if truth is not None:
+            labelled += 1
+            correct += cur["label"] == truth
+
+    return {
+        "accuracy": correct / labelled if labelled else None,
+        "agreement": agree / both if both else None,
+        "mean_abs_delta_p": float(np.mean(deltas)) if deltas else None,
+        "max_abs_delta_p": float(np.max(deltas)) if deltas else None,
+        "concept_jaccard": float(np.mean(jaccards)) if jaccards else None,
+        "overlay_mean_diff": float(np.mean(overlay_diffs)) if overlay_diffs else None,
+    }
+
+
+def _fmt(value, pattern):
+    return pattern.format(value) if value is not None else "-"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Regressão de acurácia/velocidade das precisões de CPU (fp32 x bf16 x int8)"
+    )
+    parser.add_argument("--images", nargs="+",
+                        default=[os.path.join("images", "inferences"), os.path.join("images", "experiment")])
+    parser.add_argument("--precisions", nargs="+", choices=model_registry.PRECISIONS, default=["bf16", "int8"],
+                        help="Precisões comparadas com a referência fp32")
+    parser.add_argument("--stages", nargs="+", default=["classify", "concepts", "segment"])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Concordância mínima de rótulo com o fp32")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.02,
+                        help="Queda máxima de acurácia em relação ao fp32")
+    parser.add_argument("--json", default=None, help="Grava o relatório neste arquivo")
+    args = parser.parse_args()
+
+    paths = [p for source in args.images for p in iter_image_paths(source)]
+    if not paths:
+        sys.exit(f"❌ Nenhuma imagem em {args.images}")
+    truths = [ground_truth(p) for p in paths]
+    print(f"📊 {len(paths)} imagens ({sum(t is not None for t in truths)} com rótulo), estágios {args.stages}\n")
+
+    ref_rate, reference = run_precision("fp32", paths, args.stages, args.batch_size)
+    report = {"fp32": {"images_per_sec": ref_rate, "speedup": 1.0, **compare(reference, reference, truths)}}
+    for precision in args.precisions:
+        if precision == "fp32":
+            continue
+        rate, summary = run_precision(precision, paths, args.stages, args.batch_size)
+        report[precision] = {"images_per_sec": rate, "speedup": rate / ref_rate if ref_rate else None,
+                             **compare(summary, reference, truths)}
+
+    print(f"\n{'precisão':<9} {'img/s':>7} {'speedup':>8} {'acurácia':>9} {'concord.':>9} "
+          f"{'|Δp| méd':>9} {'|Δp| máx':>9} {'conceitos':>10} {'overlay Δ':>10}")
+    for precision, m in report.items():
+        print(f"{precision:<9} {m['images_per_sec']:7.2f} {_fmt(m['speedup'], '{:7.2f}x'):>8} "
+              f"{_fmt(m['accuracy'], '{:.1%}'):>9} {_fmt(m['agreement'], '{:.1%}'):>9} "
+              f"{_fmt(m['mean_abs_delta_p'], '{:.4f}'):>9} {_fmt(m['max_abs_delta_p'], '{:.4f}'):>9} "
+              f"{_fmt(m['concept_jaccard'], '{:.3f}'):>10} {_fmt(m['overlay_mean_diff'], '{:.4f}'):>10}")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Relatório salvo em {args.json}")
+
+    failed = []
+    ref_accuracy = report["fp32"]["accuracy"]
+    for precision, m in report.items():
+        if precision == "fp32":
+            continue
+        if m["agreement"] is not None and m["agreement"] < args.min_agreement:
+            failed.append(f"{precision}: concordância {m['agreement']:.1%} < {args.min_agreement:.1%}")
+        if ref_accuracy is not None and m["accuracy"] is not None \
+                and ref_accuracy - m["accuracy"] > args.max_accuracy_drop:
+            failed.append(f"{precision}: acurácia caiu {ref_accuracy - m['accuracy']:.1%}")
+
+    if failed:
+        print("\n❌ Regressão de acurácia:\n   " + "\n   ".join(failed))
+        sys.exit(1)
+    print("\n✅ Nenhuma regressão acima dos limites.")
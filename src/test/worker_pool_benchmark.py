@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+from itertools import islice
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from models.vision_model_clip import CLIPAIModel                               # noqa: E402
+from pipeline.scan import iter_image_paths                                     # noqa: E402
+from pipeline.worker_pool import WorkerPool, default_threads_per_worker        # noqa: E402
+
+
+def _process_counts(max_workers):
+    """1, 2, 4, ... até max_workers (incluído)."""
+    counts, n = [], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def _bench(clip_model, paths, processes, batch_size, threads_per_worker):
+    with WorkerPool(clip_model, processes=processes, batch_size=batch_size,
+                    threads_per_worker=threads_per_worker) as pool:
+        # Aquecimento: um lote por worker, fora da medição
+        for _ in pool.run(paths[: batch_size * processes]):
+            pass
+        memory = pool.memory_report()
+        start = time.perf_counter()
+        done = sum(len(batch) for batch in pool.run(paths))
+        elapsed = time.perf_counter() - start
+    return done / elapsed if elapsed > 0 else 0.0, memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Escalabilidade do WorkerPool (imagens/s de 1 a N processos)")
+    parser.add_argument("--images", default=os.path.join("images", "inferences"))
+    parser.add_argument("--limit", type=int, default=128, help="Máximo de imagens por rodada")
+    parser.add_argument("--max-workers", type=int, default=default_threads_per_worker(1))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Fixa as threads por processo (padrão: núcleos / processos)")
+    parser.add_argument("--stages", nargs="+", default=["classify", "concepts", "segment"])
+    args = parser.parse_args()
+
+    paths = list(islice(iter_image_paths(args.images), args.limit))
+    if not paths:
+        sys.exit(f"❌ Nenhuma imagem em {args.images}")
+
+    clip_model = CLIPAIModel(device="cpu", stages=args.stages, persist_outputs=False)
+    print(f"📊 {len(paths)} imagens, estágios {args.stages}, até {args.max_workers} processos\n")
+    print(f"{'proc':>5} {'thr':>4} {'img/s':>8} {'speedup':>8} {'efic.':>6} {'RSS MB':>9} {'PSS MB':>9}")
+
+    baseline = None
+    for processes in _process_counts(args.max_workers):
+        threads = args.threads_per_worker or default_threads_per_worker(processes)
+        rate, memory = _bench(clip_model, paths, processes, args.batch_size, threads)
+        baseline = baseline or rate
+        speedup = rate / baseline if baseline else 0.0
+        rss = f"{memory['rss_mb']:9.0f}" if memory else f"{'-':>9}"
+        pss = f"{memory['pss_mb']:9.0f}" if memory else f"{'-':>9}"
+        print(f"{processes:>5} {threads:>4} {rate:8.2f} {speedup:7.2f}x {speedup / processes:6.0%} {rss} {pss}")
+
+    print("\nRSS conta os pesos compartilhados em cada processo; PSS os divide entre eles "
+          "(próximo do uso real de memória).")
@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import threading
 from PIL import Image
 from dotenv import load_dotenv
 
@@ -18,40 +19,155 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from models.vision_model_clip import CLIPAIModel
 from models.multimodal_model_llava import LLaVAModel
 from models.multimodal_model_nemotron import NemotronVL
+from pipeline.result_cache import ResultCache, content_hash
+from pipeline.embedding_store import EmbeddingStore, DEFAULT_STORE_DIR
+from pipeline import telemetry
+from pipeline.explanation_cache import ExplanationCache, explanation_key, evidence_hash
+from pipeline.image_io import encode_image, to_pil, DISPLAY_MAX_SIDE
+from pipeline.hedging import HedgedRunner
+from pipeline.scheduler import MicroBatchScheduler, SchedulerFull
 
 # Carrega .env
 load_dotenv()
 
+# Por padrão a imagem e o overlay trafegam só em memória; MEGATRUTH_PERSIST_FILES=1 grava em disco
+PERSIST_FILES = os.getenv("MEGATRUTH_PERSIST_FILES", "0") == "1"
+# Em CPU: fp32 (padrão), bf16 ou int8
+PRECISION = os.getenv("MEGATRUTH_PRECISION", "fp32")
+# torch (padrão) ou onnx (pacote de `megatruth.py export`)
+RUNTIME = os.getenv("MEGATRUTH_RUNTIME", "torch")
+# Base de embeddings das imagens analisadas (vazio desativa)
+EMBEDDINGS_DIR = os.getenv("MEGATRUTH_EMBEDDINGS", DEFAULT_STORE_DIR)
+
 # Diretórios
-os.makedirs("images/uploaded", exist_ok=True)
-os.makedirs("outputs/defect_maps", exist_ok=True)
+if PERSIST_FILES:
+    os.makedirs("images/uploaded", exist_ok=True)
+    os.makedirs("outputs/defect_maps", exist_ok=True)
 
 # Instâncias globais
 clip_model = None
 llava_model = None
 nemotron_model = None
+result_cache = None
+embedding_store = None
+explanation_cache = None
+hedger = None
+scheduler = None
+# Sessões simultâneas chamam os get_* ao mesmo tempo: cada singleton é criado uma única vez
+_singleton_lock = threading.RLock()
+_llava_lock = threading.Lock()
+
+NEMOTRON_LABEL = "NVIDIA Nemotron-12B (Via API)"
+LLAVA_LABEL = "LLaVA-7B (Local Ollama)"
+# Estratégia entre Nemotron e LLaVA: "sequential", "race" ou "hedge" (ver pipeline/hedging.py)
+HEDGE_STRATEGY = os.getenv("MEGATRUTH_HEDGE_STRATEGY", "hedge")
+# Intervalo mínimo entre atualizações do laudo parcial na tela (streaming)
+STREAM_UPDATE_SECONDS = 0.1
+
+# Agendador de micro-lotes do CLIP e fila do Gradio
+MAX_BATCH_SIZE = int(os.getenv("MEGATRUTH_MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("MEGATRUTH_MAX_WAIT_MS", "20"))
+QUEUE_DEPTH = int(os.getenv("MEGATRUTH_QUEUE_DEPTH", "32"))
+CONCURRENCY = int(os.getenv("MEGATRUTH_CONCURRENCY", "8"))
+# Quanto um pedido espera por espaço na fila do agendador antes de ser recusado
+QUEUE_TIMEOUT_SECONDS = 5.0
 
 def get_clip():
     global clip_model
-    if clip_model is None:
-        print("🔄 Inicializando CLIP...")
-        clip_model = CLIPAIModel()
+    with _singleton_lock:
+        if clip_model is None:
+            print("🔄 Inicializando CLIP...")
+            # Overlay para exibição: cópia de trabalho limitada a DISPLAY_MAX_SIDE
+            clip_model = CLIPAIModel(persist_outputs=PERSIST_FILES, max_side=DISPLAY_MAX_SIDE,
+                                     precision=PRECISION, runtime=RUNTIME)
     return clip_model
 
 def get_llava():
     global llava_model
-    if llava_model is None:
-        print("🔄 Inicializando LLaVA via Ollama...")
-        llava_model = LLaVAModel()
+    # Lock próprio: o LLaVA pode demorar (download via Ollama) e não deve travar o CLIP
+    with _llava_lock:
+        if llava_model is None:
+            print("🔄 Inicializando LLaVA via Ollama...")
+            llava_model = LLaVAModel()
     return llava_model
 
 def get_nemotron():
     global nemotron_model
-    if nemotron_model is None:
-        print("🔄 Inicializando Cliente Nemotron...")
-        nemotron_model = NemotronVL()
+    with _singleton_lock:
+        if nemotron_model is None:
+            print("🔄 Inicializando Cliente Nemotron...")
+            nemotron_model = NemotronVL()
     return nemotron_model
 
+def get_result_cache():
+    global result_cache
+    with _singleton_lock:
+        if result_cache is None:
+            clip = get_clip()
+            # Resultados ficam separados por checkpoint/revisão/precisão/runtime/estágios
+            # para não servir saídas de outra versão do modelo
+            result_cache = ResultCache(namespace=clip.cache_namespace())
+    return result_cache
+
+def get_embedding_store():
+    global embedding_store
+    if not EMBEDDINGS_DIR:
+        return None
+    with _singleton_lock:
+        if embedding_store is None:
+            embedding_store = EmbeddingStore(EMBEDDINGS_DIR, namespace=get_clip().path_tuned)
+    return embedding_store
+
+def describe_similar(pil_image, result):
+    """Guarda a imagem na base de embeddings e descreve a quase-duplicata e as fakes conhecidas parecidas."""
+    store = get_embedding_store()
+    if store is None:
+        return ""
+    try:
+        key = content_hash(pil_image)
+        # Resultados vindos do cache não trazem o embedding: a imagem já está na base pela chave
+        item_id = store.add_result(result, key=key) if "embedding" in result else store.id_for_key(key)
+        if item_id is None:
+            return ""
+        vector = store.vector(item_id)
+
+        lines = []
+        duplicate = store.find_duplicate(vector, exclude=[item_id])
+        if duplicate:
+            lines.append(f"🔁 Quase-duplicata da imagem #{duplicate['id']} ({duplicate['similarity']:.1%}): "
+                         f"{duplicate['verdict'] or duplicate['label']}")
+        fakes = store.similar(vector, k=3, exclude=[item_id])
+        if fakes:
+            lines.append("🕵️ Fakes conhecidas semelhantes: " + ", ".join(
+                f"#{h['id']}{' ' + os.path.basename(h['path']) if h['path'] else ''} ({h['similarity']:.0%})"
+                for h in fakes))
+        return "\n".join(lines)
+    except Exception as e:
+        print(f"⚠️ Base de embeddings indisponível: {e}")
+        return ""
+
+def get_explanation_cache():
+    global explanation_cache
+    with _singleton_lock:
+        if explanation_cache is None:
+            explanation_cache = ExplanationCache()
+    return explanation_cache
+
+def get_hedger():
+    global hedger
+    with _singleton_lock:
+        if hedger is None:
+            hedger = HedgedRunner(strategy=HEDGE_STRATEGY)
+    return hedger
+
+def get_scheduler():
+    global scheduler
+    with _singleton_lock:
+        if scheduler is None:
+            scheduler = MicroBatchScheduler(get_clip(), max_batch_size=MAX_BATCH_SIZE,
+                                            max_wait_ms=MAX_WAIT_MS, queue_depth=QUEUE_DEPTH)
+    return scheduler
+
 def save_uploaded_image(img):
     """Salva imagem enviada no disco dentro da pasta 'images/uploaded'."""
     ts = int(time.time() * 1000)
@@ -71,8 +187,14 @@ def analyze_image(image, overlay_color):
         return None, "Erro", "Nenhuma imagem enviada", "", None, None
     
     try:
-        img_path = save_uploaded_image(image)
-        print(f"✅ Imagem salva em: {img_path}")
+        clip = get_clip()
+
+        # Cópia de trabalho: imagens enormes são reduzidas antes do hash, do modelo e do multimodal
+        pil_image = to_pil(image, max_side=clip.max_side)
+        img_path = None
+        if PERSIST_FILES:
+            img_path = save_uploaded_image(pil_image)
+            print(f"✅ Imagem salva em: {img_path}")
         
         # Mapeia nome amigável para código interno ('red', 'green', 'blue')
         color_map = {
@@ -82,16 +204,33 @@ def analyze_image(image, overlay_color):
         }
         selected_code = color_map.get(overlay_color, "red")
 
-        clip = get_clip()
-        print(f" Analisando com CLIP (Overlay: {selected_code})...")
-        
-        # Passa a cor para o modelo
-        result = clip.predict_with_defect_map(img_path, overlay_color=selected_code)
+        # --- Cache por conteúdo: a mesma imagem (ou uma recompressão/redimensionamento dela) não passa pelos modelos de novo ---
+        cache = get_result_cache()
+        cache_key = cache.make_key(pil_image, selected_code)
+        cached = cache.get(cache_key)
+
+        if cached is not None:
+            result, overlay_png = cached
+            print("⚡ Resultado recuperado do cache.")
+            overlay_image = to_pil(overlay_png) if overlay_png else None
+        else:
+            print(f" Analisando com CLIP (Overlay: {selected_code})...")
+
+            # Passa a imagem já decodificada (e o caminho, se persistida) e a cor para o agendador,
+            # que junta os envios simultâneos de várias sessões em um único forward
+            result = get_scheduler().predict((pil_image, img_path), overlay_color=selected_code,
+                                             queue_timeout=QUEUE_TIMEOUT_SECONDS)
+
+            overlay_image = result.get("overlay_image")
+            overlay_png = encode_image(overlay_image, fmt="PNG") if overlay_image is not None else None
+            cache.put(cache_key, result, overlay_png)
+
+        # Sem overlay gerado: o "overlay" é a própria imagem original
+        overlay = overlay_image if overlay_image is not None else pil_image
         
         label = result.get("label", "N/A")
         prob = result.get("probability", 0.0)
         conceitos = result.get("conceitos", {}) 
-        overlay_path = result.get("overlay_path", None)
         
         conceitos_text = ""
         if conceitos:
@@ -100,27 +239,35 @@ def analyze_image(image, overlay_color):
             conceitos_text = "Nenhum defeito específico detectado"
         
         status_msg = f"Análise CLIP concluída\n {label}\n Confiança: {prob:.2%}"
+        similares = describe_similar(pil_image, result)
+        if similares:
+            status_msg += f"\n\n{similares}"
         
-        return img_path, label, f"{prob:.2%}", conceitos_text, overlay_path, status_msg
+        return pil_image, label, f"{prob:.2%}", conceitos_text, overlay, status_msg
+
+    except SchedulerFull as e:
+        print(f"⚠️ {e}")
+        return None, "Erro", "Servidor ocupado", "", None, "⏳ Servidor ocupado com outras análises. Tente novamente em instantes."
 
     except Exception as e:
         print(f"Erro na análise: {e}")
         return None, "Erro", str(e), "", None, f"Erro: {str(e)}"
 
 
-def explain_with_multimodal(image_path, overlay_path, clip_label, clip_prob_str, conceitos_text, overlay_color):
+def explain_with_multimodal(image, overlay, clip_label, clip_prob_str, conceitos_text, overlay_color, force_refresh=False):
     """
         Gera explicação usando estratégia Híbrida:
-            1. Tenta Nemotron (Melhor qualidade, API).
-            2. Se falhar, usa LLaVA (Local, Fallback).
+            0. Reaproveita um laudo em cache para a mesma evidência (exceto com force_refresh).
+            1. Nemotron (Melhor qualidade, API) e LLaVA (Local) conforme MEGATRUTH_HEDGE_STRATEGY:
+               em sequência, em corrida ou com hedge guiado pela latência do Nemotron.
+            2. Vence o primeiro a produzir um token; o outro é cancelado.
+        É um gerador: produz o laudo parcial (com cabeçalho) à medida que os tokens chegam.
     """
 
     try:
-        if not image_path or not overlay_path:
-            return "Erro: Imagem ou overlay não disponível. Execute a análise CLIP primeiro."
-
-        if not os.path.exists(image_path) or not os.path.exists(overlay_path):
-            return "rro: Arquivos de imagem ou overlay não encontrados."
+        if image is None or overlay is None:
+            yield "Erro: Imagem ou overlay não disponível. Execute a análise CLIP primeiro."
+            return
 
         # --- 1. Preparar Dados (Parsing) ---
         # Limpar a probabilidade (remover %)
@@ -155,58 +302,81 @@ def explain_with_multimodal(image_path, overlay_path, clip_label, clip_prob_str,
             cor_real = "Azul"
         elif "Vermelho" in overlay_color:
             cor_real = "Vermelha"
+
+        # --- Cache de laudos: mesma imagem, overlay, classificação, conceitos e cor ---
+        cache = get_explanation_cache()
+        image_hash = evidence_hash(image)
+        overlay_hash = evidence_hash(overlay)
+
+        def cache_key(model_label):
+            return explanation_key(image_hash, overlay_hash, clip_label, prob_float, conceitos_dict, cor_real, model_label)
+
+        if not force_refresh:
+            for model_label in (NEMOTRON_LABEL, LLAVA_LABEL):
+                cached = cache.get(cache_key(model_label))
+                if cached:
+                    print(f"⚡ Laudo recuperado do cache ({model_label}).")
+                    header = f"🤖 **Modelo Utilizado:** {model_label} (cache)\n" + "="*40 + "\n\n"
+                    yield header + cached[0]
+                    return
     
-        # --- 2. TENTATIVA A: NEMOTRON (API) ---
-        try:
+        kwargs = dict(
+            imagem_original=image,
+            defect_map=overlay,
+            classificacao_clip=clip_label,
+            probabilidade_clip=prob_float,
+            conceitos_detectados=conceitos_dict if conceitos_dict else None,
+            color_overlay=cor_real
+        )
 
-            print("🚀 Tentando Nemotron-12B...")
-            nemotron = get_nemotron()
-            
-            response_text = nemotron.analisar_imagens(
-                imagem_original=image_path,
-                defect_map=overlay_path,
-                classificacao_clip=clip_label,
-                probabilidade_clip=prob_float,
-                conceitos_detectados=conceitos_dict if conceitos_dict else None,
-                color_overlay=cor_real
-            )
-            
-            if response_text:
-                model_used = "NVIDIA Nemotron-12B (Via API)"
-        except Exception as e:
-            print(f"⚠️ Nemotron falhou: {e}. Alternando para LLaVA...")
-
-        # --- 3. TENTATIVA B: LLAVA (Local) ---
-        if not response_text:
-            try:
-                print("🦙 Tentando LLaVA-7B (Local)...")
-                llava = get_llava()
-
-                response_text = llava.analisar_imagens(
-                    imagem_original=image_path,
-                    defect_map=overlay_path,
-                    classificacao_clip=clip_label,
-                    probabilidade_clip=prob_float,
-                    conceitos_detectados=conceitos_dict if conceitos_dict else None, 
-                    color_overlay=cor_real
-                )
-                if response_text:
-                    model_used = "LLaVA-7B (Local Ollama)"
+        start = time.perf_counter()
 
-            except Exception as e:
-                return f"rro Crítico: Ambos os modelos falharam.\nNemotron: (Vide logs)\nLLaVA: {str(e)}"
+        # --- 2. Nemotron (API) e LLaVA (Local) segundo a estratégia de hedge ---
+        # sequential: LLaVA só após falha do Nemotron | race: os dois juntos |
+        # hedge: LLaVA também entra se o Nemotron passar do p90 do tempo até o primeiro token
+        backends = [
+            (NEMOTRON_LABEL, lambda cancel: get_nemotron().analisar_imagens_stream(**kwargs, cancel_event=cancel)),
+            (LLAVA_LABEL, lambda cancel: get_llava().analisar_imagens_stream(**kwargs, cancel_event=cancel)),
+        ]
+        hedger = get_hedger()
+        yield f"⏳ Gerando laudo (estratégia: {hedger.strategy})..."
+
+        text = ""
+        last_update = 0.0
+        try:
+            for label, piece in hedger.stream(backends):
+                if not text:
+                    print(f"⏱️ Primeiro token ({label}) em {time.perf_counter() - start:.2f}s")
+                    model_used = label
+                text += piece
+                response_text = text
+                # Atualiza a tela no máx. a cada STREAM_UPDATE_SECONDS
+                if time.perf_counter() - last_update >= STREAM_UPDATE_SECONDS:
+                    last_update = time.perf_counter()
+                    yield f"🤖 **Modelo Utilizado:** {model_used}\n" + "="*40 + "\n\n" + text
+            if text:
+                yield f"🤖 **Modelo Utilizado:** {model_used}\n" + "="*40 + "\n\n" + text
+        except Exception as e:
+            if response_text:
+                # Falha no meio do laudo: mantém o texto parcial (não vai para o cache)
+                print(f"⚠️ {model_used} interrompido: {e}")
+                yield f"🤖 **Modelo Utilizado:** {model_used}\n" + "="*40 + "\n\n" + response_text + "\n\n⚠️ *Laudo interrompido.*"
+                return
+            yield f"rro Crítico: Ambos os modelos falharam.\n{str(e)}"
+            return
 
         # --- 4. Resultado Final ---
         if response_text:
-            header = f"🤖 **Modelo Utilizado:** {model_used}\n" + "="*40 + "\n\n"
-            return header + response_text
+            print(f"✅ Laudo completo ({model_used}) em {time.perf_counter() - start:.2f}s")
+            print(f"📊 Tempo até o primeiro token: { {k: h.summary() for k, h in hedger.histograms.items()} }")
+            cache.put(cache_key(model_used), response_text, model_used)
 
         else:
-            return "Erro desconhecido: O modelo retornou uma resposta vazia."
+            yield "Erro desconhecido: O modelo retornou uma resposta vazia."
 
     except Exception as e:
         print(f"Erro geral: {e}")
-        return f"Erro ao gerar explicação: {str(e)}"
+        yield f"Erro ao gerar explicação: {str(e)}"
 
 
 def build_ui():
@@ -356,6 +526,10 @@ def build_ui():
             size="lg",
             variant="primary"
         )
+        force_refresh_box = gr.Checkbox(
+            value=False,
+            label="Forçar nova geração do laudo (ignorar cache)"
+        )
         
         # Indicador de carregamento
         # loading_indicator = gr.HTML(
@@ -370,38 +544,40 @@ def build_ui():
         
         # ========== LÓGICA DE EVENTOS ==========
         
-        state_image_path = gr.State(value=None)
-        state_overlay_path = gr.State(value=None)
+        # Imagem e overlay ficam em memória na sessão (PIL/NumPy), sem ida e volta ao disco
+        state_image = gr.State(value=None)
+        state_overlay = gr.State(value=None)
         state_label = gr.State(value="")
         state_prob = gr.State(value="")
         state_conceitos = gr.State(value="")
         
         # --- ATUALIZAÇÃO 3: Passa o valor da cor para a função ---
         def on_analyze(image, color):
-            img_path, label, prob, conceitos, overlay_path, status = analyze_image(image, color)
+            img, label, prob, conceitos, overlay, status = analyze_image(image, color)
             
             
-            return img_path, overlay_path, label, prob, conceitos, overlay_path, status, label, prob, conceitos, "Clique em 'Gerar Laudo'..."
+            return img, overlay, label, prob, conceitos, overlay, status, label, prob, conceitos, "Clique em 'Gerar Laudo'..."
         
         analyze_btn.click(
             fn=on_analyze,
             inputs=[image_input, color_selector], # Adicionado o input de cor
             outputs=[
-                state_image_path, state_overlay_path, state_label, state_prob, state_conceitos,
+                state_image, state_overlay, state_label, state_prob, state_conceitos,
                 defect_map_display, status_display, label_display, prob_display, conceitos_display, explanation_display
             ]
         )
         
-        def on_explain(img_path, overlay_path, label, prob, conceitos, color):
-            if not img_path or not overlay_path:
-                return "⚠️ Erro: Execute a análise visual primeiro."
+        def on_explain(img, overlay, label, prob, conceitos, color, force_refresh):
+            if img is None or overlay is None:
+                yield "⚠️ Erro: Execute a análise visual primeiro."
+                return
             
-            result = explain_with_multimodal(img_path, overlay_path, label, prob, conceitos, overlay_color=color)
-            return result
+            # Gerador: o laudo aparece no explanation_display à medida que é escrito
+            yield from explain_with_multimodal(img, overlay, label, prob, conceitos, overlay_color=color, force_refresh=force_refresh)
         
         explain_btn.click(
             fn=on_explain,
-            inputs=[state_image_path, state_overlay_path, state_label, state_prob, state_conceitos, color_selector],
+            inputs=[state_image, state_overlay, state_label, state_prob, state_conceitos, color_selector, force_refresh_box],
             outputs=[explanation_display]
         )
     
@@ -409,6 +585,8 @@ def build_ui():
 
 if __name__ == "__main__":
     app = build_ui()
+    # MEGATRUTH_METRICS_FILE / MEGATRUTH_TRACE_FILE: métricas e spans em arquivo
+    telemetry.configure_from_env()
     print("\n" + "="*60)
     print("🚀 MegaTruth Interface Iniciada")
     print("="*60)
@@ -416,6 +594,9 @@ if __name__ == "__main__":
     # Caminho do favicon
     favicon_path = os.path.join(os.path.dirname(__file__), "..", "..", "images", "logo", "logo_mega_truth.png")
     
+    # Fila do Gradio: até CONCURRENCY eventos em paralelo; o agendador agrupa as análises em lotes
+    app.queue(default_concurrency_limit=CONCURRENCY, max_size=QUEUE_DEPTH * 2)
+
     app.launch(
         server_name="127.0.0.1",
         server_port=7860,